@@ -9,56 +9,2092 @@ Output: The base branch name (or error message to stderr with exit 1)
 """
 
 import argparse
+import asyncio
+import contextlib
+import ctypes
+import fcntl
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import os
+import re
+import selectors
+import shlex
+import signal
+import socket
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from typing import Callable, Iterable, Iterator, NamedTuple
 
 DEBUG = False
 
+# Most git processes one query may run at once (--git-jobs)
+GIT_JOBS = 1
+
+# Whether commits may be read from the object files directly rather
+# than through git cat-file (--no-object-reader turns this off)
+READ_OBJECTS = True
+
 # Remotes to consider, in priority order
 PREFERRED_REMOTES = ["origin", "upstream", "github"]
 
 # Branch names that are typically "main" branches (not feature branches)
 DEFAULT_BRANCH_NAMES = ["develop", "dev", "main", "master"]
 
+# Resolved base branches are cached in this file in the git directory;
+# entries are evicted after CACHE_MAX_AGE seconds or beyond the newest
+# CACHE_MAX_ENTRIES.
+CACHE_FILE = "find-merge-base-cache.json"
+CACHE_MAX_ENTRIES = 64
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+# Trees under refs/ whose loose refs affect the answer: local and remote
+# branches, and tags, which can change how a branch name is shortened
+REF_TREES = ["heads", "remotes", "tags"]
+
+# --fetch is skipped if FETCH_HEAD is younger than this many seconds
+FETCH_MAX_AGE = 60
+
+# A --serve daemon listens on this socket in the git directory, exits
+# after DAEMON_IDLE_TIMEOUT seconds without queries, and waits for
+# DAEMON_SETTLE seconds of quiet after a ref change before recomputing.
+# Without inotify it polls for ref changes every DAEMON_POLL_INTERVAL.
+DAEMON_SOCKET = "find-merge-base.sock"
+DAEMON_IDLE_TIMEOUT = 30 * 60
+DAEMON_SETTLE = 0.1
+DAEMON_POLL_INTERVAL = 1.0
+# How long a client waits for the daemon before answering by itself
+DAEMON_CLIENT_TIMEOUT = 30.0
+
+
+# Hooks installed by --install-hooks recompute the answer in the
+# background after ref changes and store it in PRECOMPUTED_FILE in the
+# git directory, where --cached-only reads it without running git.
+# Runs queue behind each other on PRECOMPUTED_LOCK.
+PRECOMPUTED_FILE = "find-merge-base-result.json"
+PRECOMPUTED_LOCK = "find-merge-base-result.lock"
+HOOK_NAMES = ["post-checkout", "post-merge", "post-rewrite", "reference-transaction"]
+HOOK_MARKER = "# Installed by find-merge-base.py --install-hooks"
+
+
+# Per-thread buffer for debug messages from concurrently run strategies
+_debug_buffer = threading.local()
+
 
 def debug(msg: str) -> None:
-    """Print debug message to stderr if debug mode is enabled."""
+    """Print debug message to stderr if debug mode is enabled.
+
+    Inside a concurrently evaluated strategy the message is buffered
+    instead, so it can be replayed in strategy priority order.
+    """
     if DEBUG:
-        print(f"[debug] {msg}", file=sys.stderr)
+        lines = getattr(_debug_buffer, "lines", None)
+        if lines is not None:
+            lines.append(msg)
+        else:
+            print(f"[debug] {msg}", file=sys.stderr)
+
 
+class Tracer:
+    """Records every git invocation for ``--trace``.
 
-def run_git(*args: str) -> str | None:
+    Each event has the git argv, its kind (``run`` for a one-shot
+    process, ``spawn`` for starting a long-lived one, ``query`` for a
+    round trip on a cat-file pipe and ``stream`` for reading rev-list
+    output), wall time, exit status, bytes of output, and the strategy
+    and branch being worked on when it happened.  Strategy runs are
+    recorded as spans, so git time can be set against Python time.
+    """
+
+    def __init__(self) -> None:
+        self.events: list[dict] = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._context = threading.local()
+        self._threads: dict[int, int] = {}
+
+    def _record(self, event: dict) -> None:
+        with self._lock:
+            thread = self._threads.setdefault(threading.get_ident(), len(self._threads))
+            self.events.append(dict(event, thread=thread))
+
+    def _now(self) -> float:
+        return time.perf_counter() - self._origin
+
+    @contextlib.contextmanager
+    def scope(self, strategy: str | None = None, branch: str | None = None):
+        """Attribute git calls in this block to a strategy and/or branch.
+
+        Entering a strategy also records a span covering the block.
+        """
+        saved = dict(vars(self._context))
+        if strategy is not None:
+            self._context.strategy = strategy
+            self._context.branch = None
+        if branch is not None:
+            self._context.branch = branch
+        start = self._now()
+        try:
+            yield
+        finally:
+            if strategy is not None:
+                self._record(
+                    {
+                        "type": "strategy",
+                        "strategy": strategy,
+                        "start": start,
+                        "seconds": self._now() - start,
+                    }
+                )
+            vars(self._context).clear()
+            vars(self._context).update(saved)
+
+    @contextlib.contextmanager
+    def git(self, kind: str, argv: list[str]):
+        """Time one git call; the caller fills in status and bytes."""
+        call = {"status": None, "bytes": 0}
+        start = self._now()
+        try:
+            yield call
+        finally:
+            self._record(
+                {
+                    "type": "git",
+                    "kind": kind,
+                    "argv": ["git", *argv],
+                    "start": start,
+                    "seconds": self._now() - start,
+                    "status": call["status"],
+                    "bytes": call["bytes"],
+                    "strategy": getattr(self._context, "strategy", None),
+                    "branch": getattr(self._context, "branch", None),
+                }
+            )
+
+    def summary(self) -> dict[str, dict]:
+        """Total, git and Python time per strategy, plus git call counts."""
+        totals: dict[str, dict] = {}
+        for event in self.events:
+            name = event["strategy"] or "(none)"
+            entry = totals.setdefault(
+                name,
+                {"seconds": 0.0, "git_seconds": 0.0, "processes": 0, "queries": 0},
+            )
+            if event["type"] == "strategy":
+                entry["seconds"] += event["seconds"]
+                continue
+            entry["git_seconds"] += event["seconds"]
+            if event["kind"] in ("run", "spawn"):
+                entry["processes"] += 1
+            else:
+                entry["queries"] += 1
+        for entry in totals.values():
+            entry["python_seconds"] = max(0.0, entry["seconds"] - entry["git_seconds"])
+        return totals
+
+    def print_summary(self) -> None:
+        print("[trace] strategy                      total      git   python  "
+              "procs queries", file=sys.stderr)
+        for name, entry in self.summary().items():
+            print(
+                f"[trace] {name:28} {entry['seconds'] * 1000:7.1f}ms "
+                f"{entry['git_seconds'] * 1000:7.1f}ms "
+                f"{entry['python_seconds'] * 1000:7.1f}ms "
+                f"{entry['processes']:5} {entry['queries']:7}",
+                file=sys.stderr,
+            )
+
+    def write(self, path: str, fmt: str) -> None:
+        """Write the events as JSON lines or a Chrome trace-event file."""
+        with open(path, "w") as f:
+            if fmt == "jsonl":
+                for event in self.events:
+                    f.write(json.dumps(event) + "\n")
+                f.write(json.dumps({"type": "summary", **self.summary()}) + "\n")
+                return
+            trace_events = []
+            for event in self.events:
+                if event["type"] == "strategy":
+                    name, category, args = event["strategy"], "strategy", {}
+                else:
+                    name = " ".join(event["argv"][:3])
+                    category = f"git.{event['kind']}"
+                    args = {
+                        key: event[key]
+                        for key in ["argv", "status", "bytes", "strategy", "branch"]
+                    }
+                trace_events.append(
+                    {
+                        "name": name,
+                        "cat": category,
+                        "ph": "X",
+                        "ts": round(event["start"] * 1e6, 1),
+                        "dur": round(event["seconds"] * 1e6, 1),
+                        "pid": os.getpid(),
+                        "tid": event["thread"],
+                        "args": args,
+                    }
+                )
+            json.dump(
+                {"traceEvents": trace_events, "otherData": self.summary()}, f
+            )
+
+
+# The active tracer, set by --trace
+TRACER: Tracer | None = None
+
+# Stand-ins used when tracing is off, so traced calls cost next to nothing
+_UNTRACED_SCOPE = contextlib.nullcontext()
+_UNTRACED_CALL = contextlib.nullcontext({"status": None, "bytes": 0})
+
+
+def trace_scope(strategy: str | None = None, branch: str | None = None):
+    """Attribute git calls in a block to a strategy and/or branch."""
+    return TRACER.scope(strategy, branch) if TRACER else _UNTRACED_SCOPE
+
+
+def trace_git(kind: str, *argv: str):
+    """Time a git call when tracing; yields a dict for status and bytes."""
+    return TRACER.git(kind, list(argv)) if TRACER else _UNTRACED_CALL
+
+
+def run_git(*args: str, cwd: str | None = None) -> str | None:
     """Run a git command and return stdout, or None on failure."""
-    try:
+    with trace_git("run", *args) as call:
         result = subprocess.run(
             ["git", *args],
             capture_output=True,
             text=True,
-            check=True,
+            check=False,
+            cwd=cwd,
+        )
+        call["status"] = result.returncode
+        if TRACER:
+            call["bytes"] = len(result.stdout.encode())
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+
+async def run_git_async(
+    *args: str,
+    cwd: str | None = None,
+    input: bytes | None = None,
+    note: str | None = None,
+) -> bytes | None:
+    """Run a git command without blocking the event loop.
+
+    Returns the raw stdout, or None on failure.  ``note`` is appended
+    to the traced argv to describe ``input``.
+    """
+    traced = [*args, note] if note else args
+    with trace_git("run", *traced) as call:
+        proc = await asyncio.create_subprocess_exec(
+            "git",
+            *args,
+            stdin=subprocess.DEVNULL if input is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=cwd,
         )
-        return result.stdout.strip()
-    except subprocess.CalledProcessError:
+        stdout, _ = await proc.communicate(input)
+        call["status"] = proc.returncode
+        call["bytes"] = len(stdout)
+    if proc.returncode != 0:
         return None
+    return stdout
+
+
+def run_git_many(
+    calls: list[tuple[list[str], bytes | None, str | None]],
+    cwd: str | None = None,
+    limit: int = 1,
+) -> list[bytes | None]:
+    """Run ``(args, input, note)`` git calls, at most ``limit`` at a time.
+
+    Results come back in the order of ``calls``, however the processes
+    happen to finish.
+    """
+
+    async def run_all() -> list[bytes | None]:
+        semaphore = asyncio.Semaphore(limit)
 
+        async def run_one(args: list[str], input: bytes | None, note: str | None):
+            async with semaphore:
+                return await run_git_async(*args, cwd=cwd, input=input, note=note)
 
-def get_remote_branches() -> list[str]:
-    """Get list of remote branch refs (e.g., origin/main)."""
-    output = run_git("branch", "-r", "--format=%(refname:short)")
+        return await asyncio.gather(*(run_one(*call) for call in calls))
+
+    return asyncio.run(run_all())
+
+
+class Cancelled(Exception):
+    """Raised inside a GitSession whose work is no longer wanted."""
+
+
+class Commit(NamedTuple):
+    """The parts of a commit object needed for ancestry walks."""
+
+    timestamp: int
+    parents: tuple[str, ...]
+
+
+# Flags used by the in-process ancestry walks, mirroring git's own
+# commit-reach.c (merge-base) and revision.c (rev-list limiting).
+PARENT1 = 1 << 0
+PARENT2 = 1 << 1
+STALE = 1 << 2
+RESULT = 1 << 3
+UNINTERESTING = 1 << 4
+SEEN = 1 << 5
+
+# Number of extra all-uninteresting commits to walk before trusting
+# commit dates to end a range walk (same value as git's revision.c).
+SLOP = 5
+
+# Names sent down the --batch-check pipe before reading answers back;
+# small enough that neither pipe buffer can fill and deadlock.
+RESOLVE_CHUNK = 256
+
+# Extra lines of HEAD's ancestry to read past the oldest commit asked
+# for, so range walks that dip just below it stay in memory.
+ANCESTRY_READAHEAD = 256
+
+# Fewest tips worth giving their own rev-list when a bulk load is
+# split over several concurrent git processes.
+REV_LIST_SHARD_MIN = 64
+
+# Above this many distinct merge-bases, distances come from memoized
+# per-commit ancestor counts rather than one range walk per merge-base.
+DIRECT_DISTANCE_LIMIT = 8
+
+# Generation of commits missing from the commit-graph, as in git
+GENERATION_INFINITY = 1 << 64
+
+# Object types as numbered in pack files, and the two delta kinds
+OBJECT_TYPES = {1: "commit", 2: "tree", 3: "blob", 4: "tag"}
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+# Objects from delta chains an ObjectStore keeps for reuse as bases
+OBJECT_CACHE_SIZE = 256
+
+# Longest delta chain followed before a pack is taken to be corrupt
+MAX_DELTA_CHAIN = 10000
+
+# commit-graph parent slot meaning "no parent", and the flag marking a
+# second-parent slot or GDA2 entry as an index into an overflow chunk
+GRAPH_PARENT_NONE = 0x70000000
+GRAPH_OVERFLOW = 0x80000000
+
+# core.commitGraph = false in a config file
+COMMIT_GRAPH_DISABLED = re.compile(
+    r"^\s*commitgraph\s*=\s*(false|no|off|0)\s*$", re.I | re.M
+)
+
+
+def discover_git_dirs(cwd: str | None = None) -> tuple[str, str] | None:
+    """Find the git dir and common git dir by walking up from ``cwd``.
+
+    Handles ``.git`` directories, ``.git`` files pointing elsewhere
+    (worktrees, submodules) and ``commondir`` links.  Returns None when
+    git's own discovery is needed: environment overrides, bare
+    repositories, or no ``.git`` found.
+    """
+    if any(os.environ.get(var) for var in ["GIT_DIR", "GIT_COMMON_DIR"]):
+        return None
+
+    directory = os.path.abspath(cwd or os.getcwd())
+    while True:
+        dot_git = os.path.join(directory, ".git")
+        git_dir = None
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+        elif os.path.isfile(dot_git):
+            content = read_git_file(dot_git) or ""
+            if content.startswith("gitdir: "):
+                git_dir = os.path.join(directory, content.removeprefix("gitdir: "))
+        if git_dir and os.path.isfile(os.path.join(git_dir, "HEAD")):
+            git_dir = os.path.normpath(git_dir)
+            common = read_git_file(os.path.join(git_dir, "commondir"))
+            common_dir = os.path.normpath(os.path.join(git_dir, common or "."))
+            return git_dir, common_dir
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def locate_git_dirs(cwd: str | None = None) -> tuple[str, str] | None:
+    """Return the absolute git dir and common git dir, or None outside a repo."""
+    found = discover_git_dirs(cwd)
+    if found:
+        return found
+    output = run_git("rev-parse", "--absolute-git-dir", "--git-common-dir", cwd=cwd)
     if not output:
-        return []
-    return [b.strip() for b in output.splitlines() if b.strip()]
+        return None
+    git_dir, common_dir = output.splitlines()
+    return git_dir, os.path.abspath(os.path.join(cwd or os.getcwd(), common_dir))
 
 
-def try_upstream() -> tuple[str | None, str | None]:
+def read_git_file(path: str) -> str | None:
+    """Read a small file from the git directory, or None if absent."""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def stat_signature(path: str) -> list[int] | None:
+    """Identify a file's current version without reading it.
+
+    git replaces ref files by renaming a lockfile over them, so the
+    inode changes on every update even within one mtime tick.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_ino, st.st_mtime_ns, st.st_size]
+
+
+# How many symbolic refs to follow before giving up, as git does
+MAX_SYMREF_DEPTH = 5
+
+# Rules git tries before refs/remotes/ when shortening a ref name; if
+# any of them names an existing ref, "origin/x" would be ambiguous.
+SHORT_NAME_RULES = ["{}", "refs/{}", "refs/tags/{}", "refs/heads/{}"]
+
+# Config section header, e.g. [remote "origin"]
+CONFIG_SECTION = re.compile(r'^\s*\[\s*([\w.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+
+
+class PackedRefs:
+    """The refs in a ``packed-refs`` file, read in place.
+
+    The file is memory-mapped.  When git wrote it sorted (as every git
+    since 2.15 does, saying so in its header), a ref or the start of a
+    prefix is found by binary search over the lines, so nothing outside
+    the refs asked for is read; an unsorted file is parsed once.
+    """
+
+    def __init__(self, data: bytes | mmap.mmap) -> None:
+        self.data = data
+        self.start = 0
+        traits: list[bytes] = []
+        if data[:17] == b"# pack-refs with:":
+            end = data.find(b"\n")
+            self.start = len(data) if end < 0 else end + 1
+            traits = data[17 : self.start].split()
+        self.sorted = b"sorted" in traits
+        self._parsed: dict[bytes, str] | None = None
+
+    @classmethod
+    def open(cls, path: str) -> "PackedRefs":
+        """Map the file at ``path``; a missing or empty one has no refs."""
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except OSError:
+            pass
+        return cls(b"")
+
+    def _line(self, pos: int) -> tuple[bytes, bytes, int]:
+        """Return the name and value on the line at ``pos``, and the next line."""
+        end = self.data.find(b"\n", pos)
+        if end < 0:
+            end = len(self.data)
+        sha, _, name = self.data[pos:end].partition(b" ")
+        return name, sha, end + 1
+
+    def _seek(self, key: bytes) -> int:
+        """Offset of the first ref line whose name is not below ``key``."""
+        data = self.data
+        lo, hi = self.start, len(data)
+        while lo < hi:
+            pos = max(lo, data.rfind(b"\n", lo, (lo + hi) // 2) + 1)
+            if data[pos : pos + 1] == b"^":
+                pos = max(lo, data.rfind(b"\n", lo, pos - 1) + 1)
+            name, _, end = self._line(pos)
+            if name < key:
+                lo = end
+                while data[lo : lo + 1] == b"^":
+                    lo = self._line(lo)[2]
+            else:
+                hi = pos
+        return lo
+
+    def _parse(self) -> dict[bytes, str]:
+        if self._parsed is None:
+            self._parsed = {}
+            pos = self.start
+            while pos < len(self.data):
+                name, sha, pos = self._line(pos)
+                if name and sha[:1] not in (b"#", b"^"):
+                    self._parsed[name] = sha.decode()
+        return self._parsed
+
+    def get(self, name: str) -> str | None:
+        """Return the value packed for a ref, if any."""
+        key = name.encode()
+        if not self.sorted:
+            return self._parse().get(key)
+        pos = self._seek(key)
+        if pos < len(self.data):
+            found, sha, _ = self._line(pos)
+            if found == key:
+                return sha.decode()
+        return None
+
+    def items(self, prefix: bytes) -> Iterator[tuple[bytes, str]]:
+        """Yield (name, value) of the packed refs under ``prefix``, in order."""
+        if not self.sorted:
+            refs = self._parse().items()
+            yield from sorted(item for item in refs if item[0].startswith(prefix))
+            return
+        pos = self._seek(prefix)
+        while pos < len(self.data):
+            name, sha, pos = self._line(pos)
+            if sha[:1] == b"^":
+                continue
+            if not name.startswith(prefix):
+                return
+            yield name, sha.decode()
+
+
+class RefStore:
+    """Reads refs straight from the files git keeps them in.
+
+    Understands loose refs, ``packed-refs``, symbolic refs and the
+    per-worktree ``HEAD`` of a worktree whose refs live in the common
+    dir.  Repositories using another ref backend (reftable) are not
+    supported; use :meth:`open`, which returns None for those so
+    callers fall back to git.
+    """
+
+    def __init__(self, git_dir: str, common_dir: str) -> None:
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self._packed: PackedRefs | None = None
+
+    @classmethod
+    def open(cls, cwd: str | None = None) -> "RefStore | None":
+        """Return a RefStore for the repository at ``cwd`` if supported."""
+        dirs = discover_git_dirs(cwd)
+        if not dirs:
+            return None
+        store = cls(*dirs)
+        return store if store.supported() else None
+
+    def supported(self) -> bool:
+        """Whether refs are stored in the files backend this reads."""
+        if os.path.exists(os.path.join(self.common_dir, "reftable")):
+            return False
+        if not os.path.isdir(os.path.join(self.common_dir, "refs")):
+            return False
+        config = read_git_file(os.path.join(self.common_dir, "config")) or ""
+        return not re.search(r"^\s*refstorage\s*=", config, re.I | re.M)
+
+    def _path(self, name: str) -> str:
+        """Return the loose file for a ref (HEAD is per worktree)."""
+        if name == "HEAD" or not name.startswith("refs/"):
+            return os.path.join(self.git_dir, name)
+        return os.path.join(self.common_dir, name)
+
+    def packed(self) -> "PackedRefs":
+        """Return the repository's packed-refs, opened once per RefStore."""
+        if self._packed is None:
+            self._packed = PackedRefs.open(os.path.join(self.common_dir, "packed-refs"))
+        return self._packed
+
+    def read_raw(self, name: str) -> str | None:
+        """Return a ref's stored value: a sha or ``ref: <target>``."""
+        loose = read_git_file(self._path(name))
+        if loose is not None and not os.path.isdir(self._path(name)):
+            return loose
+        return self.packed().get(name)
+
+    def symbolic_ref(self, name: str) -> str | None:
+        """Return the target of a symbolic ref, like git symbolic-ref."""
+        value = self.read_raw(name)
+        if value and value.startswith("ref: "):
+            return value.removeprefix("ref: ").strip()
+        return None
+
+    def resolve(self, name: str) -> str | None:
+        """Return the sha a ref points to, following symbolic refs."""
+        for _ in range(MAX_SYMREF_DEPTH):
+            value = self.read_raw(name)
+            if not value:
+                return None
+            if not value.startswith("ref: "):
+                return value if is_object_id(value) else None
+            name = value.removeprefix("ref: ").strip()
+        return None
+
+    def current_branch(self) -> str:
+        """Return the checked-out branch, or "" when HEAD is detached."""
+        target = self.symbolic_ref("HEAD") or ""
+        if not target.startswith("refs/heads/"):
+            return ""
+        return target.removeprefix("refs/heads/")
+
+    def refs(self, prefix: str) -> list[str]:
+        """List the full names of refs under ``prefix``, sorted as git does."""
+        return [name for name, _ in self.iter_refs(prefix)]
+
+    def iter_refs(self, prefix: str) -> Iterator[tuple[str, str]]:
+        """Yield (full name, sha) of the refs under ``prefix`` in git's order.
+
+        Packed refs are read in place from the prefix onwards and merged
+        with the loose refs under it, so only one remote's refs need be
+        looked at and none are held once yielded.  Loose refs shadow
+        packed ones; broken and dangling refs are skipped, like git
+        for-each-ref.
+        """
+        loose = []
+        top = self._path(prefix.rstrip("/"))
+        for root, dirs, files in os.walk(top):
+            for file in files:
+                if not file.endswith(".lock"):
+                    path = os.path.join(root, file)
+                    name = os.path.relpath(path, self.common_dir)
+                    loose.append((name.replace(os.sep, "/").encode(), None))
+        loose.sort()
+        previous = None
+        packed = self.packed().items(prefix.encode())
+        for key, sha in heapq.merge(loose, packed, key=lambda item: item[0]):
+            if key == previous:
+                continue
+            previous = key
+            name = key.decode()
+            if sha is None or not is_object_id(sha):
+                sha = self.resolve(name)
+            if sha:
+                yield name, sha
+
+    def exists(self, name: str) -> bool:
+        return self.resolve(name) is not None
+
+    def short_name(self, name: str) -> str:
+        """Shorten a refs/remotes/ name as %(refname:short) does."""
+        short = name.removeprefix("refs/remotes/")
+        if any(self.exists(rule.format(short)) for rule in SHORT_NAME_RULES):
+            return name.removeprefix("refs/")
+        return short
+
+    def remote_branches(self) -> list[str]:
+        """Short names of all remote-tracking refs, like git branch -r."""
+        return [self.short_name(name) for name in self.refs("refs/remotes/")]
+
+    def iter_remote_branches(self, remote: str) -> Iterator[str]:
+        """Yield short names of one remote's tracking refs, as git does.
+
+        Only ``refs/remotes/<remote>/`` is read.  Names are checked for
+        clashes one by one only if something outside it could shadow
+        them, i.e. a ref or file named after the remote.
+        """
+        prefix = f"refs/remotes/{remote}/"
+        shadowed = any(
+            os.path.exists(self._path(rule.format(remote)))
+            or next(self.packed().items(rule.format(remote).encode() + b"/"), None)
+            for rule in SHORT_NAME_RULES
+        )
+        for name, _ in self.iter_refs(prefix):
+            if shadowed:
+                yield self.short_name(name)
+            else:
+                yield name.removeprefix("refs/remotes/")
+
+    def remotes(self) -> list[str] | None:
+        """Names of configured remotes, or None if git must be asked.
+
+        Reads remote sections from the repository, global and system
+        config plus legacy remotes/ and branches/ files; configs using
+        include directives need git's own parser.
+        """
+        names: set[str] = set()
+        for path in config_paths(self.common_dir):
+            try:
+                with open(path) as f:
+                    lines = f.readlines()
+            except (OSError, UnicodeDecodeError):
+                continue
+            section = subsection = None
+            for line in lines:
+                match = CONFIG_SECTION.match(line)
+                if match:
+                    section = match.group(1).lower()
+                    subsection = match.group(2)
+                    if section.startswith("include"):
+                        return None
+                    rest = line[match.end() :].strip()
+                else:
+                    rest = line.strip()
+                if (
+                    rest
+                    and rest[0] not in "#;"
+                    and section == "remote"
+                    and subsection is not None
+                ):
+                    names.add(re.sub(r"\\(.)", r"\1", subsection))
+        for legacy in ["remotes", "branches"]:
+            with contextlib.suppress(OSError):
+                listing = os.listdir(os.path.join(self.common_dir, legacy))
+                names.update(listing)
+        return sorted(names, key=lambda name: name.encode())
+
+
+def config_paths(common_dir: str) -> list[str]:
+    """Config files git reads for a repository, lowest precedence first."""
+    paths = []
+    if not os.environ.get("GIT_CONFIG_NOSYSTEM"):
+        paths.append(os.environ.get("GIT_CONFIG_SYSTEM") or "/etc/gitconfig")
+    if os.environ.get("GIT_CONFIG_GLOBAL"):
+        paths.append(os.environ["GIT_CONFIG_GLOBAL"])
+    else:
+        xdg = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+        paths.append(os.path.join(xdg, "git", "config"))
+        paths.append(os.path.expanduser("~/.gitconfig"))
+    paths.append(os.path.join(common_dir, "config"))
+    return paths
+
+
+def is_object_id(value: str) -> bool:
+    return len(value) in (40, 64) and all(c in "0123456789abcdef" for c in value)
+
+
+class CommitGraph:
+    """Read-only view of a repository's commit-graph file or chain.
+
+    The files are memory-mapped and entries decoded on demand, so
+    looking a commit up costs a fanout read and a binary search, with
+    nothing parsed up front.  Positions are global across the layers of
+    a split chain, as in git.  Use :meth:`open`, which returns None
+    when there is no usable graph or git itself would ignore it.
+    """
+
+    def __init__(self, paths: list[str]) -> None:
+        self.layers: list[dict] = []
+        for path in paths:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.layers.append(self._parse(data))
+        self._starts = []
+        total = 0
+        for layer in self.layers:
+            self._starts.append(total)
+            total += layer["count"]
+        # Corrected commit dates are only used if every layer has them.
+        self.has_generation_data = all("GDA2" in layer for layer in self.layers)
+
+    @classmethod
+    def open(cls, common_dir: str, refs: RefStore | None) -> "CommitGraph | None":
+        """Load the repository's commit-graph, or None if unusable."""
+        for name in ["shallow", "info/grafts"]:
+            if os.path.exists(os.path.join(common_dir, name)):
+                return None
+        if refs is None or refs.refs("refs/replace/"):
+            return None
+        config = read_git_file(os.path.join(common_dir, "config")) or ""
+        if COMMIT_GRAPH_DISABLED.search(config):
+            return None
+
+        info = os.path.join(common_dir, "objects", "info")
+        paths = [os.path.join(info, "commit-graph")]
+        if not os.path.exists(paths[0]):
+            graphs = os.path.join(info, "commit-graphs")
+            chain = read_git_file(os.path.join(graphs, "commit-graph-chain"))
+            if not chain:
+                return None
+            paths = [
+                os.path.join(graphs, f"graph-{line}.graph") for line in chain.split()
+            ]
+        try:
+            return cls(paths)
+        except (OSError, ValueError, struct.error):
+            return None
+
+    @staticmethod
+    def _parse(data: mmap.mmap) -> dict:
+        """Locate the chunks of one commit-graph file."""
+        signature, version, hash_version, chunks, _ = struct.unpack_from(
+            ">4sBBBB", data
+        )
+        if signature != b"CGPH" or version != 1 or hash_version not in (1, 2):
+            raise ValueError("unsupported commit-graph")
+        layer: dict = {"data": data, "hash_len": 20 if hash_version == 1 else 32}
+        table = [
+            struct.unpack_from(">4sQ", data, 8 + 12 * i) for i in range(chunks + 1)
+        ]
+        for (chunk_id, offset), _ in zip(table, table[1:]):
+            layer[chunk_id.decode("ascii", "replace")] = offset
+        for required in ["OIDF", "OIDL", "CDAT"]:
+            if required not in layer:
+                raise ValueError(f"commit-graph without {required} chunk")
+        layer["fanout"] = struct.unpack_from(">256L", data, layer["OIDF"])
+        layer["count"] = layer["fanout"][255]
+        return layer
+
+    def _layer(self, pos: int) -> tuple[dict, int]:
+        """Return the layer holding global position ``pos``, and its index."""
+        for layer, start in zip(reversed(self.layers), reversed(self._starts)):
+            if pos >= start:
+                return layer, pos - start
+        raise ValueError(f"commit-graph position {pos} out of range")
+
+    def position(self, sha: str) -> int | None:
+        """Return a commit's global position, or None if not in the graph."""
+        oid = bytes.fromhex(sha)
+        for layer, start in zip(self.layers, self._starts):
+            if len(oid) != layer["hash_len"]:
+                return None
+            data, size, fanout = layer["data"], layer["hash_len"], layer["fanout"]
+            lo = fanout[oid[0] - 1] if oid[0] else 0
+            hi = fanout[oid[0]]
+            base = layer["OIDL"]
+            index = bisect_left(
+                range(lo, hi),
+                oid,
+                key=lambda i: data[base + i * size : base + (i + 1) * size],
+            )
+            index += lo
+            found = data[base + index * size : base + (index + 1) * size]
+            if index < hi and found == oid:
+                return start + index
+        return None
+
+    def oid(self, pos: int) -> str:
+        layer, index = self._layer(pos)
+        size = layer["hash_len"]
+        start = layer["OIDL"] + index * size
+        return layer["data"][start : start + size].hex()
+
+    def entry(self, pos: int) -> tuple[int, int, tuple[int, ...]]:
+        """Return (commit time, topological level, parent positions)."""
+        layer, index = self._layer(pos)
+        data = layer["data"]
+        offset = layer["CDAT"] + index * (layer["hash_len"] + 16) + layer["hash_len"]
+        first, second, level_hi, time_lo = struct.unpack_from(">LLLL", data, offset)
+        timestamp = ((level_hi & 3) << 32) | time_lo
+        parents: list[int] = []
+        if first != GRAPH_PARENT_NONE:
+            parents.append(first)
+        if second & GRAPH_OVERFLOW:
+            edge = layer["EDGE"] + 4 * (second & ~GRAPH_OVERFLOW)
+            while True:
+                (value,) = struct.unpack_from(">L", data, edge)
+                parents.append(value & ~GRAPH_OVERFLOW)
+                if value & GRAPH_OVERFLOW:
+                    break
+                edge += 4
+        elif second != GRAPH_PARENT_NONE:
+            parents.append(second)
+        return timestamp, level_hi >> 2, tuple(parents)
+
+    def generation(self, pos: int, timestamp: int) -> int:
+        """Return the corrected commit date git orders walks by."""
+        layer, index = self._layer(pos)
+        data = layer["data"]
+        (offset,) = struct.unpack_from(">L", data, layer["GDA2"] + 4 * index)
+        if offset & GRAPH_OVERFLOW:
+            (offset,) = struct.unpack_from(
+                ">Q", data, layer["GDO2"] + 8 * (offset & ~GRAPH_OVERFLOW)
+            )
+        return timestamp + offset
+
+
+class ObjectStore:
+    """Read-only access to the object files of a repository.
+
+    Loose objects are inflated with zlib.  Packed ones are looked up in
+    each pack's memory-mapped version 2 ``.idx`` and read from its
+    memory-mapped ``.pack``, following offset and ref deltas.  The last
+    OBJECT_CACHE_SIZE objects met on delta chains are kept in an LRU,
+    so commits sharing a delta base are cheap to read.  An object this cannot read
+    (from an alternate, a promisor remote or a format it does not know)
+    is reported as None, for callers to ask git instead.  Use
+    :meth:`open`, which returns None when git would see objects
+    differently, e.g. through replace refs.
+    """
+
+    def __init__(self, objects_dir: str, hash_len: int) -> None:
+        self.objects_dir = objects_dir
+        self.hash_len = hash_len
+        self._packs: list[dict] = []
+        self._pack_names: set[str] = set()
+        self._cache: OrderedDict[tuple[int, int], tuple[int, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._scan_packs()
+
+    @classmethod
+    def open(cls, common_dir: str, refs: RefStore | None) -> "ObjectStore | None":
+        """Open the repository's object directory, or None if unusable."""
+        overrides = ["GIT_OBJECT_DIRECTORY", "GIT_ALTERNATE_OBJECT_DIRECTORIES"]
+        if any(os.environ.get(var) for var in overrides):
+            return None
+        if refs is None or refs.refs("refs/replace/"):
+            return None
+        objects_dir = os.path.join(common_dir, "objects")
+        if not os.path.isdir(objects_dir):
+            return None
+        config = read_git_file(os.path.join(common_dir, "config")) or ""
+        sha256 = re.search(r"^\s*objectformat\s*=\s*sha256\s*$", config, re.I | re.M)
+        try:
+            return cls(objects_dir, 32 if sha256 else 20)
+        except OSError:
+            return None
+
+    def _scan_packs(self) -> bool:
+        """Map packs not seen before; return whether any were found."""
+        pack_dir = os.path.join(self.objects_dir, "pack")
+        try:
+            names = sorted(os.listdir(pack_dir))
+        except OSError:
+            return False
+        found = False
+        for name in names:
+            if not name.endswith(".idx") or name in self._pack_names:
+                continue
+            self._pack_names.add(name)
+            try:
+                self._packs.append(self._map_pack(os.path.join(pack_dir, name)))
+                found = True
+            except (OSError, ValueError, struct.error):
+                continue
+        return found
+
+    def _map_pack(self, idx_path: str) -> dict:
+        """Map one pack and its index, checking both are a known version."""
+        maps = []
+        for path in [idx_path, idx_path.removesuffix(".idx") + ".pack"]:
+            with open(path, "rb") as f:
+                maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        idx, data = maps
+        if idx[:8] != b"\377tOc\0\0\0\2":
+            raise ValueError("unsupported pack index")
+        if data[:4] != b"PACK" or struct.unpack_from(">L", data, 4)[0] not in (2, 3):
+            raise ValueError("unsupported pack")
+        fanout = struct.unpack_from(">256L", idx, 8)
+        count = fanout[255]
+        names = 8 + 256 * 4
+        offsets = names + count * (self.hash_len + 4)
+        return {
+            "id": len(self._packs),
+            "idx": idx,
+            "data": data,
+            "fanout": fanout,
+            "names": names,
+            "offsets": offsets,
+            "large": offsets + count * 4,
+        }
+
+    def read(self, sha: str) -> tuple[str, bytes] | None:
+        """Return an object's type and contents, or None if not readable."""
+        try:
+            oid = bytes.fromhex(sha)
+            if len(oid) != self.hash_len:
+                return None
+            with self._lock:
+                found = self._find(oid)
+                if found is None:
+                    loose = self._read_loose(sha)
+                    if loose or not self._scan_packs():
+                        return loose
+                    found = self._find(oid)
+                    if found is None:
+                        return None
+                kind, data = self._unpack(*found)
+            return OBJECT_TYPES[kind], data
+        except (ValueError, KeyError, IndexError, struct.error, zlib.error):
+            return None
+
+    def _read_loose(self, sha: str) -> tuple[str, bytes] | None:
+        path = os.path.join(self.objects_dir, sha[:2], sha[2:])
+        try:
+            with open(path, "rb") as f:
+                raw = zlib.decompress(f.read())
+        except OSError:
+            return None
+        header, _, body = raw.partition(b"\0")
+        kind, size = header.decode().split()
+        if int(size) != len(body):
+            raise ValueError(f"corrupt loose object {sha}")
+        return kind, body
+
+    def _find(self, oid: bytes) -> tuple[dict, int] | None:
+        """Return the pack holding an object and its offset there."""
+        size = self.hash_len
+        for pack in self._packs:
+            idx, fanout, base = pack["idx"], pack["fanout"], pack["names"]
+            lo = fanout[oid[0] - 1] if oid[0] else 0
+            hi = fanout[oid[0]]
+            while lo < hi:
+                mid = (lo + hi) // 2
+                start = base + mid * size
+                if idx[start : start + size] < oid:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            start = base + lo * size
+            if idx[start : start + size] == oid:
+                (offset,) = struct.unpack_from(">L", idx, pack["offsets"] + 4 * lo)
+                if offset & 0x80000000:
+                    large = pack["large"] + 8 * (offset & 0x7FFFFFFF)
+                    (offset,) = struct.unpack_from(">Q", idx, large)
+                return pack, offset
+        return None
+
+    def _unpack(self, pack: dict, offset: int) -> tuple[int, bytes]:
+        """Read the packed object at ``offset``, applying any deltas."""
+        deltas = []
+        while True:
+            cached = self._cache.get((pack["id"], offset))
+            if cached:
+                self._cache.move_to_end((pack["id"], offset))
+                kind, data = cached
+                break
+            if len(deltas) > MAX_DELTA_CHAIN:
+                raise ValueError("delta chain too long")
+            kind, size, pos = self._entry_header(pack["data"], offset)
+            if kind == OBJ_OFS_DELTA:
+                distance, pos = self._base_distance(pack["data"], pos)
+                deltas.append((pack, offset, pos, size))
+                offset -= distance
+            elif kind == OBJ_REF_DELTA:
+                base = pack["data"][pos : pos + self.hash_len]
+                deltas.append((pack, offset, pos + self.hash_len, size))
+                found = self._find(base)
+                if found is None:
+                    raise ValueError("delta base not in any pack")
+                pack, offset = found
+            else:
+                data = self._inflate(pack["data"], pos, size)
+                if deltas:
+                    self._remember(pack, offset, kind, data)
+                break
+        for pack, offset, pos, size in reversed(deltas):
+            data = apply_delta(data, self._inflate(pack["data"], pos, size))
+            self._remember(pack, offset, kind, data)
+        return kind, data
+
+    def _remember(self, pack: dict, offset: int, kind: int, data: bytes) -> None:
+        self._cache[pack["id"], offset] = (kind, data)
+        if len(self._cache) > OBJECT_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _entry_header(data: mmap.mmap, pos: int) -> tuple[int, int, int]:
+        """Return a pack entry's type, inflated size and data offset."""
+        byte = data[pos]
+        kind, size, shift = (byte >> 4) & 7, byte & 15, 4
+        while byte & 0x80:
+            pos += 1
+            byte = data[pos]
+            size |= (byte & 0x7F) << shift
+            shift += 7
+        return kind, size, pos + 1
+
+    @staticmethod
+    def _base_distance(data: mmap.mmap, pos: int) -> tuple[int, int]:
+        """Decode an offset delta's distance back to its base."""
+        byte = data[pos]
+        distance = byte & 0x7F
+        while byte & 0x80:
+            pos += 1
+            byte = data[pos]
+            distance = ((distance + 1) << 7) | (byte & 0x7F)
+        return distance, pos + 1
+
+    @staticmethod
+    def _inflate(data: mmap.mmap, pos: int, size: int) -> bytes:
+        """Inflate ``size`` bytes from the zlib stream at ``pos``."""
+        # Deflate rarely grows data by more than a few bytes per block,
+        # so one read almost always holds the whole stream.
+        step = size + 64
+        with contextlib.suppress(zlib.error):
+            result = zlib.decompress(data[pos : pos + step])
+            if len(result) == size:
+                return result
+        stream = zlib.decompressobj()
+        parts = []
+        while not stream.eof:
+            chunk = data[pos : pos + step]
+            if not chunk:
+                raise ValueError("truncated pack entry")
+            parts.append(stream.decompress(chunk))
+            pos += step
+        result = b"".join(parts)
+        if len(result) != size:
+            raise ValueError("pack entry has the wrong size")
+        return result
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """Rebuild an object from its delta base and a git delta."""
+    pos = 0
+    sizes = []
+    for _ in range(2):
+        size = shift = 0
+        while True:
+            byte = delta[pos]
+            pos += 1
+            size |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        sizes.append(size)
+    if sizes[0] != len(base):
+        raise ValueError("delta does not apply to this base")
+
+    parts = []
+    end = len(delta)
+    while pos < end:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            # Copy from the base: offset and size bytes as flagged
+            start = length = 0
+            for i in range(4):
+                if op & (1 << i):
+                    start |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    length |= delta[pos] << (8 * i)
+                    pos += 1
+            parts.append(base[start : start + (length or 0x10000)])
+        elif op:
+            parts.append(delta[pos : pos + op])
+            pos += op
+        else:
+            raise ValueError("reserved delta opcode")
+    result = b"".join(parts)
+    if len(result) != sizes[1]:
+        raise ValueError("delta produced the wrong size")
+    return result
+
+
+class GitSession:
+    """A reusable connection to one repository's git plumbing.
+
+    Object name lookups are sent through one long-lived
+    ``git cat-file --batch-check`` process.  Commits are read straight
+    from the object files by an ObjectStore where it can, and otherwise
+    through one ``git cat-file --batch`` process.  Merge-base and
+    distance queries are answered in-process from the commits read,
+    and one-shot commands are memoized, so the number of git processes
+    in a run does not grow with the number of branches examined.
+    """
+
+    def __init__(self, cwd: str | None = None) -> None:
+        self.cwd = cwd
+        self._spawned = 0
+        self._forks: list[GitSession] = []
+        self._cancelled = threading.Event()
+        self._pipes: dict[str, subprocess.Popen] = {}
+        self._results: dict[tuple[str, ...], str | None] = {}
+        self._resolved: dict[str, str | None] = {}
+        self._commits: dict[str, Commit | None] = {}
+        self._ancestry: subprocess.Popen | None = None
+        self._refs: list[RefStore | None] = []
+        self._graph: list[CommitGraph | None] = []
+        self._objects: list[ObjectStore | None] = []
+        self._levels: dict[str, int] = {}
+        self._generations: dict[str, int] = {}
+
+    @property
+    def refs(self) -> RefStore | None:
+        """The repository's refs read from disk, or None to ask git."""
+        if not self._refs:
+            self._refs.append(RefStore.open(self.cwd))
+        return self._refs[0]
+
+    @property
+    def graph(self) -> CommitGraph | None:
+        """The repository's commit-graph, or None if it has none."""
+        if not self._graph:
+            refs = self.refs
+            graph = CommitGraph.open(refs.common_dir, refs) if refs else None
+            self._graph.append(graph)
+        return self._graph[0]
+
+    @property
+    def objects(self) -> ObjectStore | None:
+        """The repository's object files, or None to read commits via git."""
+        if not self._objects:
+            refs = self.refs
+            objects = None
+            if refs and READ_OBJECTS:
+                objects = ObjectStore.open(refs.common_dir, refs)
+            self._objects.append(objects)
+        return self._objects[0]
+
+    @property
+    def spawned(self) -> int:
+        """Number of git processes started by this session and its forks."""
+        return self._spawned + sum(fork.spawned for fork in self._forks)
+
+    def fork(self) -> "GitSession":
+        """Return a session with its own processes but shared caches.
+
+        Forks let several threads query git in parallel while still
+        sharing everything already learnt about the repository.
+        """
+        fork = GitSession(self.cwd)
+        fork._results = self._results
+        fork._resolved = self._resolved
+        fork._commits = self._commits
+        fork._refs = self._refs
+        fork._graph = self._graph
+        fork._objects = self._objects
+        fork._levels = self._levels
+        fork._generations = self._generations
+        self._forks.append(fork)
+        return fork
+
+    def renew(self) -> "GitSession":
+        """Return a fresh session that keeps only immutable knowledge.
+
+        Commits, their levels and generations never change, so a
+        long-lived caller can carry them over after refs have moved,
+        while everything that depends on refs starts over.
+        """
+        renewed = GitSession(self.cwd)
+        renewed._commits = self._commits
+        renewed._levels = self._levels
+        renewed._generations = self._generations
+        return renewed
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        """Abandon this session's work from another thread.
+
+        Its batch processes are killed so blocked reads return, and
+        every later query raises Cancelled.
+        """
+        self._cancelled.set()
+        for proc in [*self._pipes.values(), self._ancestry]:
+            if proc:
+                proc.kill()
+
+    def _check_cancelled(self) -> None:
+        # Queries check on their own; in-process walks check once per
+        # step, so a cancelled strategy stops instead of running on
+        if self._cancelled.is_set():
+            raise Cancelled
+
+    def __enter__(self) -> "GitSession":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shut down any batch processes started by this session."""
+        if self._ancestry:
+            self._ancestry.kill()
+            self._ancestry.wait()
+            if self._ancestry.stdout:
+                self._ancestry.stdout.close()
+            self._ancestry = None
+        for proc in self._pipes.values():
+            if proc.stdin:
+                with contextlib.suppress(OSError):
+                    proc.stdin.close()
+            proc.wait()
+            if proc.stdout:
+                proc.stdout.close()
+        self._pipes.clear()
+
+    def run(self, *args: str) -> str | None:
+        """Run a read-only git command once and memoize its output."""
+        if args not in self._results:
+            self._check_cancelled()
+            self._spawned += 1
+            output = run_git(*args, cwd=self.cwd)
+            self._check_cancelled()
+            self._results[args] = output
+        return self._results[args]
+
+    def lines(self, *args: str) -> Iterator[str]:
+        """Run a read-only git command, yielding its output line by line.
+
+        Unlike :meth:`run` nothing is memoized, so output too large to
+        keep is never held in full.
+        """
+        self._check_cancelled()
+        self._spawned += 1
+        with trace_git("run", *args) as call:
+            with subprocess.Popen(
+                ["git", *args],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                cwd=self.cwd,
+                text=True,
+            ) as proc:
+                assert proc.stdout
+                for line in proc.stdout:
+                    call["bytes"] += len(line)
+                    yield line.rstrip("\n")
+            call["status"] = proc.returncode
+
+    def _pipe(self, mode: str) -> subprocess.Popen:
+        """Return the cat-file process for ``mode``, starting it if needed."""
+        self._check_cancelled()
+        proc = self._pipes.get(mode)
+        if proc is None:
+            self._spawned += 1
+            with trace_git("spawn", "cat-file", mode):
+                proc = subprocess.Popen(
+                    ["git", "cat-file", mode],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    cwd=self.cwd,
+                )
+            self._pipes[mode] = proc
+        return proc
+
+    def _query(self, mode: str, name: str) -> tuple[list[str], bytes | None]:
+        """Send one object name down a cat-file pipe.
+
+        Returns the header fields and, for ``--batch``, the object body.
+        A header of ``[name, "missing"]`` (or similar) means the name
+        did not resolve.
+        """
+        proc = self._pipe(mode)
+        assert proc.stdin and proc.stdout
+        with trace_git("query", "cat-file", mode, name) as call:
+            try:
+                proc.stdin.write(name.encode() + b"\n")
+                proc.stdin.flush()
+            except OSError:
+                self._check_cancelled()
+                raise
+            header = self._read_header(proc)
+            body = None
+            if mode == "--batch" and len(header) == 3:
+                body = proc.stdout.read(int(header[2]) + 1)[:-1]
+            call["status"] = 0 if len(header) == 3 else 1
+            call["bytes"] = len(body or b"")
+        return header, body
+
+    def _read_header(self, proc: subprocess.Popen) -> list[str]:
+        """Read one cat-file response header, failing loudly on EOF."""
+        assert proc.stdout
+        header = proc.stdout.readline().decode().split()
+        if not header:
+            self._check_cancelled()
+            raise RuntimeError("git cat-file exited unexpectedly")
+        return header
+
+    def resolve(self, rev: str) -> str | None:
+        """Resolve a revision to the commit it points at, or None."""
+        if rev not in self._resolved:
+            header, _ = self._query("--batch-check", f"{rev}^{{commit}}")
+            ok = len(header) == 3 and header[1] == "commit"
+            self._resolved[rev] = header[0] if ok else None
+        return self._resolved[rev]
+
+    def resolve_many(self, revs: list[str]) -> list[str | None]:
+        """Resolve many revisions with pipelined --batch-check queries."""
+        pending = [rev for rev in dict.fromkeys(revs) if rev not in self._resolved]
+        proc = self._pipe("--batch-check") if pending else None
+        for start in range(0, len(pending), RESOLVE_CHUNK):
+            chunk = pending[start : start + RESOLVE_CHUNK]
+            assert proc and proc.stdin and proc.stdout
+            names = f"<{len(chunk)} names>"
+            with trace_git("query", "cat-file", "--batch-check", names) as call:
+                try:
+                    proc.stdin.write(
+                        b"".join(f"{rev}^{{commit}}\n".encode() for rev in chunk)
+                    )
+                    proc.stdin.flush()
+                except OSError:
+                    self._check_cancelled()
+                    raise
+                for rev in chunk:
+                    header = self._read_header(proc)
+                    ok = len(header) == 3 and header[1] == "commit"
+                    self._resolved[rev] = header[0] if ok else None
+                call["status"] = 0
+        return [self._resolved[rev] for rev in revs]
+
+    def _load_commit_line(self, line: bytes) -> tuple[str, bool]:
+        """Record one ``rev-list --timestamp --parents`` output line.
+
+        Returns the commit's sha and whether it was a ``--boundary``
+        commit.
+        """
+        timestamp, sha, *parents = line.decode().split()
+        boundary = sha.startswith("-")
+        sha = sha.lstrip("-")
+        if self._commits.get(sha) is None:
+            self._commits[sha] = Commit(int(timestamp), tuple(parents))
+        return sha, boundary
+
+    def rev_list(
+        self, revs: list[str], jobs: int = 1
+    ) -> tuple[list[str], set[str]] | None:
+        """Bulk-load the commits selected by ``revs`` with one rev-list.
+
+        ``revs`` are fed to ``git rev-list --stdin``, so any number of
+        tips and ``^exclusions`` cost a single process.  Returns the
+        selected commits and the boundary commits just outside them,
+        or None if rev-list failed.
+
+        With ``jobs`` above 1 and enough tips, the tips are dealt out
+        to up to ``jobs`` rev-lists that each carry every exclusion and
+        run at the same time.  Their union is the same selection, and
+        is merged in shard order so the result does not depend on
+        which process finishes first.
+        """
+        self._check_cancelled()
+        argv = ["rev-list", "--parents", "--timestamp", "--boundary", "--stdin"]
+        tips = [rev for rev in revs if not rev.startswith("^")]
+        excludes = [rev for rev in revs if rev.startswith("^")]
+        shards = max(1, min(jobs, len(tips) // REV_LIST_SHARD_MIN))
+        groups = [tips[i::shards] + excludes for i in range(shards)]
+        if shards == 1:
+            groups = [revs]
+        self._spawned += len(groups)
+        calls = []
+        for group in groups:
+            stdin = "".join(f"{rev}\n" for rev in group).encode()
+            calls.append((argv, stdin, f"<{len(group)} revs>"))
+        outputs = run_git_many(calls, cwd=self.cwd, limit=jobs)
+        self._check_cancelled()
+        if any(output is None for output in outputs):
+            return None
+
+        selected, boundary = {}, set()
+        for output in outputs:
+            for line in output.splitlines():
+                sha, is_boundary = self._load_commit_line(line)
+                if is_boundary:
+                    boundary.add(sha)
+                else:
+                    selected[sha] = None
+        return list(selected), boundary
+
+    def exclusive_commits(
+        self, includes: list[str], excludes: list[str]
+    ) -> set[str]:
+        """Return commits reachable from ``includes`` but not ``excludes``.
+
+        The in-process equivalent of ``rev_list`` for repositories with
+        a commit-graph.  Commits are visited highest topological level
+        first, so each is final by the time it is popped and the walk
+        stops as soon as only excluded commits remain.
+        """
+        flags: dict[str, int] = {}
+        queue: list[tuple[int, int, str]] = []
+        interesting = 0
+
+        def push(sha: str, flag: int) -> None:
+            nonlocal interesting
+            seen = flags.get(sha)
+            if seen is None:
+                flags[sha] = flag
+                heapq.heappush(queue, (-(self.level(sha) or 0), len(flags), sha))
+                interesting += not flag
+            elif flag and not seen & UNINTERESTING:
+                flags[sha] = seen | flag
+                interesting -= 1
+
+        for sha in excludes:
+            push(sha, UNINTERESTING)
+        for sha in includes:
+            push(sha, 0)
+
+        selected = set()
+        while interesting:
+            self._check_cancelled()
+            *_, sha = heapq.heappop(queue)
+            flag = flags[sha] & UNINTERESTING
+            if not flag:
+                interesting -= 1
+                selected.add(sha)
+            for parent in self.parents(sha):
+                push(parent, flag)
+        return selected
+
+    def containing(self, tips: list[str], target: str) -> set[str] | None:
+        """Return the tips that ``target`` is reachable from.
+
+        The in-process equivalent of ``git for-each-ref --contains``.
+        A commit can only reach ``target`` through commits above its
+        topological level and corrected commit date, so the walk never
+        goes below either and is shared by all the tips.  Returns None
+        without a commit-graph.
+        """
+        floor = self.level(target)
+        if floor is None:
+            return None
+        # Commits newer than the graph have no corrected date to compare
+        date_floor = self.generation(target)
+        if date_floor == GENERATION_INFINITY:
+            date_floor = -1
+        reaches = {target: True}
+        for tip in tips:
+            stack = [tip]
+            while stack:
+                self._check_cancelled()
+                sha = stack[-1]
+                if sha in reaches:
+                    stack.pop()
+                    continue
+                level = self.level(sha) or 0
+                if level <= floor or self.generation(sha) <= date_floor:
+                    reaches[sha] = False
+                    stack.pop()
+                    continue
+                parents = self.parents(sha)
+                pending = [p for p in parents if p not in reaches]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                reaches[sha] = any(reaches[p] for p in parents)
+                stack.pop()
+        return {tip for tip in tips if reaches[tip]}
+
+    def load_ancestry(self, rev: str, until: set[str] | None = None) -> None:
+        """Stream ``rev``'s ancestry into memory until ``until`` is covered.
+
+        A single ``git rev-list`` is started on first use and read
+        lazily in date order, so only as much history is loaded as the
+        oldest commit asked for needs; ``until=None`` reads it all.
+        Later calls resume the stream, and commits it never reaches are
+        read on demand.  With a commit-graph there is nothing to
+        preload: commits are read from the graph as needed.
+        """
+        if self.graph:
+            return
+        if until is None:
+            wanted = None
+        else:
+            wanted = {sha for sha in until if self._commits.get(sha) is None}
+            if not wanted:
+                return
+        self._check_cancelled()
+        argv = ["rev-list", "--parents", "--timestamp", rev]
+        if self._ancestry is None:
+            self._spawned += 1
+            with trace_git("spawn", *argv):
+                self._ancestry = subprocess.Popen(
+                    ["git", *argv],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    cwd=self.cwd,
+                )
+
+        assert self._ancestry.stdout
+        readahead = ANCESTRY_READAHEAD
+        with trace_git("stream", *argv) as call:
+            while readahead:
+                line = self._ancestry.stdout.readline()
+                if not line:
+                    self._check_cancelled()
+                    break
+                call["bytes"] += len(line)
+                sha, _ = self._load_commit_line(line)
+                if wanted is not None:
+                    wanted.discard(sha)
+                    if not wanted:
+                        readahead -= 1
+
+    def commit(self, sha: str) -> Commit | None:
+        """Read a commit's timestamp and parents, or None if unavailable.
+
+        Missing commits (e.g. beyond a shallow clone's boundary) are
+        reported as None, so walks treat them as having no history.
+        """
+        if sha not in self._commits and self.graph:
+            pos = self.graph.position(sha)
+            if pos is not None:
+                self._load_graph_commit(sha, pos)
+        if sha not in self._commits and self.objects:
+            found = self.objects.read(sha)
+            if found:
+                kind, body = found
+                self._commits[sha] = parse_commit(body) if kind == "commit" else None
+        if sha not in self._commits:
+            self._check_cancelled()
+            header, body = self._query("--batch", sha)
+            if body is None or header[1] != "commit":
+                self._commits[sha] = None
+            else:
+                self._commits[sha] = parse_commit(body)
+        return self._commits[sha]
+
+    def _load_graph_commit(self, sha: str, pos: int) -> None:
+        """Record a commit read from the commit-graph at ``pos``."""
+        graph = self.graph
+        assert graph
+        timestamp, level, parents = graph.entry(pos)
+        self._commits[sha] = Commit(timestamp, tuple(map(graph.oid, parents)))
+        self._levels[sha] = level
+        if graph.has_generation_data:
+            self._generations[sha] = graph.generation(pos, timestamp)
+
+    def generation(self, sha: str) -> int:
+        """Return the generation git orders merge-base walks by.
+
+        This is the corrected commit date from the commit-graph, or
+        GENERATION_INFINITY for commits it does not cover.
+        """
+        self.commit(sha)
+        return self._generations.get(sha, GENERATION_INFINITY)
+
+    def level(self, sha: str) -> int | None:
+        """Return a commit's topological level, or None without a graph.
+
+        A commit's level is one more than its highest parent's, so a
+        path down from ``a`` to ``b`` has at least
+        ``level(a) - level(b)`` commits.  Levels of commits newer than
+        the graph are computed from their parents.
+        """
+        if not self.graph:
+            return None
+        stack = [sha]
+        while stack:
+            self._check_cancelled()
+            top = stack[-1]
+            if top in self._levels:
+                stack.pop()
+                continue
+            self.commit(top)
+            if top in self._levels:
+                continue
+            parents = self.parents(top)
+            pending = [p for p in parents if p not in self._levels]
+            if pending:
+                stack.extend(pending)
+                continue
+            levels = [self._levels[p] for p in parents]
+            self._levels[top] = 1 + max(levels, default=0)
+            stack.pop()
+        return self._levels[sha]
+
+    def parents(self, sha: str) -> tuple[str, ...]:
+        """Return the parents of a commit that are present in the repo."""
+        commit = self.commit(sha)
+        if commit is None:
+            return ()
+        return tuple(p for p in commit.parents if self.commit(p) is not None)
+
+    def timestamp(self, sha: str) -> int:
+        commit = self.commit(sha)
+        return commit.timestamp if commit else 0
+
+    def _paint_down_to_common(
+        self, one: str, twos: list[str]
+    ) -> tuple[list[str], dict[str, int]]:
+        """Walk down from ``one`` and ``twos`` until their histories meet.
+
+        This is git's paint_down_to_common(): returns the common
+        ancestors found (in discovery order) and the flags painted on
+        every commit visited.
+        """
+        flags = {one: PARENT1}
+        queue: list[tuple[int, int, int, str]] = []
+        counter = 0
+        # Like git, order by corrected commit date when the commit-graph
+        # provides one, which keeps the walk exact under clock skew.
+        by_generation = self.graph is not None and self.graph.has_generation_data
+
+        def push(sha: str) -> None:
+            nonlocal counter
+            generation = self.generation(sha) if by_generation else 0
+            heapq.heappush(queue, (-generation, -self.timestamp(sha), counter, sha))
+            counter += 1
+
+        push(one)
+        for two in twos:
+            flags[two] = flags.get(two, 0) | PARENT2
+            push(two)
+
+        result = []
+        while any(not flags[sha] & STALE for *_, sha in queue):
+            self._check_cancelled()
+            *_, sha = heapq.heappop(queue)
+            paint = flags[sha] & (PARENT1 | PARENT2 | STALE)
+            if paint == PARENT1 | PARENT2:
+                if not flags[sha] & RESULT:
+                    flags[sha] |= RESULT
+                    result.append(sha)
+                paint |= STALE
+            for parent in self.parents(sha):
+                if flags.get(parent, 0) & paint == paint:
+                    continue
+                flags[parent] = flags.get(parent, 0) | paint
+                push(parent)
+
+        return result, flags
+
+    def _remove_redundant(self, commits: list[str]) -> list[str]:
+        """Drop commits that are ancestors of other commits in the list."""
+        redundant = [False] * len(commits)
+        for i, commit in enumerate(commits):
+            if redundant[i]:
+                continue
+            others = [j for j in range(len(commits)) if j != i and not redundant[j]]
+            _, flags = self._paint_down_to_common(
+                commit, [commits[j] for j in others]
+            )
+            if flags[commit] & PARENT2:
+                redundant[i] = True
+            for j in others:
+                if flags[commits[j]] & PARENT1:
+                    redundant[j] = True
+        return [c for c, r in zip(commits, redundant) if not r]
+
+    def merge_base(self, one: str, two: str) -> str | None:
+        """Return the best common ancestor of two revisions, like git merge-base."""
+        a, b = self.resolve(one), self.resolve(two)
+        if not a or not b:
+            return None
+        if a == b:
+            return a
+
+        found, flags = self._paint_down_to_common(a, [b])
+        bases = [sha for sha in found if not flags[sha] & STALE]
+        if len(bases) > 1:
+            bases = self._remove_redundant(bases)
+        # Newest first; ties keep discovery order, as git does.
+        bases.sort(key=self.timestamp, reverse=True)
+        return bases[0] if bases else None
+
+    def count(self, exclude: str, include: str) -> int | None:
+        """Count commits in ``exclude..include``, like git rev-list --count."""
+        a, b = self.resolve(exclude), self.resolve(include)
+        if not a or not b:
+            return None
+        return self.count_commits([a], [b])
+
+    def count_commits(self, excludes: list[str], includes: list[str]) -> int:
+        """Count commits reachable from ``includes`` but not ``excludes``.
+
+        Both lists hold commit shas.  This is git's limit_list() walk:
+        commits are visited newest first and the walk stops once only
+        uninteresting commits remain (allowing SLOP for clock skew).
+        """
+        flags: dict[str, int] = {}
+        queue: list[tuple[int, int, str]] = []
+        counter = 0
+        # Queued commits, and how many of them are still interesting, so
+        # the walk knows when only uninteresting ones remain without
+        # rescanning the queue as git's everybody_uninteresting() does.
+        queued: set[str] = set()
+        interesting = 0
+
+        def push(sha: str) -> None:
+            nonlocal counter, interesting
+            heapq.heappush(queue, (-self.timestamp(sha), counter, sha))
+            counter += 1
+            queued.add(sha)
+            interesting += not flags[sha] & UNINTERESTING
+
+        def mark_uninteresting(sha: str) -> None:
+            # Commits already reached as interesting pass the mark on to
+            # their own ancestors, as mark_parents_uninteresting() does.
+            nonlocal interesting
+            stack = [sha]
+            while stack:
+                self._check_cancelled()
+                commit = stack.pop()
+                seen = flags.get(commit, 0)
+                if seen & UNINTERESTING:
+                    continue
+                flags[commit] = seen | UNINTERESTING
+                interesting -= commit in queued
+                if seen & SEEN:
+                    stack.extend(self.parents(commit))
+
+        for sha in excludes:
+            if sha not in flags:
+                flags[sha] = UNINTERESTING | SEEN
+                push(sha)
+        for sha in includes:
+            if sha not in flags:
+                flags[sha] = SEEN
+                push(sha)
+
+        walked = []
+        slop = SLOP
+        date = None
+        while queue:
+            self._check_cancelled()
+            _, _, sha = heapq.heappop(queue)
+            queued.discard(sha)
+            uninteresting = flags[sha] & UNINTERESTING
+            interesting -= not uninteresting
+            for parent in self.parents(sha):
+                if uninteresting:
+                    mark_uninteresting(parent)
+                if not flags.get(parent, 0) & SEEN:
+                    flags[parent] = flags.get(parent, 0) | SEEN
+                    push(parent)
+            if uninteresting:
+                if not queue:
+                    break
+                if date is not None and date <= -queue[0][0]:
+                    slop = SLOP
+                elif interesting:
+                    slop = SLOP
+                else:
+                    slop -= 1
+                    if not slop:
+                        break
+                continue
+            date = self.timestamp(sha)
+            walked.append(sha)
+
+        return sum(1 for sha in walked if not flags[sha] & UNINTERESTING)
+
+
+def parse_commit(body: bytes) -> Commit:
+    """Extract the parents and committer timestamp from a raw commit."""
+    parents = []
+    timestamp = 0
+    for line in body.split(b"\n"):
+        if not line:
+            break
+        if line.startswith(b"parent "):
+            parents.append(line[7:].decode())
+        elif line.startswith(b"committer "):
+            timestamp = int(line.rsplit(b" ", 2)[1])
+    return Commit(timestamp, tuple(parents))
+
+
+class DistanceEngine:
+    """Merge-base and distance from HEAD for many branch tips at once.
+
+    The commits unique to the candidate tips are loaded with one
+    ``git rev-list --boundary`` and HEAD's ancestry is streamed once,
+    after which every tip's merge-base and distance are answered
+    in-process.  The merge-base frontier and ancestor count are
+    memoized per commit, so tips sharing history share work: with many
+    distinct merge-bases, each distance is just the difference between
+    HEAD's ancestor count and the merge-base's.  When the repository has
+    a commit-graph, history is read from it instead and the tip-side
+    walk is done in-process in generation order.
+    """
+
+    def __init__(self, git: GitSession) -> None:
+        self.git = git
+        self.head = git.resolve("HEAD")
+        self._exclusive: set[str] = set()
+        self._frontiers: dict[str, frozenset[str]] = {}
+        self._distances: dict[str, int | None] = {}
+        self._ancestor_counts: dict[str, int] = {}
+
+    def distances(self, branches: list[str]) -> dict[str, tuple[str, int]]:
+        """Map each branch with a merge-base to (merge_base_sha, distance)."""
+        if not self.head:
+            return {}
+
+        tips = dict(zip(branches, self.git.resolve_many(branches)))
+        new_tips = [
+            tip
+            for tip in dict.fromkeys(tips.values())
+            if tip and tip not in self._frontiers and tip not in self._exclusive
+        ]
+        if new_tips and self.git.graph:
+            exclusive = self.git.exclusive_commits(new_tips, [self.head])
+            self._exclusive.update(exclusive)
+        elif new_tips:
+            loaded = self.git.rev_list([*new_tips, f"^{self.head}"], jobs=GIT_JOBS)
+            if loaded is None:
+                return self._distances_one_by_one(tips)
+            self._exclusive.update(loaded[0])
+
+        bases = {}
+        for branch, tip in tips.items():
+            base = self._merge_base(tip) if tip else None
+            if base:
+                bases[branch] = base
+
+        new_bases = set(bases.values()) - set(self._distances)
+        if len(new_bases) > DIRECT_DISTANCE_LIMIT:
+            self.git.load_ancestry(self.head)
+            head_count = self._ancestor_count(self.head)
+            for base in new_bases:
+                self._distances[base] = head_count - self._ancestor_count(base)
+        else:
+            self.git.load_ancestry(self.head, new_bases)
+
+        result = {}
+        for branch, base in bases.items():
+            distance = self._distance(base)
+            if distance is not None:
+                result[branch] = (base, distance)
+        return result
+
+    def prefilter(
+        self, branches: list[str]
+    ) -> tuple[dict[str, int], dict[str, tuple[str, int]]]:
+        """Bound each branch's distance from HEAD before walking any.
+
+        Returns a lower bound per branch, and the (merge_base_sha,
+        distance) of branches already known exactly: a tip containing
+        HEAD has HEAD as its merge-base, at distance 0.
+
+        Every commit on a path from HEAD down to the merge-base is in
+        the counted range, and such a path is at least as long as the
+        drop in topological level, which is no less than
+        ``level(HEAD) - level(tip)``.  Tips not below HEAD's level are
+        checked for containing HEAD in one shared walk, and are at
+        distance 1 or more if they do not.  Without a commit-graph only
+        a tip at HEAD itself is known, and every other bound is 0.
+        """
+        tips = dict(zip(branches, self.git.resolve_many(branches)))
+        bounds = dict.fromkeys(branches, 0)
+        known = {b: (tip, 0) for b, tip in tips.items() if tip and tip == self.head}
+        head_level = self.git.level(self.head) if self.head else None
+        if head_level is None:
+            return bounds, known
+
+        levels = {tip: self.git.level(tip) or 0 for tip in tips.values() if tip}
+        high = [tip for tip, level in levels.items() if level >= head_level]
+        containing = self.git.containing(high, self.head) or set()
+        for branch, tip in tips.items():
+            if tip in containing:
+                known[branch] = (self.head, 0)
+            elif tip:
+                bounds[branch] = max(1, head_level - levels[tip])
+        return bounds, known
+
+    def _distances_one_by_one(
+        self, tips: dict[str, str | None]
+    ) -> dict[str, tuple[str, int]]:
+        """Fallback when the bulk load fails: query each tip separately."""
+        result = {}
+        for branch, tip in tips.items():
+            with trace_scope(branch=branch):
+                base = self.git.merge_base(self.head, tip) if tip else None
+                distance = self._distance(base) if base else None
+            if base and distance is not None:
+                result[branch] = (base, distance)
+        return result
+
+    def _frontier(self, tip: str) -> frozenset[str]:
+        """Commits of HEAD's ancestry first reached walking down from ``tip``."""
+        stack = [tip]
+        while stack:
+            if self.git.cancelled:
+                raise Cancelled
+            sha = stack[-1]
+            if sha in self._frontiers:
+                stack.pop()
+                continue
+            if sha not in self._exclusive:
+                self._frontiers[sha] = frozenset([sha])
+                stack.pop()
+                continue
+            commit = self.git.commit(sha)
+            parents = commit.parents if commit else ()
+            pending = [p for p in parents if p not in self._frontiers]
+            if pending:
+                stack.extend(pending)
+                continue
+            self._frontiers[sha] = frozenset().union(
+                *(self._frontiers[p] for p in parents)
+            )
+            stack.pop()
+        return self._frontiers[tip]
+
+    def _merge_base(self, tip: str) -> str | None:
+        frontier = self._frontier(tip)
+        if len(frontier) == 1:
+            return next(iter(frontier))
+        if not frontier:
+            return None
+        # Several candidates (criss-cross history): let the exact
+        # paint-down pick the same one git merge-base would.
+        return self.git.merge_base(self.head, tip)
+
+    def _ancestor_count(self, sha: str) -> int:
+        """Number of commits reachable from ``sha``, itself included.
+
+        Counts are built up first-parent chains; a merge adds the
+        commits its other parents bring in beyond the first parent's.
+        """
+        counts = self._ancestor_counts
+        chain = []
+        while sha not in counts:
+            if self.git.cancelled:
+                raise Cancelled
+            chain.append(sha)
+            parents = self.git.parents(sha)
+            if not parents:
+                break
+            sha = parents[0]
+
+        for sha in reversed(chain):
+            if self.git.cancelled:
+                raise Cancelled
+            parents = self.git.parents(sha)
+            if not parents:
+                counts[sha] = 1
+                continue
+            count = 1 + counts[parents[0]]
+            if len(parents) > 1:
+                count += self.git.count_commits([parents[0]], list(parents[1:]))
+            counts[sha] = count
+        return counts[chain[0]] if chain else counts[sha]
+
+    def _distance(self, base: str) -> int | None:
+        if base not in self._distances:
+            self._distances[base] = self.git.count(base, self.head)
+        return self._distances[base]
+
+
+def get_remote_branches(git: GitSession, remote: str) -> Iterator[str]:
+    """Yield one remote's branch refs (e.g., origin/main) as they are read."""
+    if git.refs:
+        yield from git.refs.iter_remote_branches(remote)
+        return
+    prefix = f"refs/remotes/{remote}/"
+    for line in git.lines("for-each-ref", "--format=%(refname:short)", prefix):
+        if line.strip():
+            yield line.strip()
+
+
+def try_upstream(git: GitSession) -> tuple[str | None, str | None]:
     """Try @{upstream} (the current branch's configured upstream)."""
     debug("Trying @{upstream}")
-    upstream = run_git("rev-parse", "--abbrev-ref", "@{upstream}")
+    upstream = git.run("rev-parse", "--abbrev-ref", "@{upstream}")
     if not upstream:
         debug("  no upstream configured")
         return None, None
 
     debug(f"  upstream is {upstream}")
-    base = run_git("merge-base", "HEAD", "@{upstream}")
+    with trace_scope(branch=upstream):
+        base = git.merge_base("HEAD", "@{upstream}")
     if base:
         debug(f"  found merge-base {base[:12]} with {upstream}")
         return upstream, "@{upstream}"
@@ -67,11 +2103,14 @@ def try_upstream() -> tuple[str | None, str | None]:
     return None, None
 
 
-def try_origin_head() -> tuple[str | None, str | None]:
+def try_origin_head(git: GitSession) -> tuple[str | None, str | None]:
     """Try origin/HEAD (the remote's default branch)."""
     debug("Trying origin/HEAD")
     # Resolve origin/HEAD to actual branch name
-    target = run_git("symbolic-ref", "refs/remotes/origin/HEAD")
+    if git.refs:
+        target = git.refs.symbolic_ref("refs/remotes/origin/HEAD")
+    else:
+        target = git.run("symbolic-ref", "refs/remotes/origin/HEAD")
     if not target:
         debug("  origin/HEAD not available")
         return None, None
@@ -80,7 +2119,8 @@ def try_origin_head() -> tuple[str | None, str | None]:
     branch = target.replace("refs/remotes/", "")
     debug(f"  origin/HEAD points to {branch}")
 
-    base = run_git("merge-base", "HEAD", "origin/HEAD")
+    with trace_scope(branch=branch):
+        base = git.merge_base("HEAD", "origin/HEAD")
     if base:
         debug(f"  found merge-base {base[:12]} with {branch}")
         return branch, "origin/HEAD"
@@ -89,25 +2129,29 @@ def try_origin_head() -> tuple[str | None, str | None]:
     return None, None
 
 
-def try_common_default_branches() -> tuple[str | None, str | None]:
+def try_common_default_branches(git: GitSession) -> tuple[str | None, str | None]:
     """Try common default branch names on origin."""
     debug("Trying common default branches")
     for branch in ["origin/main", "origin/master", "origin/develop", "origin/dev"]:
         debug(f"  checking {branch}")
-        if run_git("rev-parse", "--verify", branch):
-            base = run_git("merge-base", "HEAD", branch)
-            if base:
-                debug(f"  found merge-base {base[:12]} with {branch}")
-                return branch, "common default branch"
-        else:
+        with trace_scope(branch=branch):
+            exists = git.resolve(branch)
+            base = git.merge_base("HEAD", branch) if exists else None
+        if not exists:
             debug(f"  {branch} does not exist")
+        elif base:
+            debug(f"  found merge-base {base[:12]} with {branch}")
+            return branch, "common default branch"
 
     return None, None
 
 
-def get_existing_remotes() -> list[str]:
+def get_existing_remotes(git: GitSession) -> list[str]:
     """Get list of configured remotes."""
-    output = run_git("remote")
+    remotes = git.refs.remotes() if git.refs else None
+    if remotes is not None:
+        return remotes
+    output = git.run("remote")
     if not output:
         return []
     return [r.strip() for r in output.splitlines() if r.strip()]
@@ -134,58 +2178,101 @@ def should_skip_branch(remote_branch: str, current_branch: str | None) -> bool:
     return True
 
 
-def get_branch_distance(remote_branch: str) -> tuple[str, int] | None:
-    """Get the merge-base and commit distance for a remote branch.
-
-    Returns tuple of (merge_base_sha, distance) or None if not determinable.
-    """
-    base = run_git("merge-base", "HEAD", remote_branch)
-    if not base:
-        return None
-
-    count_output = run_git("rev-list", "--count", f"{base}..HEAD")
-    if not count_output:
-        return None
-
-    return base, int(count_output)
+# How many of a remote's branches are weighed at a time, which bounds
+# the memory used however many refs the remote has
+REMOTE_BRANCH_CHUNK = 4096
 
 
 def find_closest_branch_for_remote(
+    engine: DistanceEngine,
     remote: str,
-    remote_branches: list[str],
+    remote_branches: Iterable[str],
     current_branch: str | None,
 ) -> str | None:
-    """Find the closest branch for a single remote."""
-    branches_for_remote = [b for b in remote_branches if b.startswith(f"{remote}/")]
-    if not branches_for_remote:
+    """Find the closest branch for a single remote.
+
+    ``remote_branches`` is consumed as it is produced, REMOTE_BRANCH_CHUNK
+    branches at a time; only the best branch so far is carried from one
+    chunk to the next.
+    """
+    branches = (b for b in remote_branches if b.startswith(f"{remote}/"))
+    found = False
+    best = None
+    position = 0
+    while chunk := list(itertools.islice(branches, REMOTE_BRANCH_CHUNK)):
+        found = True
+        candidates = [b for b in chunk if not should_skip_branch(b, current_branch)]
+        order = {branch: position + i for i, branch in enumerate(candidates)}
+        position += len(candidates)
+        best = weigh_candidates(engine, remote, candidates, order, best)
+    if not found:
         debug(f"    no branches for {remote}")
         return None
 
-    best_branch = None
-    min_distance = float("inf")
-
-    for remote_branch in branches_for_remote:
-        if should_skip_branch(remote_branch, current_branch):
-            continue
-
-        result = get_branch_distance(remote_branch)
-        if not result:
-            continue
-
-        base, distance = result
-        debug(f"    {remote_branch}: merge-base {base[:12]}, distance {distance}")
-
-        if distance < min_distance:
-            min_distance = distance
-            best_branch = remote_branch
-
-    if best_branch:
-        debug(f"  best from {remote}: {best_branch} with distance {min_distance}")
-
+    if best is None:
+        return None
+    min_distance, _, best_branch = best
+    debug(f"  best from {remote}: {best_branch} with distance {min_distance}")
     return best_branch
 
 
-def try_closest_remote_branch() -> tuple[str | None, str | None]:
+def weigh_candidates(
+    engine: DistanceEngine,
+    remote: str,
+    candidates: list[str],
+    order: dict[str, int],
+    best: tuple[int, int, str] | None,
+) -> tuple[int, int, str] | None:
+    """Return the best (distance, position, branch) of ``best`` and ``candidates``.
+
+    Positions come from ``order``, so ties go to the earliest branch
+    across all chunks of a remote.
+    """
+    bounds, distances = engine.prefilter(candidates)
+
+    def beats_best(distance: int, position: int) -> bool:
+        return best is None or (distance, position) < best[:2]
+
+    # Branches already known can improve the best so far; the rest wait
+    # in a heap ordered by distance lower bound and list position.  They
+    # are evaluated a bound at a time, only while the top of the heap
+    # could still beat the best branch (or tie with it from earlier in
+    # the list), so branches that cannot win are never walked.
+    for branch, (_, distance) in distances.items():
+        if beats_best(distance, order[branch]):
+            best = (distance, order[branch], branch)
+    heap = [(bounds[b], order[b], b) for b in candidates if b not in distances]
+    heapq.heapify(heap)
+    evaluated = set(distances)
+
+    while heap and beats_best(*heap[0][:2]):
+        bound = heap[0][0]
+        group = []
+        while heap and heap[0][0] == bound and beats_best(*heap[0][:2]):
+            group.append(heapq.heappop(heap)[2])
+        evaluated.update(group)
+        scope = group[0] if len(group) == 1 else f"{remote}/* ({len(group)} branches)"
+        with trace_scope(branch=scope):
+            distances.update(engine.distances(group))
+        for remote_branch in group:
+            result = distances.get(remote_branch)
+            if result and beats_best(result[1], order[remote_branch]):
+                best = (result[1], order[remote_branch], remote_branch)
+
+    for remote_branch in candidates:
+        result = distances.get(remote_branch)
+        if result:
+            base, distance = result
+            debug(f"    {remote_branch}: merge-base {base[:12]}, distance {distance}")
+        elif remote_branch not in evaluated:
+            debug(
+                f"    {remote_branch}: skipped, distance at least "
+                f"{bounds[remote_branch]}"
+            )
+    return best
+
+
+def try_closest_remote_branch(git: GitSession) -> tuple[str | None, str | None]:
     """Find the closest remote branch by commit distance.
 
     Only considers branches from preferred remotes (in priority order).
@@ -194,7 +2281,7 @@ def try_closest_remote_branch() -> tuple[str | None, str | None]:
     debug("Trying closest remote branch by commit distance")
     debug(f"  preferred remotes: {PREFERRED_REMOTES}")
 
-    existing_remotes = get_existing_remotes()
+    existing_remotes = get_existing_remotes(git)
     debug(f"  existing remotes: {existing_remotes}")
 
     remotes_to_check = [r for r in PREFERRED_REMOTES if r in existing_remotes]
@@ -204,18 +2291,17 @@ def try_closest_remote_branch() -> tuple[str | None, str | None]:
 
     debug(f"  checking remotes: {remotes_to_check}")
 
-    remote_branches = get_remote_branches()
-    if not remote_branches:
-        debug("  no remote branches found")
-        return None, None
-
-    current_branch = run_git("branch", "--show-current")
+    if git.refs:
+        current_branch = git.refs.current_branch()
+    else:
+        current_branch = git.run("branch", "--show-current")
     debug(f"  current branch: {current_branch}")
 
+    engine = DistanceEngine(git)
     for remote in remotes_to_check:
         debug(f"  checking remote: {remote}")
         best_branch = find_closest_branch_for_remote(
-            remote, remote_branches, current_branch
+            engine, remote, get_remote_branches(git, remote), current_branch
         )
         if best_branch:
             return best_branch, "closest remote branch"
@@ -224,15 +2310,26 @@ def try_closest_remote_branch() -> tuple[str | None, str | None]:
     return None, None
 
 
-def find_base_branch() -> tuple[str | None, str | None]:
+Strategy = Callable[[GitSession], tuple[str | None, str | None]]
+
+
+def find_base_branch(
+    git: GitSession, concurrent: bool = False
+) -> tuple[str | None, str | None]:
     """Find the base branch for the current branch.
 
+    All strategies share ``git``, so a full run costs a fixed handful
+    of git processes however many branches are examined.
+
     Tries strategies in order:
     - @{upstream} (the current branch's configured upstream)
     - origin/HEAD (the remote's default branch)
     - Common default branch names (main, master, develop, dev)
     - Closest remote branch by commit distance
 
+    With ``concurrent``, all strategies start at once and the result is
+    still that of the first one in this order to succeed.
+
     Returns:
         Tuple of (branch_name, source_description)
     """
@@ -243,16 +2340,453 @@ def find_base_branch() -> tuple[str | None, str | None]:
         try_origin_head,
     ]
 
+    if concurrent:
+        return run_strategies_concurrently(git, strategies)
+
     for strategy in strategies:
-        base, source = strategy()
+        with trace_scope(strategy=strategy.__name__):
+            base, source = strategy(git)
         if base:
             return base, source
 
     return None, None
 
 
+def _run_buffered(
+    strategy: Strategy, git: GitSession
+) -> tuple[tuple[str | None, str | None], list[str]]:
+    """Run a strategy on a worker thread, capturing its debug output."""
+    _debug_buffer.lines = []
+    try:
+        with trace_scope(strategy=strategy.__name__):
+            return strategy(git), _debug_buffer.lines
+    finally:
+        _debug_buffer.lines = None
+        git.close()
+
+
+def run_strategies_concurrently(
+    git: GitSession, strategies: list[Strategy]
+) -> tuple[str | None, str | None]:
+    """Run all strategies at once, keeping sequential priority.
+
+    Each strategy gets a fork of ``git`` so their queries run in
+    parallel; their in-process walks still share the interpreter lock.
+    As soon as one succeeds, every lower-priority strategy is
+    cancelled, stopping at its next query or walk step, and its answer
+    is returned once all higher-priority strategies have failed.  Debug
+    output is replayed in priority order for the strategies a
+    sequential run would have tried, so it reads exactly the same.
+    """
+    sessions = [git.fork() for _ in strategies]
+    pool = ThreadPoolExecutor(max_workers=len(strategies))
+    futures = [
+        pool.submit(_run_buffered, strategy, session)
+        for strategy, session in zip(strategies, sessions)
+    ]
+    index_of: dict[Future, int] = {future: i for i, future in enumerate(futures)}
+    outcomes: dict[int, tuple[tuple[str | None, str | None], list[str]]] = {}
+
+    try:
+        pending = set(futures)
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = index_of[future]
+                if not sessions[i].cancelled:
+                    outcomes[i] = future.result()
+
+            succeeded = [i for i, ((base, _), _) in outcomes.items() if base]
+            first_success = min(succeeded, default=len(strategies))
+            for i in range(first_success + 1, len(strategies)):
+                futures[i].cancel()
+                sessions[i].cancel()
+
+            # Decided once every strategy up to the first success is done
+            decided = None
+            for i in range(len(strategies)):
+                if i not in outcomes:
+                    break
+                if outcomes[i][0][0] or i == len(strategies) - 1:
+                    decided = i
+                    break
+            if decided is not None:
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    for i in range(decided + 1):
+        for line in outcomes[i][1]:
+            debug(line)
+    return outcomes[decided][0]
+
+
+class ResultCache:
+    """Resolved base branches stored in the repository's git directory.
+
+    Entries are keyed on HEAD, the current branch, a stat fingerprint
+    of every file that holds branch, remote or tag refs or otherwise
+    affects the answer, and the settings the strategies use, so any
+    ref update leaves old entries unreachable until they are evicted.
+    Computing the key only reads files under the git directory; no git
+    process is run.
+    """
+
+    def __init__(self, git_dir: str, common_dir: str) -> None:
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self.path = os.path.join(common_dir, CACHE_FILE)
+        self.refs = RefStore(git_dir, common_dir)
+
+    def key(self) -> str:
+        head, branch = self._read_head()
+        state = [
+            head,
+            branch,
+            self._fingerprint(),
+            PREFERRED_REMOTES,
+            DEFAULT_BRANCH_NAMES,
+        ]
+        return hashlib.sha256(json.dumps(state).encode()).hexdigest()
+
+    def _read_head(self) -> tuple[str | None, str | None]:
+        """Return HEAD's commit and current branch."""
+        ref = self.refs.symbolic_ref("HEAD")
+        head = self.refs.resolve("HEAD") or self.refs.read_raw("HEAD")
+        branch = None
+        if ref and ref.startswith("refs/heads/"):
+            branch = ref.removeprefix("refs/heads/")
+        return head, branch
+
+    def _fingerprint(self) -> list[list]:
+        files = [
+            os.path.join(self.common_dir, name)
+            for name in ["packed-refs", "config", "shallow", "reftable/tables.list"]
+        ]
+        files.append(os.path.join(self.git_dir, "config.worktree"))
+        for tree in REF_TREES:
+            for root, _, names in os.walk(os.path.join(self.common_dir, "refs", tree)):
+                files.extend(os.path.join(root, name) for name in names)
+        return sorted(
+            [os.path.relpath(path, self.common_dir), stat_signature(path)]
+            for path in files
+        )
+
+    def _load(self) -> dict[str, dict]:
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, key: str) -> tuple[str, str] | None:
+        """Return the cached (branch, source) for ``key``, if still fresh."""
+        entry = self._load().get(key)
+        if not isinstance(entry, dict):
+            return None
+        if time.time() - entry.get("time", 0) > CACHE_MAX_AGE:
+            return None
+        return entry.get("branch"), entry.get("source")
+
+    def put(self, key: str, branch: str, source: str) -> None:
+        """Store a result, evicting stale and surplus entries."""
+        now = time.time()
+        entries = self._load()
+        entries[key] = {"branch": branch, "source": source, "time": now}
+        fresh = sorted(
+            (
+                item
+                for item in entries.items()
+                if isinstance(item[1], dict)
+                and now - item[1].get("time", 0) <= CACHE_MAX_AGE
+            ),
+            key=lambda item: item[1]["time"],
+            reverse=True,
+        )[:CACHE_MAX_ENTRIES]
+
+        try:
+            with tempfile.NamedTemporaryFile(
+                "w", dir=self.common_dir, prefix=CACHE_FILE, delete=False
+            ) as f:
+                json.dump(dict(fresh), f)
+            os.replace(f.name, self.path)
+        except OSError as e:
+            debug(f"Could not write cache: {e}")
+            with contextlib.suppress(OSError):
+                os.unlink(f.name)
+
+
+def daemon_socket_path(git_dir: str) -> str:
+    """Return where the daemon for ``git_dir`` listens.
+
+    The socket lives in the git directory unless that path is too
+    long for a Unix socket address, in which case it goes in a private
+    per-user directory under the system temp dir.
+    """
+    path = os.path.join(git_dir, DAEMON_SOCKET)
+    if len(os.fsencode(path)) < 100:
+        return path
+    private = os.path.join(tempfile.gettempdir(), f"find-merge-base-{os.getuid()}")
+    os.makedirs(private, mode=0o700, exist_ok=True)
+    digest = hashlib.sha256(os.fsencode(git_dir)).hexdigest()[:16]
+    return os.path.join(private, f"{digest}.sock")
+
+
+# inotify event bits (from <sys/inotify.h>)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+REF_EVENTS = (
+    IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+
+# Files directly in the git directories whose changes affect the answer
+WATCHED_FILES = {"HEAD", "packed-refs", "config", "config.worktree", "shallow"}
+
+
+class RefWatcher:
+    """Reports changes to HEAD, packed-refs, config and the refs trees.
+
+    Uses inotify through ctypes: the git directories are watched for
+    the files in WATCHED_FILES, and the REF_TREES under refs/ are
+    watched recursively, including directories created later.  Use
+    :meth:`open`, which returns None where inotify is unavailable so
+    the caller can poll instead.
+    """
+
+    def __init__(self, libc: ctypes.CDLL, fd: int, git_dirs: list[str]) -> None:
+        self._libc = libc
+        self._fd = fd
+        # Watch descriptor -> (directory, what changes in it matter)
+        self._watches: dict[int, tuple[str, set[str] | None]] = {}
+        for git_dir in git_dirs:
+            self._watch(git_dir, WATCHED_FILES)
+        refs = os.path.join(git_dirs[-1], "refs")
+        self._watch(refs, set(REF_TREES))
+        for tree in REF_TREES:
+            self._watch_tree(os.path.join(refs, tree))
+
+    @classmethod
+    def open(cls, git_dir: str, common_dir: str) -> "RefWatcher | None":
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        return cls(libc, fd, list(dict.fromkeys([git_dir, common_dir])))
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def _watch(self, path: str, names: set[str] | None) -> None:
+        """Watch a directory; ``names`` limits which entries matter."""
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), REF_EVENTS | IN_DELETE_SELF
+        )
+        if wd >= 0:
+            self._watches[wd] = (path, names)
+
+    def _watch_tree(self, top: str) -> None:
+        for root, _, _ in os.walk(top):
+            self._watch(root, None)
+
+    def read(self) -> bool:
+        """Consume pending events; return whether any ref may have changed."""
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, size = struct.unpack_from("iIII", data, offset)
+                name = data[offset + 16 : offset + 16 + size].rstrip(b"\0")
+                offset += 16 + size
+                if mask & IN_Q_OVERFLOW:
+                    changed = True
+                    continue
+                directory, names = self._watches.get(wd, ("", set()))
+                entry = os.fsdecode(name)
+                if entry.endswith(".lock"):
+                    continue
+                if names is not None and entry not in names:
+                    continue
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(os.path.join(directory, entry))
+                changed = True
+
+
+class Daemon:
+    """Answers base branch queries for one repository over a Unix socket.
+
+    The answer is kept in memory with the ResultCache key it was
+    computed for.  Ref changes reported by a RefWatcher (or, without
+    inotify, noticed by polling the key) trigger a recompute once the
+    repository has been quiet for DAEMON_SETTLE seconds, so queries are
+    normally answered without touching git.  Recomputes reuse the
+    commits already read, since those never change.
+
+    The protocol is one JSON object per line each way: a request such
+    as ``{"debug": true}`` is answered with
+    ``{"branch": ..., "source": ..., "debug": [...]}``.
+    """
+
+    def __init__(
+        self,
+        git_dir: str,
+        common_dir: str,
+        concurrent: bool = False,
+        cwd: str | None = None,
+    ) -> None:
+        self.git_dir = git_dir
+        self.path = daemon_socket_path(git_dir)
+        self.concurrent = concurrent
+        self.cache = ResultCache(git_dir, common_dir)
+        self.watcher = RefWatcher.open(git_dir, common_dir)
+        self.git = GitSession(cwd)
+        self.key: str | None = None
+        self.answer: dict = {}
+        self.dirty = True
+        self.changed_at = 0.0
+
+    def compute(self) -> dict:
+        """Return the answer for the repository's current state."""
+        global DEBUG
+        key = self.cache.key()
+        if key != self.key:
+            self.git.close()
+            self.git = self.git.renew()
+            saved, DEBUG = DEBUG, True
+            _debug_buffer.lines = []
+            try:
+                branch, source = find_base_branch(self.git, self.concurrent)
+                lines = _debug_buffer.lines
+            finally:
+                _debug_buffer.lines = None
+                DEBUG = saved
+            self.key = key
+            self.answer = {"branch": branch, "source": source, "debug": lines}
+            if branch and source:
+                self.cache.put(key, branch, source)
+            debug(f"Recomputed: {branch} (via {source})")
+        self.dirty = self.watcher is None
+        return self.answer
+
+    def handle(self, conn: socket.socket) -> None:
+        """Answer one client connection."""
+        with conn, conn.makefile("rwb") as stream:
+            try:
+                request = json.loads(stream.readline() or b"{}")
+            except ValueError:
+                request = {}
+            if self.watcher and self.watcher.read():
+                self.dirty = True
+            answer = self.compute() if self.dirty else self.answer
+            if not request.get("debug"):
+                answer = {k: v for k, v in answer.items() if k != "debug"}
+            stream.write(json.dumps(answer).encode() + b"\n")
+
+    def claim_socket(self) -> socket.socket | None:
+        """Listen on the socket, or return None if a daemon already is."""
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                return None
+            except OSError:
+                os.unlink(self.path)
+            finally:
+                probe.close()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        server.listen()
+        return server
+
+    def serve(self, idle_timeout: float) -> int:
+        """Serve queries until idle for ``idle_timeout`` seconds."""
+        server = self.claim_socket()
+        if server is None:
+            print(
+                f"Error: a daemon is already listening on {self.path}",
+                file=sys.stderr,
+            )
+            return 1
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ)
+        if self.watcher:
+            selector.register(self.watcher, selectors.EVENT_READ)
+        debug(f"Listening on {self.path} ({'inotify' if self.watcher else 'polling'})")
+
+        last_query = time.monotonic()
+        try:
+            self.compute()
+            while time.monotonic() - last_query < idle_timeout:
+                if self.watcher is None:
+                    timeout = DAEMON_POLL_INTERVAL
+                elif self.changed_at:
+                    settle_at = self.changed_at + DAEMON_SETTLE
+                    timeout = max(0.0, settle_at - time.monotonic())
+                else:
+                    timeout = idle_timeout
+                for selected, _ in selector.select(timeout):
+                    if selected.fileobj is server:
+                        conn, _ = server.accept()
+                        last_query = time.monotonic()
+                        self.handle(conn)
+                    elif self.watcher and self.watcher.read():
+                        self.dirty = True
+                        self.changed_at = time.monotonic()
+                settled = self.changed_at + DAEMON_SETTLE <= time.monotonic()
+                if self.watcher is None or (self.changed_at and settled):
+                    self.changed_at = 0.0
+                    self.compute()
+        finally:
+            selector.close()
+            server.close()
+            with contextlib.suppress(OSError):
+                os.unlink(self.path)
+            if self.watcher:
+                self.watcher.close()
+            self.git.close()
+        return 0
+
+
+def query_daemon(git_dir: str) -> dict | None:
+    """Ask a running daemon for the answer, or None if none is running."""
+    path = daemon_socket_path(git_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(DAEMON_CLIENT_TIMEOUT)
+            conn.connect(path)
+            conn.sendall(json.dumps({"debug": DEBUG}).encode() + b"\n")
+            with conn.makefile("rb") as stream:
+                answer = json.loads(stream.readline())
+    except (OSError, ValueError):
+        return None
+    return answer if isinstance(answer, dict) and "branch" in answer else None
+
+
 def main() -> int:
-    global DEBUG
+    global DEBUG, GIT_JOBS, READ_OBJECTS, TRACER
 
     parser = argparse.ArgumentParser(
         description="Find the merge base commit for the current branch"
@@ -267,20 +2801,423 @@ def main() -> int:
         action="store_true",
         help="Fetch latest remote refs before determining merge base",
     )
+    parser.add_argument(
+        "--fetch-max-age",
+        type=float,
+        default=FETCH_MAX_AGE,
+        metavar="SECONDS",
+        help="With --fetch, skip fetching if the last fetch was less than "
+        f"this long ago (default: {FETCH_MAX_AGE}; 0 always fetches)",
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="Evaluate all strategies at once (same result; faster only "
+        "when git, not the in-process walks, is the bottleneck)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Neither use nor update the result cache in the git directory",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Record every git call to FILE and print a per-strategy summary",
+    )
+    parser.add_argument(
+        "--trace-format",
+        choices=["jsonl", "chrome"],
+        default="jsonl",
+        help="Trace as JSON lines, or Chrome trace events for chrome://tracing "
+        "or Perfetto (default: jsonl)",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run a daemon answering queries for this repository over a "
+        "Unix socket; later runs ask it first",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=DAEMON_IDLE_TIMEOUT,
+        metavar="SECONDS",
+        help="With --serve, exit after this long without queries "
+        f"(default: {DAEMON_IDLE_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Do not ask a running daemon; always answer in this process",
+    )
+    parser.add_argument(
+        "--install-hooks",
+        action="store_true",
+        help="Install git hooks that recompute the answer in the background "
+        "whenever refs change, for --cached-only",
+    )
+    parser.add_argument(
+        "--uninstall-hooks",
+        action="store_true",
+        help="Remove the hooks installed by --install-hooks",
+    )
+    parser.add_argument(
+        "--precompute",
+        action="store_true",
+        help="Recompute the answer and store it for --cached-only "
+        "(run by the hooks)",
+    )
+    parser.add_argument(
+        "--cached-only",
+        action="store_true",
+        help="Print the precomputed answer without running git; exit 1 if "
+        "there is none for the current HEAD",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Resolve the repositories or worktrees given as PATHs (or read "
+        "from stdin, one per line) and print one JSON line per repository",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=min(32, os.cpu_count() or 1),
+        help="With --batch, how many repositories to resolve at once "
+        "(default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--git-jobs",
+        type=int,
+        default=GIT_JOBS,
+        metavar="N",
+        help="Run up to N git processes at once when loading the history of "
+        f"many remote branches (default: {GIT_JOBS})",
+    )
+    parser.add_argument(
+        "--no-object-reader",
+        action="store_true",
+        help="Read commits through git cat-file rather than straight from the "
+        "repository's loose objects and packs",
+    )
+    parser.add_argument(
+        "paths", nargs="*", metavar="PATH", help="Repositories for --batch"
+    )
     args = parser.parse_args()
+    if args.paths and not args.batch:
+        parser.error("PATH arguments need --batch")
+    if args.batch and (args.serve or args.trace):
+        parser.error("--batch cannot be combined with --serve or --trace")
+    modes = [
+        args.batch,
+        args.serve,
+        args.precompute,
+        args.cached_only,
+        args.install_hooks,
+        args.uninstall_hooks,
+    ]
+    if sum(modes) > 1:
+        parser.error(
+            "only one of --batch, --serve, --precompute, --cached-only, "
+            "--install-hooks and --uninstall-hooks can be given"
+        )
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.git_jobs < 1:
+        parser.error("--git-jobs must be at least 1")
 
     DEBUG = args.debug
+    GIT_JOBS = args.git_jobs
+    READ_OBJECTS = not args.no_object_reader
+    if args.trace:
+        TRACER = Tracer()
+    if args.batch:
+        return run_batch(args)
+    try:
+        return run(args)
+    finally:
+        if TRACER:
+            TRACER.write(args.trace, args.trace_format)
+            TRACER.print_summary()
+
+
+def fetch_targets(git: GitSession) -> dict[str, list[str]]:
+    """Map each remote the strategies look at to the refspecs they need.
+
+    Preferred remotes are fetched with their configured refspecs (an
+    empty list), so single-branch and narrowed clones stay narrow; the
+    current branch's upstream remote, if not preferred, gets just that
+    branch.
+    """
+    existing = get_existing_remotes(git)
+    targets = {remote: [] for remote in PREFERRED_REMOTES if remote in existing}
+    if git.refs:
+        branch = git.refs.current_branch()
+    else:
+        branch = git.run("branch", "--show-current")
+    if branch:
+        upstream = git.run(
+            "for-each-ref",
+            "--format=%(upstream:remotename) %(upstream:remoteref)",
+            f"refs/heads/{branch}",
+        )
+        remote, _, merge = (upstream or "").partition(" ")
+        if remote in existing and remote not in targets and merge:
+            name = merge.removeprefix("refs/heads/")
+            targets[remote] = [f"+{merge}:refs/remotes/{remote}/{name}"]
+    return targets
+
+
+def fetch_remotes(
+    git_dir: str, cwd: str | None = None, max_age: float = FETCH_MAX_AGE
+) -> None:
+    """Fetch the remotes the strategies use, concurrently, unless fresh.
+
+    Nothing is fetched if FETCH_HEAD was written less than ``max_age``
+    seconds ago.  Like ``git fetch --multiple``, FETCH_HEAD is emptied
+    first and each remote's fetch appends to it, leaving automatic
+    maintenance for later.  If every fetch fails, FETCH_HEAD is put
+    back as it was, so a failed fetch never makes the next one skip.
+    """
+    fetch_head = os.path.join(git_dir, "FETCH_HEAD")
+    with contextlib.suppress(OSError):
+        age = time.time() - os.stat(fetch_head).st_mtime
+        if age < max_age:
+            debug(f"Skipping fetch: FETCH_HEAD is {age:.1f}s old (max {max_age:g}s)")
+            return
+
+    with GitSession(cwd) as git:
+        targets = fetch_targets(git)
+    if not targets:
+        debug("No remotes to fetch")
+        return
+    try:
+        with open(fetch_head, "rb") as f:
+            saved = (f.read(), os.fstat(f.fileno()))
+    except OSError:
+        saved = None
+    with contextlib.suppress(OSError):
+        open(fetch_head, "w").close()
+
+    def fetch(remote: str) -> tuple[bool, float]:
+        start = time.perf_counter()
+        output = run_git(
+            "fetch",
+            "--append",
+            "--prune",
+            "--quiet",
+            "--no-tags",
+            "--no-auto-gc",
+            "--no-write-commit-graph",
+            remote,
+            *targets[remote],
+            cwd=cwd,
+        )
+        return output is not None, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        results = dict(zip(targets, pool.map(fetch, targets)))
+    for remote, (ok, seconds) in results.items():
+        status = "fetched" if ok else "failed to fetch"
+        debug(f"  {status} {remote} in {seconds:.2f}s")
+    debug(f"Fetching took {time.perf_counter() - start:.2f}s")
+    if not any(ok for ok, _ in results.values()):
+        with contextlib.suppress(OSError):
+            if saved is None:
+                os.unlink(fetch_head)
+            else:
+                content, st = saved
+                with open(fetch_head, "wb") as f:
+                    f.write(content)
+                os.utime(fetch_head, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def resolve_base_branch(
+    git_dirs: tuple[str, str], args: argparse.Namespace, cwd: str | None = None
+) -> tuple[str | None, str | None]:
+    """Answer from a daemon, the result cache or the strategies, in that order."""
+    use_daemon = not (args.no_cache or args.no_daemon or TRACER)
+    answer = query_daemon(git_dirs[0]) if use_daemon else None
+    if answer:
+        for line in answer.get("debug", []):
+            debug(line)
+        debug(f"Answered by daemon on {daemon_socket_path(git_dirs[0])}")
+        return answer["branch"], answer["source"]
+
+    cache = None if args.no_cache else ResultCache(*git_dirs)
+    key = cache.key() if cache else None
+    cached = cache.get(key) if cache and key else None
+    if cached:
+        debug(f"Cache hit in {cache.path}")
+        return cached
+    if cache:
+        debug("Cache miss")
+    with GitSession(cwd) as git:
+        branch, source = find_base_branch(git, concurrent=args.concurrent)
+    if cache and key and branch and source:
+        cache.put(key, branch, source)
+    return branch, source
+
+
+def precompute(git_dirs: tuple[str, str], args: argparse.Namespace) -> int:
+    """Recompute the answer and store it for --cached-only.
+
+    Each run first records a request by appending to the lock file.
+    One run at a time computes; a run that finds the lock taken just
+    leaves its request, and the running one computes again before it
+    exits if any arrived meanwhile, so a burst of ref updates costs at
+    most one extra computation.
+    """
+    lock_path = os.path.join(git_dirs[0], PRECOMPUTED_LOCK)
+    with open(lock_path, "ab") as lock:
+        lock.write(b".")
+        lock.flush()
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                debug("Precompute already running; it will pick this up")
+                return 0
+            try:
+                lock.truncate(0)
+                seen = 0
+                while True:
+                    # Keyed before computing, so a ref update meanwhile
+                    # leaves the answer stale rather than wrongly current
+                    key = ResultCache(*git_dirs).key()
+                    branch, source = resolve_base_branch(git_dirs, args)
+                    write_precomputed(git_dirs[0], key, branch, source)
+                    size = os.fstat(lock.fileno()).st_size
+                    if size == seen:
+                        break
+                    seen = size
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            if os.fstat(lock.fileno()).st_size <= seen:
+                return 0
+
+
+def write_precomputed(
+    git_dir: str, key: str, branch: str | None, source: str | None
+) -> None:
+    """Store an answer and the ResultCache key of the repository state it
+    is for, replacing the file atomically."""
+    entry = {"key": key, "branch": branch, "source": source, "time": time.time()}
+    try:
+        with tempfile.NamedTemporaryFile(
+            "w", dir=git_dir, prefix=PRECOMPUTED_FILE, delete=False
+        ) as f:
+            json.dump(entry, f)
+        os.replace(f.name, os.path.join(git_dir, PRECOMPUTED_FILE))
+    except OSError as e:
+        debug(f"Could not write precomputed answer: {e}")
+        with contextlib.suppress(OSError):
+            os.unlink(f.name)
+
+
+def print_precomputed() -> int:
+    """Print the precomputed answer for the current state, running no git.
+
+    The answer is only used if the ResultCache key, which covers HEAD's
+    commit, the current branch and the remote refs, still matches.  The
+    repository is found by reading files only, so this fails when git's
+    own discovery would be needed (e.g. with GIT_DIR set).
+    """
+    git_dirs = discover_git_dirs()
+    if not git_dirs:
+        print("Error: not a git repository", file=sys.stderr)
+        return 1
+    path = os.path.join(git_dirs[0], PRECOMPUTED_FILE)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        entry = None
+    if not isinstance(entry, dict) or not entry.get("branch"):
+        debug(f"No precomputed answer in {path}")
+    elif entry.get("key") != ResultCache(*git_dirs).key():
+        debug(f"Precomputed answer in {path} is out of date")
+    else:
+        debug(f"Result: {entry['branch']} (via {entry.get('source')}, precomputed)")
+        print(entry["branch"])
+        return 0
+    print("Error: no precomputed base branch", file=sys.stderr)
+    return 1
+
+
+def hook_script(name: str) -> str:
+    """Return the hook that triggers --precompute in the background."""
+    command = shlex.join([sys.executable, os.path.abspath(__file__), "--precompute"])
+    lines = [
+        "#!/bin/sh",
+        HOOK_MARKER,
+        "# Recomputes the base branch in the background for --cached-only.",
+    ]
+    if name in ("post-rewrite", "reference-transaction"):
+        lines.append("cat >/dev/null")
+    if name == "reference-transaction":
+        lines.append('[ "$1" = committed ] || exit 0')
+    lines.append(f"{command} </dev/null >/dev/null 2>&1 &")
+    return "\n".join(lines) + "\n"
+
+
+def install_hooks(uninstall: bool = False) -> int:
+    """Install (or remove) the hooks that keep the precomputed answer fresh.
+
+    Hooks go where git looks for them, honouring core.hooksPath.  A
+    hook of the same name not installed by this script is left alone.
+    """
+    hooks_dir = run_git("rev-parse", "--git-path", "hooks")
+    if not hooks_dir:
+        print("Error: not a git repository", file=sys.stderr)
+        return 1
+    hooks_dir = os.path.abspath(hooks_dir)
+    status = 0
+    for name in HOOK_NAMES:
+        path = os.path.join(hooks_dir, name)
+        existing = read_git_file(path)
+        if existing is not None and HOOK_MARKER not in existing:
+            print(f"Skipping {path}: not installed by this script", file=sys.stderr)
+            status = 1
+        elif uninstall:
+            if existing is not None:
+                os.unlink(path)
+                debug(f"Removed {path}")
+        else:
+            os.makedirs(hooks_dir, exist_ok=True)
+            with open(path, "w") as f:
+                f.write(hook_script(name))
+            os.chmod(path, 0o755)
+            debug(f"Installed {path}")
+    return status
+
+
+def run(args: argparse.Namespace) -> int:
+    """Resolve and print the base branch for the current directory."""
+    if args.cached_only:
+        return print_precomputed()
+    if args.install_hooks or args.uninstall_hooks:
+        return install_hooks(uninstall=args.uninstall_hooks)
 
     # Ensure we're in a git repository
-    if not run_git("rev-parse", "--git-dir"):
+    git_dirs = locate_git_dirs()
+    if not git_dirs:
         print("Error: not a git repository", file=sys.stderr)
         return 1
 
     if args.fetch:
         debug("Fetching latest remote refs")
-        run_git("fetch", "--prune", "--quiet")
+        fetch_remotes(git_dirs[0], max_age=args.fetch_max_age)
 
-    branch, source = find_base_branch()
+    if args.serve:
+        return Daemon(*git_dirs, args.concurrent).serve(args.idle_timeout)
+    if args.precompute:
+        return precompute(git_dirs, args)
+
+    branch, source = resolve_base_branch(git_dirs, args)
     if not branch:
         print("Error: could not determine base branch", file=sys.stderr)
         return 1
@@ -290,5 +3227,59 @@ def main() -> int:
     return 0
 
 
+def resolve_repo(path: str, args: argparse.Namespace) -> dict:
+    """Resolve one repository for --batch, reporting failures in the result."""
+    start = time.perf_counter()
+    result: dict = {"path": path}
+    try:
+        git_dirs = locate_git_dirs(path) if os.path.isdir(path) else None
+        if not git_dirs:
+            result["error"] = "not a git repository"
+        else:
+            if args.fetch:
+                fetch_remotes(git_dirs[0], cwd=path, max_age=args.fetch_max_age)
+            branch, source = resolve_base_branch(git_dirs, args, cwd=path)
+            if branch:
+                result.update(branch=branch, source=source)
+            else:
+                result["error"] = "could not determine base branch"
+    except Exception as e:  # one broken repository must not end the batch
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def configure_worker(debug_on: bool, git_jobs: int, read_objects: bool) -> None:
+    """Set a --batch worker's options, which only a forked worker inherits."""
+    global DEBUG, GIT_JOBS, READ_OBJECTS
+    DEBUG = debug_on
+    GIT_JOBS = git_jobs
+    READ_OBJECTS = read_objects
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    """Resolve many repositories on a process pool, streaming NDJSON.
+
+    Paths come from the command line, or from stdin (one per line) if
+    none are given.  Results are printed as each repository finishes,
+    so their order is not the input order; each line carries its path.
+    The options main() sets as globals are passed to each worker, as
+    workers started by spawn or forkserver do not inherit them.
+    """
+    paths = args.paths or [line.strip() for line in sys.stdin if line.strip()]
+    failed = False
+    with ProcessPoolExecutor(
+        max_workers=args.jobs,
+        initializer=configure_worker,
+        initargs=(DEBUG, GIT_JOBS, READ_OBJECTS),
+    ) as pool:
+        futures = [pool.submit(resolve_repo, path, args) for path in paths]
+        for future in as_completed(futures):
+            result = future.result()
+            failed |= "error" in result
+            print(json.dumps(result), flush=True)
+    return 1 if failed else 0
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the ai-safe-rm script.
+
+Generates trees of files in a mix of states (unmodified and modified
+tracked files, untracked files, untracked copies of content git
+already stores, and wholly untracked subdirectories), then times
+``ai-safe-rm -r`` deleting each one.  A separate run per tree counts
+the git, md5sum and realpath processes started, through a PATH shim.
+Results are written as a JSON report; the run fails if any command
+starts more processes than a budget growing slowly with the tree, or,
+given a stored baseline, if any timing or process count regresses
+beyond it.
+
+Examples:
+    # Trees of 1k, 10k and 100k files
+    python3 tests/bench_ai_safe_rm.py --report report.json
+
+    # Store a baseline, then check later runs against it
+    python3 tests/bench_ai_safe_rm.py --save-baseline baseline.json
+    python3 tests/bench_ai_safe_rm.py --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPT = Path(__file__).parent.parent / "bin" / "ai-safe-rm"
+
+# Identity for generated commits, and no user configuration, so trees
+# built from the same parameters are identical.
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "Bench",
+    "GIT_AUTHOR_EMAIL": "bench@example.com",
+    "GIT_COMMITTER_NAME": "Bench",
+    "GIT_COMMITTER_EMAIL": "bench@example.com",
+    "GIT_CONFIG_NOSYSTEM": "1",
+    "GIT_CONFIG_GLOBAL": os.devnull,
+}
+
+# Commands whose invocations are counted by the PATH shim
+COUNTED = ("git", "md5sum", "realpath")
+
+# Share of files in each state; the rest are unmodified tracked files
+STATES = {
+    "modified": 0.2,
+    "untracked": 0.2,
+    "stored": 0.05,
+    "untracked_dir": 0.05,
+}
+
+# Files per generated directory, and directories per parent
+FILES_PER_DIR = 50
+DIRS_PER_PARENT = 20
+
+# Most processes of each counted command a run may start: a fixed
+# allowance plus a share per file.  The script classifies and hashes
+# files and labels untracked directories in bulk, so the counted
+# commands start a few times per job, never once per file or
+# directory; one per file is the regression this catches.
+BUDGET_FIXED = 20
+BUDGET_PER_FILE = 0.05
+
+# Timings below this many seconds are within noise, so a regression
+# must exceed the baseline by this much as well as by the tolerance.
+TIME_SLACK = 0.1
+
+
+def git(*args, cwd, input=None):
+    """Run a git command for repository setup, failing loudly."""
+    result = subprocess.run(
+        ["git", *args],
+        input=input,
+        capture_output=True,
+        check=False,
+        cwd=cwd,
+        env=dict(os.environ, **GIT_ENV),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"git {' '.join(args)} failed: {result.stderr.decode(errors='replace')}"
+        )
+    return result.stdout.decode()
+
+
+def tree_paths(count):
+    """Return ``count`` file paths spread over nested directories."""
+    paths = []
+    for i in range(count):
+        leaf = i // FILES_PER_DIR
+        parent = leaf // DIRS_PER_PARENT
+        paths.append(f"tree/p{parent}/d{leaf}/file{i}.txt")
+    return paths
+
+
+def build_repo(path, files, seed):
+    """Create a repository at ``path`` whose ``tree`` directory holds
+    ``files`` files in the mix of states given by STATES.
+
+    Returns the number of manifest records deleting the tree should
+    write: one per modified, untracked or stored file, and one per
+    untracked subdirectory, which is moved whole.
+    """
+    rnd = random.Random(seed)
+    path.mkdir(parents=True)
+    git("init", "-q", "--template=", cwd=path)
+
+    # The first file in each directory stays tracked, so no generated
+    # directory is wholly untracked except the build ones
+    states = {}
+    for i, rel_path in enumerate(tree_paths(files)):
+        roll = rnd.random() if i % FILES_PER_DIR else 1
+        state = "tracked"
+        for name, share in STATES.items():
+            if roll < share:
+                state = name
+                break
+            roll -= share
+        states[rel_path] = state
+
+    # Commit every file that is tracked, then change the working tree
+    tracked = [p for p, s in states.items() if s in ("tracked", "modified")]
+    for rel_path in tracked:
+        file = path / rel_path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(f"committed {rel_path}\n")
+    git("add", "tree", cwd=path)
+    git("commit", "-q", "-m", "Add tree", cwd=path)
+
+    contents = {
+        "modified": lambda rel_path: f"modified {rel_path}\n",
+        "untracked": lambda rel_path: f"untracked {rel_path}\n",
+        "stored": lambda rel_path: f"committed {rnd.choice(tracked)}\n",
+        "untracked_dir": lambda rel_path: f"built {rel_path}\n",
+    }
+    records = 0
+    untracked_dirs = set()
+    for rel_path, state in states.items():
+        if state == "tracked":
+            continue
+        file = path / rel_path
+        if state == "untracked_dir":
+            file = file.parent / "build" / file.name
+            untracked_dirs.add(file.parent)
+        else:
+            records += 1
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(contents[state](rel_path))
+    return records + len(untracked_dirs)
+
+
+def make_shim(directory, log):
+    """Create wrappers for the COUNTED commands that log each call.
+
+    Returns an environment with the wrappers first on PATH.
+    """
+    directory.mkdir(exist_ok=True)
+    for command in COUNTED:
+        shim = directory / command
+        shim.write_text(
+            f'#!/bin/sh\necho {command} >> "{log}"\n'
+            f'exec {shutil.which(command)} "$@"\n'
+        )
+        shim.chmod(0o755)
+    return dict(os.environ, PATH=f"{directory}{os.pathsep}{os.environ['PATH']}")
+
+
+def delete_tree(source, work, jobs, env=None):
+    """Copy the built repository to ``work`` and delete its tree.
+
+    Returns the seconds ai-safe-rm took and the manifest record count.
+    """
+    if work.exists():
+        shutil.rmtree(work)
+    shutil.copytree(source, work, symlinks=True)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [str(SCRIPT), "-j", str(jobs), "-r", "tree"],
+        capture_output=True,
+        text=True,
+        check=False,
+        cwd=work,
+        env=env,
+    )
+    seconds = time.perf_counter() - start
+    if result.returncode != 0 or (work / "tree").exists():
+        raise RuntimeError(f"ai-safe-rm failed: {result.stderr}")
+    manifest = work / ".safe-rm" / "manifest.jsonl"
+    return seconds, len(manifest.read_text().splitlines())
+
+
+def measure(workdir, files, args):
+    """Build a tree of ``files`` files and measure deleting it."""
+    source = workdir / f"repo-{files}"
+    work = workdir / f"work-{files}"
+    start = time.perf_counter()
+    expected = build_repo(source, files, args.seed)
+    build_seconds = time.perf_counter() - start
+
+    seconds = []
+    for _ in range(args.repeat):
+        elapsed, _ = delete_tree(source, work, args.jobs)
+        seconds.append(elapsed)
+
+    log = workdir / "calls.log"
+    log.write_text("")
+    env = make_shim(workdir / "shim", log)
+    _, records = delete_tree(source, work, args.jobs, env=env)
+    calls = log.read_text().split()
+    processes = {command: calls.count(command) for command in COUNTED}
+    shutil.rmtree(work)
+
+    return {
+        "files": files,
+        "build_seconds": build_seconds,
+        "seconds": statistics.median(seconds),
+        "processes": processes,
+        "per_file": {name: count / files for name, count in processes.items()},
+        "records": records,
+        "expected_records": expected,
+    }
+
+
+def run_benchmark(args, workdir):
+    """Build each tree and return the benchmark report."""
+    results = {str(files): measure(workdir, files, args) for files in args.files}
+    return {
+        "params": {
+            "files": args.files,
+            "jobs": args.jobs,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "git": git("--version", cwd=workdir).strip(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def process_budget(files, per_file=BUDGET_PER_FILE):
+    """Return the most processes of one command deleting ``files`` may start."""
+    return int(BUDGET_FIXED + per_file * files)
+
+
+def find_problems(report, per_file):
+    """Describe every tree whose deletion went wrong or over budget."""
+    problems = []
+    for name, result in report["results"].items():
+        if result["records"] != result["expected_records"]:
+            problems.append(
+                f"{name} files: {result['records']} manifest records, "
+                f"expected {result['expected_records']}"
+            )
+        budget = process_budget(result["files"], per_file)
+        for command, count in result["processes"].items():
+            if count > budget:
+                problems.append(
+                    f"{name} files: {count} {command} processes, "
+                    f"over the budget of {budget}"
+                )
+    return problems
+
+
+def find_regressions(report, baseline, tolerance):
+    """Describe every measurement that got worse than the baseline."""
+    problems = []
+    if baseline.get("params") != report["params"]:
+        problems.append(
+            f"parameters differ from baseline: {baseline.get('params')} "
+            f"!= {report['params']}"
+        )
+        return problems
+    for name, before in baseline.get("results", {}).items():
+        after = report["results"].get(name)
+        if after is None:
+            problems.append(f"{name} files: missing from this run")
+            continue
+        for command, count in before["processes"].items():
+            if after["processes"].get(command, 0) > count:
+                problems.append(
+                    f"{name} files: {after['processes'][command]} {command} "
+                    f"processes, baseline {count}"
+                )
+        limit = max(before["seconds"] * tolerance, before["seconds"] + TIME_SLACK)
+        if after["seconds"] > limit:
+            problems.append(
+                f"{name} files: {after['seconds']:.3f}s, baseline "
+                f"{before['seconds']:.3f}s (limit {limit:.3f}s)"
+            )
+    return problems
+
+
+def print_summary(report):
+    """Print a human-readable table of the results to stderr."""
+    print(f"ai-safe-rm -j {report['params']['jobs']} -r", file=sys.stderr)
+    for result in report["results"].values():
+        counts = "  ".join(
+            f"{count:4} {command}" for command, count in result["processes"].items()
+        )
+        print(
+            f"  {result['files']:7} files {result['seconds'] * 1000:10.1f} ms  "
+            f"{counts}  (built in {result['build_seconds']:.1f}s)",
+            file=sys.stderr,
+        )
+
+
+def file_counts(value):
+    """Parse a comma-separated list of positive file counts."""
+    try:
+        counts = [int(count) for count in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a list of numbers: {value}")
+    if not counts or min(counts) < 1:
+        raise argparse.ArgumentTypeError(f"file counts must be positive: {value}")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark ai-safe-rm on synthetic trees of files"
+    )
+    parser.add_argument(
+        "--files",
+        type=file_counts,
+        default=[1000, 10000, 100000],
+        help="Comma-separated tree sizes (default 1000,10000,100000)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="Jobs given to ai-safe-rm -j (fixed, so process counts do "
+        "not depend on the machine)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Timed runs per tree (median kept)"
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=BUDGET_PER_FILE,
+        help="Processes of each counted command allowed per file, beyond "
+        f"a fixed {BUDGET_FIXED}",
+    )
+    parser.add_argument("--workdir", help="Build the trees here and keep them")
+    parser.add_argument("--report", help="Write the JSON report here (default stdout)")
+    parser.add_argument(
+        "--baseline", help="Fail if this run regresses against the stored report"
+    )
+    parser.add_argument("--save-baseline", help="Store this run's report as a baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="Allowed slowdown factor against the baseline",
+    )
+    args = parser.parse_args(argv)
+    if args.jobs < 1 or args.repeat < 1:
+        parser.error("--jobs and --repeat must be at least 1")
+
+    if args.workdir:
+        workdir = Path(args.workdir)
+        if workdir.exists():
+            parser.error(f"{workdir} already exists")
+        workdir.mkdir(parents=True)
+        report = run_benchmark(args, workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="ai-safe-rm-bench-") as tmp:
+            report = run_benchmark(args, Path(tmp))
+
+    print_summary(report)
+    output = json.dumps(report, indent=2) + "\n"
+    if args.report:
+        Path(args.report).write_text(output)
+    else:
+        sys.stdout.write(output)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(output)
+
+    problems = find_problems(report, args.budget)
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        problems += find_regressions(report, baseline, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
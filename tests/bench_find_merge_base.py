@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the describing-prs find-merge-base.py script.
+
+Generates a synthetic repository whose remotes are local bare
+repositories, then times each base branch strategy, the whole
+find_base_branch() run and a cold run of the script itself, counting
+the git processes each one starts.  Results are written as a JSON
+report; given a stored baseline, the run fails if any timing or
+process count regresses beyond it.
+
+Examples:
+    # 10k commits, 5k remote branches spread over 3 remotes
+    python3 tests/bench_find_merge_base.py --report report.json
+
+    # Store a baseline, then check later runs against it
+    python3 tests/bench_find_merge_base.py --save-baseline baseline.json
+    python3 tests/bench_find_merge_base.py --baseline baseline.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPT = (
+    Path(__file__).parent.parent
+    / ".agents"
+    / "skills"
+    / "describing-prs"
+    / "scripts"
+    / "find-merge-base.py"
+)
+
+# Identity and clock for generated commits, so repositories built
+# from the same parameters are identical.
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "Bench",
+    "GIT_AUTHOR_EMAIL": "bench@example.com",
+    "GIT_COMMITTER_NAME": "Bench",
+    "GIT_COMMITTER_EMAIL": "bench@example.com",
+    "GIT_CONFIG_NOSYSTEM": "1",
+    "GIT_CONFIG_GLOBAL": os.devnull,
+}
+EPOCH = 1_600_000_000
+
+# Timings below this many seconds are within noise, so a regression
+# must exceed the baseline by this much as well as by the tolerance.
+TIME_SLACK = 0.05
+
+
+def load_script():
+    """Import find-merge-base.py as a module."""
+    spec = importlib.util.spec_from_file_location("find_merge_base", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+fmb = load_script()
+
+
+def git(*args, cwd, input=None):
+    """Run a git command for repository setup, failing loudly."""
+    result = subprocess.run(
+        ["git", *args],
+        input=input,
+        capture_output=True,
+        check=False,
+        cwd=cwd,
+        env=dict(os.environ, **GIT_ENV),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"git {' '.join(args)} failed: {result.stderr.decode(errors='replace')}"
+        )
+    return result.stdout.decode()
+
+
+def build_repo(path, commits, branches, remotes, default_branch, seed):
+    """Create the benchmark repository at ``path``.
+
+    The mainline has ``commits`` commits, with a short side branch
+    merged back every 50 commits.  ``branches`` remote branches, spread
+    round-robin over ``remotes`` bare repositories (the first named
+    origin), each fork from a random mainline commit with one to three
+    commits of their own.  The checked-out feature branch is built on
+    top of one of origin's, which is therefore the expected base.
+
+    Returns that expected base branch.
+    """
+    rnd = random.Random(seed)
+    work = path / "work"
+    work.mkdir(parents=True)
+    git("init", "-q", "-b", "feature", cwd=work)
+
+    stream = []
+    mark = 0
+    clock = EPOCH
+
+    def add_commit(ref, message, parents):
+        nonlocal mark, clock
+        mark += 1
+        clock += 60
+        stream.append(
+            f"commit {ref}\nmark :{mark}\n"
+            f"committer Bench <bench@example.com> {clock} +0000\n"
+            f"data {len(message)}\n{message}\n"
+        )
+        if parents:
+            stream.append(f"from :{parents[0]}\n")
+            stream.extend(f"merge :{p}\n" for p in parents[1:])
+        stream.append("\n")
+        return mark
+
+    mainline = []
+    for i in range(commits):
+        parents = mainline[-1:]
+        if i and i % 50 == 0:
+            side = add_commit("refs/bench/side", f"side {i}", mainline[-5:-4])
+            parents = [mainline[-1], side]
+        ref = f"refs/bench/{default_branch}"
+        mainline.append(add_commit(ref, f"main {i}", parents))
+
+    remote_names = [f"remote{i}" for i in range(remotes)]
+    if remote_names:
+        remote_names[0] = "origin"
+    tips = []
+    for i in range(branches):
+        remote = remote_names[i % len(remote_names)]
+        ref = f"refs/bench/{remote}/topic-{i}"
+        tip = rnd.choice(mainline)
+        for j in range(rnd.randint(1, 3)):
+            tip = add_commit(ref, f"topic {i}.{j}", [tip])
+        tips.append((remote, f"topic-{i}", tip))
+
+    origin_tips = [tip for tip in tips if tip[0] == "origin"]
+    _, name, head = rnd.choice(origin_tips or [("origin", "", mainline[-1])])
+    for i in range(3):
+        head = add_commit("refs/heads/feature", f"feature {i}", [head])
+    git("fast-import", "--quiet", cwd=work, input="".join(stream).encode())
+
+    for remote in remote_names:
+        bare = path / f"{remote}.git"
+        git("init", "-q", "--bare", str(bare), cwd=path)
+        git("remote", "add", remote, str(bare), cwd=work)
+        git(
+            "push",
+            "-q",
+            remote,
+            f"refs/bench/{remote}/*:refs/heads/*",
+            f"refs/bench/{default_branch}:refs/heads/{default_branch}",
+            cwd=work,
+        )
+        git("fetch", "-q", remote, cwd=work)
+    if remote_names:
+        git(
+            "symbolic-ref",
+            "refs/remotes/origin/HEAD",
+            f"refs/remotes/origin/{default_branch}",
+            cwd=work,
+        )
+    scratch = git("for-each-ref", "--format=delete %(refname)", "refs/bench/", cwd=work)
+    git("update-ref", "--stdin", cwd=work, input=scratch.encode())
+    git("checkout", "-q", "feature", cwd=work)
+    return f"origin/{name or default_branch}"
+
+
+def measure(repo, run, repeat):
+    """Time ``run(session)`` on fresh sessions; report the median."""
+    seconds = []
+    for _ in range(repeat):
+        with fmb.GitSession(cwd=str(repo)) as session:
+            start = time.perf_counter()
+            result = run(session)
+            seconds.append(time.perf_counter() - start)
+            spawned = session.spawned
+    return {
+        "seconds": statistics.median(seconds),
+        "git_processes": spawned,
+        "result": result[0] if isinstance(result, tuple) else result,
+    }
+
+
+def measure_script(repo, repeat):
+    """Time cold runs of the script itself, counting every git it starts."""
+    shim_dir = repo.parent / "shim"
+    shim_dir.mkdir(exist_ok=True)
+    log = repo.parent / "git-calls.log"
+    shim = shim_dir / "git"
+    shim.write_text(f'#!/bin/sh\necho >> "{log}"\nexec {shutil.which("git")} "$@"\n')
+    shim.chmod(0o755)
+    env = dict(os.environ, PATH=f"{shim_dir}{os.pathsep}{os.environ['PATH']}")
+
+    seconds = []
+    for _ in range(repeat):
+        log.write_text("")
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, str(SCRIPT), "--no-cache"],
+            capture_output=True,
+            text=True,
+            check=False,
+            cwd=repo,
+            env=env,
+        )
+        seconds.append(time.perf_counter() - start)
+    return {
+        "seconds": statistics.median(seconds),
+        "git_processes": len(log.read_text().splitlines()),
+        "result": result.stdout.strip() or None,
+    }
+
+
+def run_benchmark(args, workdir):
+    """Build the repository and return the benchmark report."""
+    start = time.perf_counter()
+    expected = build_repo(
+        workdir,
+        args.commits,
+        args.branches,
+        args.remotes,
+        args.default_branch,
+        args.seed,
+    )
+    build_seconds = time.perf_counter() - start
+    repo = workdir / "work"
+
+    runs = {
+        "try_upstream": fmb.try_upstream,
+        "try_common_default_branches": fmb.try_common_default_branches,
+        "try_closest_remote_branch": fmb.try_closest_remote_branch,
+        "try_origin_head": fmb.try_origin_head,
+        "find_base_branch": fmb.find_base_branch,
+    }
+    results = {name: measure(repo, run, args.repeat) for name, run in runs.items()}
+    results["script"] = measure_script(repo, args.repeat)
+
+    return {
+        "params": {
+            "commits": args.commits,
+            "branches": args.branches,
+            "remotes": args.remotes,
+            "default_branch": args.default_branch,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "git": git("--version", cwd=workdir).strip(),
+            "platform": platform.platform(),
+        },
+        "build_seconds": build_seconds,
+        "expected_base": expected,
+        "results": results,
+    }
+
+
+def find_regressions(report, baseline, tolerance):
+    """Describe every measurement that got worse than the baseline."""
+    problems = []
+    if baseline.get("params") != report["params"]:
+        problems.append(
+            f"parameters differ from baseline: {baseline.get('params')} "
+            f"!= {report['params']}"
+        )
+        return problems
+    for name, before in baseline.get("results", {}).items():
+        after = report["results"].get(name)
+        if after is None:
+            problems.append(f"{name}: missing from this run")
+            continue
+        if after["git_processes"] > before["git_processes"]:
+            problems.append(
+                f"{name}: {after['git_processes']} git processes, "
+                f"baseline {before['git_processes']}"
+            )
+        limit = max(before["seconds"] * tolerance, before["seconds"] + TIME_SLACK)
+        if after["seconds"] > limit:
+            problems.append(
+                f"{name}: {after['seconds']:.3f}s, baseline "
+                f"{before['seconds']:.3f}s (limit {limit:.3f}s)"
+            )
+        if after["result"] != before["result"]:
+            problems.append(
+                f"{name}: result {after['result']!r}, baseline {before['result']!r}"
+            )
+    return problems
+
+
+def print_summary(report):
+    """Print a human-readable table of the results to stderr."""
+    print(
+        f"{report['params']['commits']} commits, "
+        f"{report['params']['branches']} remote branches, "
+        f"{report['params']['remotes']} remotes "
+        f"(built in {report['build_seconds']:.1f}s)",
+        file=sys.stderr,
+    )
+    for name, result in report["results"].items():
+        print(
+            f"  {name:30} {result['seconds'] * 1000:9.1f} ms "
+            f"{result['git_processes']:4} git  -> {result['result']}",
+            file=sys.stderr,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark find-merge-base.py on a synthetic repository"
+    )
+    parser.add_argument(
+        "--commits", type=int, default=10000, help="Mainline history depth"
+    )
+    parser.add_argument(
+        "--branches", type=int, default=5000, help="Number of remote branches"
+    )
+    parser.add_argument("--remotes", type=int, default=3, help="Number of remotes")
+    parser.add_argument(
+        "--default-branch",
+        default="trunk",
+        help="Mainline branch name (the default is not one of the common "
+        "default branch names, so the full run reaches the closest-branch scan)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per measurement (median kept)"
+    )
+    parser.add_argument("--workdir", help="Build the repository here and keep it")
+    parser.add_argument("--report", help="Write the JSON report here (default stdout)")
+    parser.add_argument(
+        "--baseline", help="Fail if this run regresses against the stored report"
+    )
+    parser.add_argument("--save-baseline", help="Store this run's report as a baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="Allowed slowdown factor against the baseline",
+    )
+    args = parser.parse_args(argv)
+    if args.remotes < 1:
+        parser.error("--remotes must be at least 1")
+
+    if args.workdir:
+        workdir = Path(args.workdir)
+        if workdir.exists():
+            parser.error(f"{workdir} already exists")
+        report = run_benchmark(args, workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="find-merge-base-bench-") as tmp:
+            report = run_benchmark(args, Path(tmp))
+
+    print_summary(report)
+    output = json.dumps(report, indent=2) + "\n"
+    if args.report:
+        Path(args.report).write_text(output)
+    else:
+        sys.stdout.write(output)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(output)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        problems = find_regressions(report, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}", file=sys.stderr)
+        if problems:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,6 +9,7 @@ Tests the git-aware file deletion behavior including:
 - Recursive directory deletion
 """
 
+import importlib.util
 import os
 import subprocess
 import tempfile
@@ -16,38 +17,67 @@ import shutil
 from pathlib import Path
 import unittest
 import hashlib
+import json
+
+AI_SAFE_RM = Path(__file__).parent.parent / "bin" / "ai-safe-rm"
+
+# Empty repository, with the test identity configured, that each test
+# starts from as a hardlinked copy; built once by setUpModule().
+TEMPLATE_REPO = None
+
+
+def setUpModule():
+    """Build the template repository shared by every test."""
+    global TEMPLATE_REPO
+    TEMPLATE_REPO = Path(tempfile.mkdtemp(prefix="ai-safe-rm-template-"))
+    for args in [
+        ["init", "-q", "--template="],
+        ["config", "user.email", "test@example.com"],
+        ["config", "user.name", "Test User"],
+    ]:
+        subprocess.run(
+            ["git", *args], capture_output=True, check=True, cwd=TEMPLATE_REPO
+        )
+
+
+def tearDownModule():
+    """Remove the template repository."""
+    shutil.rmtree(TEMPLATE_REPO)
 
 
 class TestAiSafeRm(unittest.TestCase):
     """Test cases for ai-safe-rm script."""
 
     def setUp(self):
-        """Create a temporary git repository for testing."""
-        self.test_dir = tempfile.mkdtemp(prefix="ai-safe-rm-test-")
-        self.original_dir = os.getcwd()
-        os.chdir(self.test_dir)
+        """Create a temporary git repository copied from the template.
 
-        # Initialize git repo
-        self.run_git("init")
-        self.run_git("config", "user.email", "test@example.com")
-        self.run_git("config", "user.name", "Test User")
+        Its files are hardlinks to the template's; git replaces rather
+        than rewrites the files it changes, so the template is never
+        modified.
+        """
+        self.test_dir = tempfile.mkdtemp(prefix="ai-safe-rm-test-")
+        self.repo = Path(self.test_dir)
+        shutil.copytree(
+            TEMPLATE_REPO, self.repo, copy_function=os.link, dirs_exist_ok=True
+        )
 
-        # Get path to ai-safe-rm script
-        repo_root = Path(__file__).parent.parent
-        self.ai_safe_rm = repo_root / "bin" / "ai-safe-rm"
+        self.ai_safe_rm = AI_SAFE_RM
         self.assertTrue(
             self.ai_safe_rm.exists(), f"ai-safe-rm not found at {self.ai_safe_rm}"
         )
 
     def tearDown(self):
         """Clean up temporary test directory."""
-        os.chdir(self.original_dir)
         shutil.rmtree(self.test_dir)
 
     def run_git(self, *args):
-        """Run a git command in the test directory."""
+        """Run a git command in the test repository."""
         result = subprocess.run(
-            ["git"] + list(args), capture_output=True, text=True, check=False
+            ["git"] + list(args),
+            capture_output=True,
+            text=True,
+            check=False,
+            cwd=self.repo,
         )
         if result.returncode != 0:
             raise RuntimeError(
@@ -57,13 +87,15 @@ class TestAiSafeRm(unittest.TestCase):
             )
         return result
 
-    def run_safe_rm(self, *args, expect_success=True):
-        """Run ai-safe-rm with given arguments."""
+    def run_safe_rm(self, *args, expect_success=True, cwd=None, env=None):
+        """Run ai-safe-rm with given arguments in the test repository or cwd."""
         result = subprocess.run(
             [str(self.ai_safe_rm)] + list(args),
             capture_output=True,
             text=True,
             check=False,
+            cwd=cwd or self.repo,
+            env=env,
         )
         if expect_success and result.returncode != 0:
             raise RuntimeError(
@@ -74,9 +106,10 @@ class TestAiSafeRm(unittest.TestCase):
         return result
 
     def create_file(self, path, content="test content"):
-        """Create a file with given content."""
-        Path(path).parent.mkdir(parents=True, exist_ok=True)
-        Path(path).write_text(content)
+        """Create a file in the test repository with given content."""
+        path = self.repo / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
 
     def add_to_git(self, *paths, commit_msg):
         """Add files to git and commit them.
@@ -88,10 +121,42 @@ class TestAiSafeRm(unittest.TestCase):
         self.run_git("add", *paths)
         self.run_git("commit", "-m", commit_msg)
 
+    def counting_env(self, *commands):
+        """Return an environment that logs each call of the commands.
+
+        The log, self.calls_log, gets one line per call naming the
+        command.
+        """
+        shim_dir = Path(tempfile.mkdtemp(prefix="ai-safe-rm-shim-"))
+        self.addCleanup(shutil.rmtree, shim_dir)
+        self.calls_log = shim_dir / "calls.log"
+        for command in commands:
+            shim = shim_dir / command
+            shim.write_text(
+                f'#!/bin/sh\necho {command} >> "{self.calls_log}"\n'
+                f'exec {shutil.which(command)} "$@"\n'
+            )
+            shim.chmod(0o755)
+        return dict(os.environ, PATH=f"{shim_dir}:{os.environ['PATH']}")
+
     def get_md5_prefix(self, content):
         """Get first 8 chars of MD5 hash of content."""
         return hashlib.md5(content.encode()).hexdigest()[:8]
 
+    def read_manifest(self, repo=None):
+        """Return the records in the .safe-rm manifest."""
+        manifest = (repo or self.repo) / ".safe-rm/manifest.jsonl"
+        return [json.loads(line) for line in manifest.read_text().splitlines()]
+
+    def set_manifest_times(self, *times):
+        """Backdate the first manifest records to the given times."""
+        records = self.read_manifest()
+        for record, time in zip(records, times):
+            record["time"] = time
+        (self.repo / ".safe-rm/manifest.jsonl").write_text(
+            "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records)
+        )
+
     def assert_backup_exists(self, expected_content, filename, subdir=""):
         """
         Assert that a backup file exists with correct content and hash.
@@ -112,9 +177,9 @@ class TestAiSafeRm(unittest.TestCase):
             backup_name = f"{filename}.{hash_prefix}"
 
         if subdir:
-            backup_path = Path(f".safe-rm/{subdir}/{backup_name}")
+            backup_path = self.repo / f".safe-rm/{subdir}/{backup_name}"
         else:
-            backup_path = Path(f".safe-rm/{backup_name}")
+            backup_path = self.repo / f".safe-rm/{backup_name}"
 
         self.assertTrue(backup_path.exists(), f"Backup file not found: {backup_path}")
 
@@ -146,9 +211,9 @@ class TestAiSafeRm(unittest.TestCase):
             backup_name = f"{filename}.{hash_prefix}"
 
         if subdir:
-            backup_path = Path(f".safe-rm/{subdir}/{backup_name}")
+            backup_path = self.repo / f".safe-rm/{subdir}/{backup_name}"
         else:
-            backup_path = Path(f".safe-rm/{backup_name}")
+            backup_path = self.repo / f".safe-rm/{backup_name}"
 
         self.assertFalse(
             backup_path.exists(), f"Backup file should not exist: {backup_path}"
@@ -161,8 +226,8 @@ class TestAiSafeRm(unittest.TestCase):
 
         self.run_safe_rm("test.txt")
 
-        self.assertFalse(Path("test.txt").exists())
-        self.assertFalse(Path(".safe-rm").exists())
+        self.assertFalse((self.repo / "test.txt").exists())
+        self.assertFalse((self.repo / ".safe-rm").exists())
 
     def test_modified_tracked_file_backed_up(self):
         """Modified tracked files should be moved to .safe-rm with hash."""
@@ -172,7 +237,7 @@ class TestAiSafeRm(unittest.TestCase):
         self.create_file("test.txt", "modified")
         self.run_safe_rm("test.txt")
 
-        self.assertFalse(Path("test.txt").exists())
+        self.assertFalse((self.repo / "test.txt").exists())
         self.assert_backup_exists("modified", "test.txt")
 
     def test_untracked_file_backed_up(self):
@@ -181,7 +246,7 @@ class TestAiSafeRm(unittest.TestCase):
 
         self.run_safe_rm("untracked.txt")
 
-        self.assertFalse(Path("untracked.txt").exists())
+        self.assertFalse((self.repo / "untracked.txt").exists())
         self.assert_backup_exists("untracked content", "untracked.txt")
 
     def test_multiple_files_mixed(self):
@@ -200,15 +265,227 @@ class TestAiSafeRm(unittest.TestCase):
 
         self.run_safe_rm("unmod.txt", "mod.txt", "untracked.txt")
 
-        self.assertFalse(Path("unmod.txt").exists())
-        self.assertFalse(Path("mod.txt").exists())
-        self.assertFalse(Path("untracked.txt").exists())
+        self.assertFalse((self.repo / "unmod.txt").exists())
+        self.assertFalse((self.repo / "mod.txt").exists())
+        self.assertFalse((self.repo / "untracked.txt").exists())
 
         # Only modified and untracked should be backed up
         self.assert_backup_not_exists("unmod", "unmod.txt")
         self.assert_backup_exists("modified", "mod.txt")
         self.assert_backup_exists("untracked", "untracked.txt")
 
+    def test_content_stored_in_git_not_backed_up(self):
+        """Content git already has is deleted and its blob id logged."""
+        self.create_file("test.txt", "version1")
+        self.add_to_git("test.txt", commit_msg="Add version1")
+        blob = self.run_git("rev-parse", "HEAD:test.txt").stdout.strip()
+        self.create_file("test.txt", "version2")
+        self.add_to_git("test.txt", commit_msg="Add version2")
+        # Revert to the older version, and copy it to an untracked file
+        self.create_file("test.txt", "version1")
+        self.create_file("copy.txt", "version1")
+
+        result = self.run_safe_rm("test.txt", "copy.txt")
+
+        self.assertIn(f"stored in git as blob {blob}: test.txt", result.stdout)
+        self.assertIn(f"stored in git as blob {blob}: copy.txt", result.stdout)
+        self.assertFalse((self.repo / "test.txt").exists())
+        self.assertFalse((self.repo / "copy.txt").exists())
+        self.assert_backup_not_exists("version1", "test.txt")
+        self.assert_backup_not_exists("version1", "copy.txt")
+
+        self.assertEqual(
+            [(r["path"], r["blob"]) for r in self.read_manifest()],
+            [("test.txt", blob), ("copy.txt", blob)],
+        )
+        pinned = self.run_git("ls-tree", "refs/safe-rm/blobs").stdout
+        self.assertIn(f"blob {blob}\t{blob}", pinned)
+
+    def test_only_identical_bytes_deleted_as_blob(self):
+        """Content equal to a blob only after filtering is backed up, and
+        a blob is restored byte for byte."""
+        self.run_git("config", "core.autocrlf", "true")
+        self.create_file("test.txt", "line\n")
+        self.add_to_git("test.txt", commit_msg="Add test.txt")
+        (self.repo / "lf.txt").write_bytes(b"line\n")
+        (self.repo / "crlf.txt").write_bytes(b"line\r\n")
+
+        result = self.run_safe_rm("lf.txt", "crlf.txt")
+
+        self.assertIn("stored in git as blob", result.stdout)
+        self.assertIn("Moving untracked file", result.stdout)
+        backup = self.repo / self.read_manifest()[1]["backup"]
+        self.assertEqual(backup.read_bytes(), b"line\r\n")
+        self.run_safe_rm("--restore", "lf.txt", "crlf.txt")
+        self.assertEqual((self.repo / "lf.txt").read_bytes(), b"line\n")
+        self.assertEqual((self.repo / "crlf.txt").read_bytes(), b"line\r\n")
+
+    def test_manifest_records_removals(self):
+        """Each backup is recorded in the manifest with its details."""
+        self.create_file("sub/new file.txt", "content")
+        self.create_file("tracked.txt", "original")
+        self.add_to_git("tracked.txt", commit_msg="Add tracked file")
+        self.create_file("tracked.txt", "changed")
+
+        self.run_safe_rm("sub/new file.txt", "tracked.txt")
+
+        records = self.read_manifest()
+        self.assertEqual(len(records), 2)
+        for record, path, content, reason in [
+            (records[0], "sub/new file.txt", "content", "untracked"),
+            (records[1], "tracked.txt", "changed", "modified tracked"),
+        ]:
+            md5 = hashlib.md5(content.encode()).hexdigest()
+            self.assertEqual(record["path"], path)
+            self.assertEqual(record["reason"], reason)
+            self.assertEqual(record["size"], len(content))
+            self.assertEqual(record["md5"], md5)
+            self.assertEqual((self.repo / record["backup"]).read_text(), content)
+            self.assertRegex(record["time"], r"^\d{4}-\d\d-\d\dT[\d:]{8}Z$")
+
+    def test_list_shows_removals_under_path(self):
+        """--list shows the recorded removals at or below a path."""
+        self.create_file("dir/sub/tracked.txt", "tracked")
+        self.add_to_git("dir/sub/tracked.txt", commit_msg="Add tracked file")
+        self.create_file("dir/a.txt", "a")
+        self.create_file("dir/sub/b.txt", "b")
+        self.create_file("other.txt", "other")
+        self.run_safe_rm("-r", "dir")
+        self.run_safe_rm("other.txt")
+
+        listed = self.run_safe_rm("--list", "dir").stdout.splitlines()
+
+        self.assertEqual(
+            sorted(line.split("\t")[2:] for line in listed),
+            [
+                ["dir/a.txt", f".safe-rm/dir/a.{self.get_md5_prefix('a')}.txt"],
+                ["dir/sub/b.txt", f".safe-rm/dir/sub/b.{self.get_md5_prefix('b')}.txt"],
+            ],
+        )
+        self.assertEqual(len(self.run_safe_rm("--list").stdout.splitlines()), 3)
+
+    def test_restore_backed_up_file(self):
+        """--restore moves the latest backup of a file back into place."""
+        self.create_file("file.txt", "version1")
+        self.run_safe_rm("file.txt")
+        self.create_file("file.txt", "version2")
+        self.run_safe_rm("file.txt")
+
+        self.run_safe_rm("--restore", "file.txt")
+
+        self.assertEqual((self.repo / "file.txt").read_text(), "version2")
+        self.assert_backup_not_exists("version2", "file.txt")
+        self.assert_backup_exists("version1", "file.txt")
+        self.assertEqual(self.read_manifest()[-1]["reason"], "restored")
+
+        # The latest removal has been undone, so there is nothing to do
+        (self.repo / "file.txt").unlink()
+        result = self.run_safe_rm("--restore", "file.txt")
+        self.assertIn("Nothing left to restore", result.stdout)
+        self.assertFalse((self.repo / "file.txt").exists())
+
+    def test_restore_directory_and_blob(self):
+        """--restore puts back every file under a directory, from git too."""
+        self.create_file("dir/kept.txt", "version1")
+        self.create_file("dir/tracked.txt", "tracked")
+        self.add_to_git("dir/", commit_msg="Add dir")
+        self.run_git("rm", "-q", "--cached", "dir/kept.txt")
+        self.create_file("dir/sub/new.txt", "new")
+        self.run_safe_rm("-r", "dir")
+        self.assertFalse((self.repo / "dir").exists())
+
+        result = self.run_safe_rm("--restore", "dir")
+
+        self.assertIn("from git blob", result.stdout)
+        self.assertEqual((self.repo / "dir/kept.txt").read_text(), "version1")
+        self.assertEqual((self.repo / "dir/sub/new.txt").read_text(), "new")
+
+    def test_restore_blob_keeps_mode(self):
+        """A file deleted as a git blob comes back with its permissions."""
+        self.create_file("deploy.sh", "#!/bin/sh\n")
+        self.add_to_git("deploy.sh", commit_msg="Add deploy.sh")
+        self.run_git("rm", "-q", "--cached", "deploy.sh")
+        (self.repo / "deploy.sh").chmod(0o755)
+        self.run_safe_rm("deploy.sh")
+        [record] = self.read_manifest()
+        self.assertEqual(record["mode"], "755")
+
+        listed = self.run_safe_rm("--list").stdout
+        self.run_safe_rm("--restore", "deploy.sh")
+
+        self.assertEqual(
+            listed.split("\t")[2:], ["deploy.sh", f"blob {record['blob']}\n"]
+        )
+        self.assertEqual((self.repo / "deploy.sh").stat().st_mode & 0o777, 0o755)
+
+    def test_restore_refuses_to_overwrite(self):
+        """--restore leaves an existing file alone and fails."""
+        self.create_file("file.txt", "old")
+        self.run_safe_rm("file.txt")
+        self.create_file("file.txt", "new")
+
+        result = self.run_safe_rm("--restore", "file.txt", expect_success=False)
+
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("Not overwriting", result.stderr)
+        self.assertEqual((self.repo / "file.txt").read_text(), "new")
+        self.assert_backup_exists("old", "file.txt")
+
+    def test_gc_evicts_least_recently_used_over_budget(self):
+        """--gc --max-size evicts the oldest backups first."""
+        for name in ["old.txt", "mid.txt", "new.txt"]:
+            self.create_file(name, name * 10)
+            self.run_safe_rm(name)
+        self.set_manifest_times(
+            "2026-01-01T00:00:00Z", "2026-01-02T00:00:00Z", "2026-01-03T00:00:00Z"
+        )
+
+        result = self.run_safe_rm("--gc", "--max-size", "150")
+
+        self.assertIn("Evicting backup of old.txt", result.stdout)
+        self.assert_backup_not_exists("old.txt" * 10, "old.txt")
+        self.assert_backup_exists("mid.txt" * 10, "mid.txt")
+        self.assert_backup_exists("new.txt" * 10, "new.txt")
+        self.assertEqual(self.read_manifest()[-1]["reason"], "evicted")
+
+        result = self.run_safe_rm("--restore", "old.txt", expect_success=False)
+        self.assertIn("evicted", result.stderr)
+
+    def test_gc_evicts_by_age_and_unpins_blobs(self):
+        """--gc --max-age drops backups and blob pins unused for too long."""
+        self.create_file("kept.txt", "in git")
+        self.add_to_git("kept.txt", commit_msg="Add kept")
+        self.run_git("rm", "-q", "--cached", "kept.txt")
+        self.create_file("old.txt", "old")
+        self.run_safe_rm("kept.txt", "old.txt")
+        self.set_manifest_times("2000-01-01T00:00:00Z", "2000-01-01T00:00:00Z")
+        self.create_file("new.txt", "new")
+        self.run_safe_rm("new.txt")
+
+        result = self.run_safe_rm("--gc", "--max-age", "30")
+
+        self.assertIn("Unpinning blob of kept.txt", result.stdout)
+        self.assert_backup_not_exists("old", "old.txt")
+        self.assert_backup_exists("new", "new.txt")
+        refs = self.run_git("for-each-ref", "refs/safe-rm/").stdout
+        self.assertEqual(refs, "")
+
+    def test_gc_links_identical_backups(self):
+        """--gc makes identical backups share a file, restored as copies."""
+        self.create_file("a.txt", "same")
+        self.create_file("dir/b.txt", "same")
+        self.run_safe_rm("a.txt", "dir/b.txt")
+
+        self.run_safe_rm("--gc")
+
+        backup_a = (self.repo / f".safe-rm/a.{self.get_md5_prefix('same')}.txt")
+        backup_b = (self.repo / f".safe-rm/dir/b.{self.get_md5_prefix('same')}.txt")
+        self.assertTrue(backup_a.samefile(backup_b))
+
+        self.run_safe_rm("--restore", "a.txt")
+        (self.repo / "a.txt").write_text("edited")
+        self.assertEqual(backup_b.read_text(), "same")
+
     def test_subdirectory_files_preserve_path(self):
         """Files in subdirectories should preserve their path in .safe-rm."""
         self.create_file("sub/dir/file.txt", "content")
@@ -225,7 +502,7 @@ class TestAiSafeRm(unittest.TestCase):
 
         self.assertEqual(result.returncode, 1)
         self.assertIn("use -r", result.stderr)
-        self.assertTrue(Path("dir/file.txt").exists())
+        self.assertTrue((self.repo / "dir/file.txt").exists())
 
     def test_directory_all_unmodified_tracked_deleted(self):
         """Directory with only unmodified tracked files should be rm -rf'd."""
@@ -235,8 +512,20 @@ class TestAiSafeRm(unittest.TestCase):
 
         self.run_safe_rm("-r", "dir")
 
-        self.assertFalse(Path("dir").exists())
-        self.assertFalse(Path(".safe-rm").exists())
+        self.assertFalse((self.repo / "dir").exists())
+        self.assertFalse((self.repo / ".safe-rm").exists())
+
+    def test_directory_all_unmodified_tracked_not_recursed(self):
+        """A clean tracked directory is removed whole, not file by file."""
+        self.create_file("dir/file1.txt", "content1")
+        self.create_file("dir/sub/file2.txt", "content2")
+        self.add_to_git("dir/", commit_msg="Add dir")
+
+        result = self.run_safe_rm("-r", "dir")
+
+        self.assertIn("Deleting directory with only unmodified tracked", result.stdout)
+        self.assertNotIn("Deleting unmodified tracked file", result.stdout)
+        self.assertFalse((self.repo / "dir").exists())
 
     def test_directory_with_modified_file_recurses(self):
         """Directory with modified file should recurse and backup only modified."""
@@ -248,7 +537,7 @@ class TestAiSafeRm(unittest.TestCase):
 
         self.run_safe_rm("-r", "dir")
 
-        self.assertFalse(Path("dir").exists())
+        self.assertFalse((self.repo / "dir").exists())
 
         # Only modified file should be backed up
         self.assert_backup_not_exists("unmod", "unmod.txt", subdir="dir")
@@ -263,12 +552,229 @@ class TestAiSafeRm(unittest.TestCase):
 
         self.run_safe_rm("-r", "dir")
 
-        self.assertFalse(Path("dir").exists())
+        self.assertFalse((self.repo / "dir").exists())
 
         # Only untracked file should be backed up
         self.assert_backup_not_exists("tracked", "tracked.txt", subdir="dir")
         self.assert_backup_exists("untracked", "untracked.txt", subdir="dir")
 
+    def test_directory_with_ignored_file_recurses(self):
+        """Ignored files are backed up like any other untracked file."""
+        self.create_file(".gitignore", "*.log\n")
+        self.create_file("dir/tracked.txt", "tracked")
+        self.add_to_git(".gitignore", "dir/", commit_msg="Add dir")
+        self.create_file("dir/build.log", "log output")
+
+        result = self.run_safe_rm("-r", "dir")
+
+        self.assertIn("Processing directory recursively: dir", result.stdout)
+        self.assertFalse((self.repo / "dir").exists())
+        self.assert_backup_not_exists("tracked", "tracked.txt", subdir="dir")
+        self.assert_backup_exists("log output", "build.log", subdir="dir")
+
+    def test_untracked_directory_moved_whole(self):
+        """A directory with nothing tracked in it is moved in one go."""
+        self.create_file(".gitignore", "cache/\n")
+        self.add_to_git(".gitignore", commit_msg="Add .gitignore")
+        for i in range(5):
+            self.create_file(f"node_modules/pkg{i}/index.js", f"module {i}")
+        self.create_file("node_modules/cache/data", "cached")
+
+        result = self.run_safe_rm("-r", "node_modules")
+
+        self.assertIn("Moving untracked directory to:", result.stdout)
+        self.assertNotIn("Moving untracked file", result.stdout)
+        self.assertFalse((self.repo / "node_modules").exists())
+        [record] = self.read_manifest()
+        self.assertEqual(record["path"], "node_modules")
+        self.assertEqual(record["size"], 5 * len("module 0") + len("cached"))
+        backup = self.repo / record["backup"]
+        self.assertEqual(backup.parent, self.repo / ".safe-rm")
+        self.assertEqual((backup / "pkg3/index.js").read_text(), "module 3")
+
+        self.run_safe_rm("--restore", "node_modules")
+        self.assertEqual((self.repo / "node_modules/cache/data").read_text(), "cached")
+
+    def test_untracked_directory_with_same_listing_kept(self):
+        """A tree whose names, sizes and mtimes match an earlier backup's
+        is kept alongside it, not in place of it."""
+        for content in ["one", "two"]:
+            self.create_file("build/a.txt", content)
+            os.utime(self.repo / "build/a.txt", (1_600_000_000, 1_600_000_000))
+            os.utime(self.repo / "build", (1_600_000_000, 1_600_000_000))
+            self.run_safe_rm("-r", "build")
+
+        first, second = [r["backup"] for r in self.read_manifest()]
+        self.assertNotEqual(first, second)
+        self.assertEqual((self.repo / first / "a.txt").read_text(), "one")
+        self.assertEqual((self.repo / second / "a.txt").read_text(), "two")
+
+    def test_mixed_directory_moves_untracked_subtrees(self):
+        """Only files outside untracked subtrees are handled one by one."""
+        self.create_file("dir/tracked.txt", "tracked")
+        self.add_to_git("dir/", commit_msg="Add dir")
+        self.create_file("dir/new.txt", "new")
+        self.create_file("dir/build/a.o", "a")
+        self.create_file("dir/build/sub/b.o", "b")
+
+        result = self.run_safe_rm("-r", "dir")
+
+        self.assertIn("Processing directory recursively: dir", result.stdout)
+        self.assertEqual(result.stdout.count("Moving untracked directory"), 1)
+        self.assertFalse((self.repo / "dir").exists())
+        self.assert_backup_exists("new", "new.txt", subdir="dir")
+        records = {r["path"]: r for r in self.read_manifest()}
+        self.assertEqual(sorted(records), ["dir/build", "dir/new.txt"])
+        self.assertEqual(
+            (self.repo / records["dir/build"]["backup"] / "sub/b.o").read_text(), "b"
+        )
+
+    def test_dirty_submodule_backed_up(self):
+        """A submodule's files belong to another repository, so its
+        changes are kept, whether it is deleted itself or within a
+        directory."""
+        self.create_file("lib/sub/s.txt", "s")
+        for args in [
+            ["init", "-q"],
+            ["add", "s.txt"],
+            ["-c", "user.name=Test", "-c", "user.email=test@example.com",
+             "commit", "-q", "-m", "Add s.txt"],
+        ]:
+            subprocess.run(
+                ["git", *args], capture_output=True, check=True,
+                cwd=self.repo / "lib/sub",
+            )
+        self.create_file("lib/tracked.txt", "tracked")
+        self.add_to_git("lib/", commit_msg="Add submodule")
+
+        for target in ["lib/sub", "lib"]:
+            with self.subTest(target=target):
+                self.create_file("lib/sub/s.txt", "changed")
+                self.create_file("lib/sub/notes.txt", "notes")
+
+                result = self.run_safe_rm("-r", target)
+
+                self.assertNotIn("Deleting directory with only", result.stdout)
+                self.assertFalse((self.repo / "lib/sub").exists())
+                self.run_safe_rm("--restore", "lib/sub")
+                self.assertEqual((self.repo / "lib/sub/s.txt").read_text(), "changed")
+                self.assertEqual((self.repo / "lib/sub/notes.txt").read_text(), "notes")
+                self.run_git("checkout", "lib/tracked.txt")
+
+    def test_parallel_jobs_match_serial_run(self):
+        """-j spreads the work over jobs without changing the outcome."""
+        for sub in range(3):
+            self.create_file(f"dir/sub{sub}/tracked.txt", f"tracked {sub}")
+        self.add_to_git("dir/", commit_msg="Add dir")
+        self.create_file("dir/sub0/tracked.txt", "modified")
+        for i in range(200):
+            self.create_file(f"dir/sub{i % 3}/file{i}.txt", f"content {i}")
+        copy = Path(tempfile.mkdtemp(prefix="ai-safe-rm-test-"))
+        shutil.copytree(self.repo, copy, symlinks=True, dirs_exist_ok=True)
+
+        def run(repo, *args):
+            output = self.run_safe_rm(*args, "-r", "dir", cwd=repo).stdout
+            backups = sorted(
+                (str(p.relative_to(repo)), p.read_text())
+                for p in (repo / ".safe-rm").rglob("*")
+                if p.is_file() and p.name != "manifest.jsonl"
+            )
+            records = [
+                {k: v for k, v in r.items() if k != "time"}
+                for r in self.read_manifest(repo)
+            ]
+            return output.replace(str(repo), "REPO"), backups, records
+
+        try:
+            serial = run(self.repo, "-j", "1")
+            parallel = run(copy, "-j", "4")
+        finally:
+            shutil.rmtree(copy)
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual(len(serial[1]), 201)
+        self.assertFalse((self.repo / "dir").exists())
+
+    def test_process_count_independent_of_file_count(self):
+        """Deleting a directory starts as many git, md5sum and realpath
+        processes for a hundred files of each kind as for three."""
+        commands = ("git", "md5sum", "realpath")
+        env = self.counting_env(*commands)
+
+        def processes_for(name, count):
+            for i in range(count):
+                self.create_file(f"{name}/tracked{i}.txt", f"tracked {i}")
+                self.create_file(f"{name}/mod{i}.txt", f"original {i}")
+            self.add_to_git(f"{name}/", commit_msg=f"Add {name}")
+            for i in range(count):
+                self.create_file(f"{name}/mod{i}.txt", f"modified {i}")
+                self.create_file(f"{name}/new{i}.txt", f"new {i}")
+            self.calls_log.write_text("")
+            self.run_safe_rm("-j", "1", "-r", name, env=env)
+            calls = self.calls_log.read_text().split()
+            return {command: calls.count(command) for command in commands}
+
+        few = processes_for("few", 3)
+        many = processes_for("many", 100)
+
+        self.assertEqual(few, many)
+        self.assertGreater(few["git"], 0)
+        self.assertEqual(len(self.read_manifest()), 2 * 3 + 2 * 100)
+
+    def test_process_count_independent_of_untracked_subtrees(self):
+        """Moving a hundred untracked subtrees whole starts as many
+        find, md5sum and awk processes as moving three."""
+        commands = ("find", "md5sum", "awk")
+        env = self.counting_env(*commands)
+        self.create_file(".gitignore", "__pycache__/\n")
+        self.add_to_git(".gitignore", commit_msg="Add .gitignore")
+
+        def processes_for(name, count):
+            for i in range(count):
+                self.create_file(f"{name}/pkg{i}/mod.py", f"module {i}")
+            self.add_to_git(f"{name}/", commit_msg=f"Add {name}")
+            for i in range(count):
+                self.create_file(f"{name}/pkg{i}/__pycache__/mod.pyc", f"code {i}")
+            self.calls_log.write_text("")
+            self.run_safe_rm("-r", name, env=env)
+            calls = self.calls_log.read_text().split()
+            return {command: calls.count(command) for command in commands}
+
+        few = processes_for("few", 3)
+        many = processes_for("many", 100)
+
+        self.assertEqual(few, many)
+        records = self.read_manifest()
+        self.assertEqual(len(records), 3 + 100)
+        self.assertEqual(records[-1]["size"], len("code 99"))
+
+    def test_failed_move_keeps_records_of_others(self):
+        """When one move fails, the files already moved are recorded."""
+        self.create_file("dir/tracked.txt", "tracked")
+        self.add_to_git("dir/", commit_msg="Add dir")
+        self.create_file("dir/a.txt", "a")
+        self.create_file("dir/b.txt", "b")
+        # mv cannot replace a non-empty directory with b.txt
+        blocked = f".safe-rm/dir/b.{self.get_md5_prefix('b')}.txt/b.txt"
+        self.create_file(f"{blocked}/x", "in the way")
+
+        result = self.run_safe_rm("-r", "dir", expect_success=False)
+
+        self.assertNotEqual(result.returncode, 0)
+        self.assertEqual([r["path"] for r in self.read_manifest()], ["dir/a.txt"])
+        self.assert_backup_exists("a", "a.txt", subdir="dir")
+        self.assertEqual((self.repo / "dir/b.txt").read_text(), "b")
+
+    def test_invalid_job_count_fails(self):
+        """-j needs a positive number."""
+        self.create_file("file.txt", "content")
+
+        result = self.run_safe_rm("-j", "0", "file.txt", expect_success=False)
+
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("-j", result.stderr)
+        self.assertTrue((self.repo / "file.txt").exists())
+
     def test_nested_directory_structure(self):
         """Test recursive deletion with nested directories."""
         self.create_file("parent/child1/file1.txt", "unmod1")
@@ -282,7 +788,7 @@ class TestAiSafeRm(unittest.TestCase):
 
         self.run_safe_rm("-r", "parent")
 
-        self.assertFalse(Path("parent").exists())
+        self.assertFalse((self.repo / "parent").exists())
 
         # Unmodified tracked files should NOT be backed up
         self.assert_backup_not_exists("unmod1", "file1.txt", subdir="parent/child1")
@@ -296,6 +802,23 @@ class TestAiSafeRm(unittest.TestCase):
             "untracked_content", "untracked.txt", subdir="parent/child2"
         )
 
+    def test_run_from_subdirectory(self):
+        """Paths are classified relative to the repository root."""
+        self.create_file("sub/tracked.txt", "tracked")
+        self.create_file("sub/mod.txt", "original")
+        self.add_to_git("sub/", commit_msg="Add sub")
+        self.create_file("sub/mod.txt", "modified")
+        self.create_file("sub/untracked.txt", "untracked")
+
+        self.run_safe_rm(
+            "tracked.txt", "mod.txt", "untracked.txt", cwd=self.repo / "sub"
+        )
+
+        self.assertEqual(list((self.repo / "sub").iterdir()), [])
+        self.assert_backup_not_exists("tracked", "tracked.txt", subdir="sub")
+        self.assert_backup_exists("modified", "mod.txt", subdir="sub")
+        self.assert_backup_exists("untracked", "untracked.txt", subdir="sub")
+
     def test_nonexistent_file_warning(self):
         """Deleting nonexistent file should warn but not fail."""
         result = self.run_safe_rm("nonexistent.txt")
@@ -305,18 +828,15 @@ class TestAiSafeRm(unittest.TestCase):
 
     def test_not_in_git_repo_fails(self):
         """Running outside git repo should fail."""
-        os.chdir(self.original_dir)
         temp_dir = tempfile.mkdtemp(prefix="no-git-")
         try:
-            os.chdir(temp_dir)
-            Path("test.txt").write_text("content")
+            Path(temp_dir, "test.txt").write_text("content")
 
-            result = self.run_safe_rm("test.txt", expect_success=False)
+            result = self.run_safe_rm("test.txt", expect_success=False, cwd=temp_dir)
 
             self.assertEqual(result.returncode, 1)
             self.assertIn("Not in a git repository", result.stderr)
         finally:
-            os.chdir(self.original_dir)
             shutil.rmtree(temp_dir)
 
     def test_hash_collision_handling(self):
@@ -338,8 +858,8 @@ class TestAiSafeRm(unittest.TestCase):
 
         self.run_safe_rm("-r", "dir")
 
-        self.assertFalse(Path("dir").exists())
-        self.assertFalse(Path("dir/subdir").exists())
+        self.assertFalse((self.repo / "dir").exists())
+        self.assertFalse((self.repo / "dir/subdir").exists())
 
     def test_file_outside_repo_fails(self):
         """Deleting files outside the repo should fail and NOT delete the file."""
@@ -361,5 +881,51 @@ class TestAiSafeRm(unittest.TestCase):
             shutil.rmtree(outside_dir)
 
 
+class TestBenchmark(unittest.TestCase):
+    """Test the benchmark harness on small synthetic trees."""
+
+    def setUp(self):
+        spec = importlib.util.spec_from_file_location(
+            "bench_ai_safe_rm", Path(__file__).parent / "bench_ai_safe_rm.py"
+        )
+        self.bench = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.bench)
+        self.test_dir = tempfile.mkdtemp(prefix="ai-safe-rm-bench-test-")
+        self.baseline = Path(self.test_dir) / "baseline.json"
+        self.args = ["--files", "60,120", "--repeat", "1"]
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def run_bench(self, *args):
+        report = Path(self.test_dir) / "report.json"
+        code = self.bench.main([*self.args, "--report", str(report), *args])
+        return code, json.loads(report.read_text())
+
+    def test_report_and_baseline(self):
+        """Each tree is deleted as expected within budget; an equal rerun
+        passes."""
+        code, report = self.run_bench("--save-baseline", str(self.baseline))
+
+        self.assertEqual(code, 0)
+        for result in report["results"].values():
+            self.assertEqual(result["records"], result["expected_records"])
+            self.assertGreater(result["processes"]["git"], 0)
+        code, _ = self.run_bench("--baseline", str(self.baseline), "--tolerance", "100")
+        self.assertEqual(code, 0)
+
+    def test_process_count_regression_fails(self):
+        """More processes than the baseline, or than the budget, fail."""
+        _, report = self.run_bench()
+        report["results"]["120"]["processes"]["md5sum"] = 0
+        self.baseline.write_text(json.dumps(report))
+
+        code, _ = self.run_bench("--baseline", str(self.baseline), "--tolerance", "100")
+
+        self.assertEqual(code, 1)
+        report["results"]["120"]["processes"]["md5sum"] = 120
+        self.assertEqual(len(self.bench.find_problems(report, 0.05)), 1)
+
+
 if __name__ == "__main__":
     unittest.main()
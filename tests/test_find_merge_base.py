@@ -0,0 +1,1330 @@
+#!/usr/bin/env python3
+"""
+Test suite for the describing-prs find-merge-base.py script.
+
+Tests the base branch selection strategies including:
+- @{upstream}
+- Common default branch names
+- Closest remote branch by commit distance
+- origin/HEAD
+- The in-process merge-base and distance calculations
+"""
+
+import importlib.util
+import fcntl
+import json
+import os
+import subprocess
+import tempfile
+import shutil
+import sys
+import time
+from pathlib import Path
+import unittest
+
+SCRIPT = (
+    Path(__file__).parent.parent
+    / ".agents"
+    / "skills"
+    / "describing-prs"
+    / "scripts"
+    / "find-merge-base.py"
+)
+
+
+def load_script():
+    """Import find-merge-base.py as a module."""
+    spec = importlib.util.spec_from_file_location("find_merge_base", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+fmb = load_script()
+
+
+class GitRepoTestCase(unittest.TestCase):
+    """Base class providing a temporary git repository."""
+
+    def setUp(self):
+        """Create a temporary git repository with one commit on main."""
+        self.test_dir = tempfile.mkdtemp(prefix="find-merge-base-test-")
+        self.repo = Path(self.test_dir) / "repo"
+        self.repo.mkdir()
+
+        self.run_git("init", "-b", "main")
+        self.run_git("config", "user.email", "test@example.com")
+        self.run_git("config", "user.name", "Test User")
+        self.commit("initial")
+
+    def tearDown(self):
+        """Clean up temporary test directory."""
+        shutil.rmtree(self.test_dir)
+
+    def run_git(self, *args):
+        """Run a git command in the test repository and return stdout."""
+        result = subprocess.run(
+            ["git"] + list(args),
+            capture_output=True,
+            text=True,
+            check=False,
+            cwd=self.repo,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"Git command failed: {' '.join(args)}\n"
+                f"stdout: {result.stdout}\n"
+                f"stderr: {result.stderr}"
+            )
+        return result.stdout.strip()
+
+    def commit(self, message):
+        """Create an empty commit and return its sha."""
+        self.run_git("commit", "--allow-empty", "-m", message)
+        return self.run_git("rev-parse", "HEAD")
+
+    def add_remote(self, name, **branches):
+        """Add a remote with remote-tracking branches at the given commits."""
+        self.run_git("remote", "add", name, f"{self.test_dir}/{name}.git")
+        for branch, sha in branches.items():
+            self.run_git("update-ref", f"refs/remotes/{name}/{branch}", sha)
+
+    def git_logging_env(self):
+        """Return an environment whose git logs each invocation."""
+        shim_dir = Path(self.test_dir) / "shim"
+        shim_dir.mkdir(exist_ok=True)
+        self.git_log = Path(self.test_dir) / "git.log"
+        shim = shim_dir / "git"
+        shim.write_text(
+            f'#!/bin/sh\necho "$*" >> "{self.git_log}"\n'
+            f'exec {shutil.which("git")} "$@"\n'
+        )
+        shim.chmod(0o755)
+        return dict(os.environ, PATH=f"{shim_dir}:{os.environ['PATH']}")
+
+    def run_script(self, *args, expect_success=True, env=None):
+        """Run find-merge-base.py in the test repository."""
+        result = subprocess.run(
+            [str(SCRIPT)] + list(args),
+            capture_output=True,
+            text=True,
+            check=False,
+            cwd=self.repo,
+            env=env,
+        )
+        if expect_success and result.returncode != 0:
+            raise RuntimeError(
+                f"find-merge-base.py failed: {' '.join(args)}\n"
+                f"stdout: {result.stdout}\n"
+                f"stderr: {result.stderr}"
+            )
+        return result
+
+
+class TestStrategies(GitRepoTestCase):
+    """Test the base branch strategies end to end."""
+
+    def test_upstream_preferred(self):
+        """The configured upstream wins over everything else."""
+        main = self.run_git("rev-parse", "HEAD")
+        self.add_remote("origin", main=main, topic=main)
+        self.run_git("checkout", "-b", "feature")
+        self.run_git("branch", "--set-upstream-to=origin/topic")
+        self.commit("feature work")
+
+        result = self.run_script()
+
+        self.assertEqual(result.stdout.strip(), "origin/topic")
+
+    def test_common_default_branch(self):
+        """origin/main is used when there is no upstream."""
+        main = self.run_git("rev-parse", "HEAD")
+        self.add_remote("origin", main=main)
+        self.run_git("checkout", "-b", "feature")
+        self.commit("feature work")
+
+        result = self.run_script("--debug")
+
+        self.assertEqual(result.stdout.strip(), "origin/main")
+        self.assertIn("via common default branch", result.stderr)
+
+    def test_closest_remote_branch(self):
+        """The remote branch with the fewest commits to HEAD is chosen."""
+        self.commit("base")
+        old = self.commit("old feature")
+        self.run_git("checkout", "-b", "feature")
+        parent = self.commit("parent feature")
+        self.commit("child feature")
+        self.add_remote("upstream", old=old, parent=parent)
+
+        result = self.run_script()
+
+        self.assertEqual(result.stdout.strip(), "upstream/parent")
+
+    def test_closest_skips_own_tracking_branch(self):
+        """A feature branch is never its own base."""
+        base = self.commit("base")
+        self.run_git("checkout", "-b", "feature")
+        own = self.commit("feature work")
+        self.add_remote("upstream", feature=own, other=base)
+
+        result = self.run_script()
+
+        self.assertEqual(result.stdout.strip(), "upstream/other")
+
+    def test_preferred_remote_order(self):
+        """Earlier remotes in PREFERRED_REMOTES take precedence."""
+        far = self.commit("far")
+        self.commit("middle")
+        self.run_git("checkout", "-b", "feature")
+        near = self.commit("near")
+        self.commit("feature work")
+        self.add_remote("github", near=near)
+        self.add_remote("upstream", far=far)
+
+        result = self.run_script()
+
+        self.assertEqual(result.stdout.strip(), "upstream/far")
+
+    def test_closest_across_chunks(self):
+        """Branches weighed a chunk at a time give the same answer."""
+        far = self.commit("far")
+        self.run_git("checkout", "-b", "feature")
+        near = self.commit("near")
+        self.commit("feature work")
+        self.add_remote("upstream", a=far, b=near, c=far, d=near)
+
+        original_chunk = fmb.REMOTE_BRANCH_CHUNK
+        fmb.REMOTE_BRANCH_CHUNK = 1
+        try:
+            with fmb.GitSession(cwd=str(self.repo)) as git:
+                result = fmb.try_closest_remote_branch(git)
+        finally:
+            fmb.REMOTE_BRANCH_CHUNK = original_chunk
+
+        self.assertEqual(result, ("upstream/b", "closest remote branch"))
+
+    def test_origin_head(self):
+        """origin/HEAD resolves to the branch it points at."""
+        main = self.run_git("rev-parse", "HEAD")
+        self.add_remote("origin", trunk=main)
+        self.run_git(
+            "symbolic-ref", "refs/remotes/origin/HEAD", "refs/remotes/origin/trunk"
+        )
+        self.run_git("checkout", "-b", "feature")
+        self.commit("feature work")
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            result = fmb.try_origin_head(git)
+
+        self.assertEqual(result, ("origin/trunk", "origin/HEAD"))
+
+    def test_no_base_branch_fails(self):
+        """A repository without remotes has no base branch."""
+        result = self.run_script(expect_success=False)
+
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("could not determine base branch", result.stderr)
+
+    def test_not_in_git_repo_fails(self):
+        """Running outside a git repository should fail."""
+        outside = Path(self.test_dir) / "outside"
+        outside.mkdir()
+
+        result = subprocess.run(
+            [str(SCRIPT)], capture_output=True, text=True, check=False, cwd=outside
+        )
+
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("not a git repository", result.stderr)
+
+
+class TestGitSession(GitRepoTestCase):
+    """Test the in-process git queries against git itself."""
+
+    def make_criss_cross(self):
+        """Build a history where two branches have two merge bases."""
+        self.commit("root")
+        self.run_git("checkout", "-b", "left")
+        left = self.commit("left 1")
+        self.run_git("checkout", "-b", "right", "main")
+        right = self.commit("right 1")
+        self.run_git("merge", "--no-ff", "-m", "merge left", left)
+        self.commit("right 2")
+        self.run_git("checkout", "left")
+        self.run_git("merge", "--no-ff", "-m", "merge right", right)
+        self.commit("left 2")
+
+    def test_merge_base_matches_git(self):
+        """merge_base() picks the same commit as git merge-base."""
+        self.make_criss_cross()
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            for one, two in [("left", "right"), ("right", "left"), ("main", "left")]:
+                expected = self.run_git("merge-base", one, two)
+                self.assertEqual(git.merge_base(one, two), expected)
+
+    def test_count_matches_git(self):
+        """count() agrees with git rev-list --count."""
+        self.make_criss_cross()
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            for one, two in [("left", "right"), ("right", "left"), ("main", "left")]:
+                expected = self.run_git("rev-list", "--count", f"{one}..{two}")
+                self.assertEqual(git.count(one, two), int(expected))
+
+    def test_unrelated_histories(self):
+        """Unrelated histories have no merge base."""
+        self.run_git("checkout", "--orphan", "other")
+        self.commit("unrelated")
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            self.assertIsNone(git.merge_base("main", "other"))
+
+    def test_process_count_independent_of_branches(self):
+        """A full run spawns the same number of git processes for any
+        number of remote branches."""
+
+        def spawned_for(branch_count):
+            for i in range(branch_count):
+                sha = self.commit(f"remote {branch_count} {i}")
+                self.run_git("update-ref", f"refs/remotes/origin/b{i}", sha)
+            self.run_git("checkout", "-q", "-B", f"feature{branch_count}")
+            self.commit("feature work")
+            with fmb.GitSession(cwd=str(self.repo)) as git:
+                fmb.find_base_branch(git)
+                return git.spawned
+
+        self.run_git("remote", "add", "origin", f"{self.test_dir}/origin.git")
+        few = spawned_for(3)
+        many = spawned_for(30)
+
+        self.assertEqual(few, many)
+
+
+class TestObjectStore(TestGitSession):
+    """Test reading objects straight from loose objects and packs.
+
+    Inherits the git session tests, which here walk commits read from
+    packs holding offset and ref deltas.
+    """
+
+    def make_criss_cross(self):
+        """Build the criss-cross history and pack it with deltas."""
+        super().make_criss_cross()
+        self.repack()
+
+    def repack(self, offsets=True):
+        """Pack every object, deltifying as hard as git will."""
+        self.run_git(
+            "-c",
+            f"repack.useDeltaBaseOffset={str(offsets).lower()}",
+            "repack",
+            "-a",
+            "-d",
+            "-f",
+            "-q",
+            "--window=50",
+        )
+
+    def assert_store_matches_cat_file(self):
+        store = fmb.ObjectStore.open(str(self.repo / ".git"), fmb.RefStore.open())
+        self.assertIsNotNone(store)
+        names = self.run_git(
+            "cat-file", "--batch-all-objects", "--batch-check=%(objectname)"
+        )
+        for sha in names.split():
+            kind = self.run_git("cat-file", "-t", sha)
+            body = subprocess.run(
+                ["git", "cat-file", kind, sha],
+                capture_output=True,
+                check=True,
+                cwd=self.repo,
+            ).stdout
+            self.assertEqual(store.read(sha), (kind, body), sha)
+
+    def make_similar_objects(self):
+        """Commit versions of a file and messages similar enough to deltify."""
+        lines = [f"line {i}\n" for i in range(200)]
+        for i in range(10):
+            lines[i * 7] = f"changed in {i}\n"
+            (self.repo / "file.txt").write_text("".join(lines))
+            self.run_git("add", "file.txt")
+            self.commit("a long commit message that repeats itself " * 4 + str(i))
+
+    def test_reads_match_cat_file(self):
+        """Loose objects and both kinds of deltas read as git reads them."""
+        self.make_similar_objects()
+        self.assert_store_matches_cat_file()
+
+        for offsets in [True, False]:
+            with self.subTest(offsets=offsets):
+                self.repack(offsets)
+                self.commit("loose after the pack")
+                self.assert_store_matches_cat_file()
+
+    def test_commits_read_without_cat_file(self):
+        """Merge-base walks read no commit through git cat-file."""
+        self.make_criss_cross()
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            git.merge_base("left", "right")
+            self.assertNotIn("--batch", git._pipes)
+
+    def test_unreadable_objects_fall_back(self):
+        """Objects in an alternate are left to cat-file."""
+        other = Path(self.test_dir) / "other"
+        subprocess.run(["git", "init", "-q", str(other)], check=True)
+        alternates = self.repo / ".git" / "objects" / "info" / "alternates"
+        alternates.write_text(f"{other / '.git' / 'objects'}\n")
+        sha = self.run_git("rev-parse", "HEAD")
+        self.run_git("repack", "-a", "-d", "-q")
+        for pack in (self.repo / ".git" / "objects" / "pack").iterdir():
+            pack.rename(other / ".git" / "objects" / "pack" / pack.name)
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            self.assertIsNone(git.objects.read(sha))
+            self.assertIsNotNone(git.commit(sha))
+            self.assertIn("--batch", git._pipes)
+
+
+class TestDistanceEngine(GitRepoTestCase):
+    """Test the single-pass distance engine against git itself."""
+
+    def make_branchy_history(self):
+        """Build a history with a merge and many remote branches off it."""
+        self.run_git("remote", "add", "origin", f"{self.test_dir}/origin.git")
+        branches = []
+        for i in range(12):
+            point = self.commit(f"main {i}")
+            if i == 5:
+                self.run_git("checkout", "-q", "-b", "side", "HEAD~3")
+                self.commit("side work")
+                self.run_git("checkout", "-q", "main")
+                self.run_git("merge", "-q", "--no-ff", "-m", "merge side", "side")
+            self.run_git("checkout", "-q", "-b", f"b{i}", point)
+            self.commit(f"branch {i}")
+            self.run_git("update-ref", f"refs/remotes/origin/b{i}", "HEAD")
+            self.run_git("checkout", "-q", "main")
+            branches.append(f"origin/b{i}")
+        self.run_git("checkout", "-q", "-b", "feature")
+        self.commit("feature work")
+        return branches
+
+    def assert_matches_git(self, distance_limit):
+        branches = self.make_branchy_history()
+        original_limit = fmb.DIRECT_DISTANCE_LIMIT
+        fmb.DIRECT_DISTANCE_LIMIT = distance_limit
+        try:
+            with fmb.GitSession(cwd=str(self.repo)) as git:
+                distances = fmb.DistanceEngine(git).distances(branches)
+        finally:
+            fmb.DIRECT_DISTANCE_LIMIT = original_limit
+
+        for branch in branches:
+            base = self.run_git("merge-base", "HEAD", branch)
+            count = int(self.run_git("rev-list", "--count", f"{base}..HEAD"))
+            self.assertEqual(distances[branch], (base, count), branch)
+
+    def test_direct_distances_match_git(self):
+        """Per-merge-base range walks agree with git."""
+        self.assert_matches_git(distance_limit=100)
+
+    def test_ancestor_count_distances_match_git(self):
+        """Distances from memoized ancestor counts agree with git."""
+        self.assert_matches_git(distance_limit=0)
+
+    def test_sharded_rev_list_matches_single(self):
+        """Tips split over concurrent rev-lists load the same commits."""
+        self.make_branchy_history()
+        revs = [*self.run_git("rev-parse", "--remotes").split(), "^HEAD"]
+        original_min = fmb.REV_LIST_SHARD_MIN
+        fmb.REV_LIST_SHARD_MIN = 1
+        try:
+            with fmb.GitSession(cwd=str(self.repo)) as git:
+                single = git.rev_list(revs)
+            with fmb.GitSession(cwd=str(self.repo)) as git:
+                sharded = git.rev_list(revs, jobs=3)
+                spawned = git.spawned
+        finally:
+            fmb.REV_LIST_SHARD_MIN = original_min
+
+        self.assertEqual(spawned, 3)
+        self.assertEqual(sorted(sharded[0]), sorted(single[0]))
+        self.assertEqual(sharded[1], single[1])
+
+    def test_git_jobs_same_result(self):
+        """--git-jobs changes how history is loaded, not the answer."""
+        self.make_branchy_history()
+        sequential = self.run_script("--debug", "--no-cache")
+
+        result = self.run_script("--debug", "--no-cache", "--git-jobs", "4")
+
+        self.assertEqual(result.stdout, sequential.stdout)
+        self.assertEqual(result.stderr, sequential.stderr)
+
+    def make_branches_at_head(self):
+        """Add remote branches at HEAD and one commit ahead of it."""
+        branches = self.make_branchy_history()
+        self.run_git("update-ref", "refs/remotes/origin/at", "HEAD")
+        self.run_git("checkout", "-q", "-b", "ahead")
+        self.commit("ahead of feature")
+        self.run_git("update-ref", "refs/remotes/origin/ahead", "HEAD")
+        self.run_git("checkout", "-q", "feature")
+        return [*branches, "origin/at", "origin/ahead"]
+
+    def test_prefilter_bounds_hold(self):
+        """Pre-filter bounds never exceed git's distance; known ones match."""
+        branches = self.make_branches_at_head()
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            bounds, known = fmb.DistanceEngine(git).prefilter(branches)
+
+        head = self.run_git("rev-parse", "HEAD")
+        self.assertEqual(known["origin/at"], (head, 0))
+        for branch in branches:
+            base = self.run_git("merge-base", "HEAD", branch)
+            count = int(self.run_git("rev-list", "--count", f"{base}..HEAD"))
+            self.assertLessEqual(bounds[branch], count, branch)
+            if branch in known:
+                self.assertEqual(known[branch], (base, count), branch)
+
+    def test_unrelated_branch_has_no_distance(self):
+        """Branches sharing no history with HEAD are left out."""
+        self.run_git("checkout", "-q", "--orphan", "other")
+        self.commit("unrelated")
+        self.run_git("update-ref", "refs/remotes/origin/other", "HEAD")
+        self.run_git("checkout", "-q", "main")
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            distances = fmb.DistanceEngine(git).distances(["origin/other"])
+
+        self.assertEqual(distances, {})
+
+
+class TestCommitGraph(TestDistanceEngine):
+    """Test the commit-graph reader and the walks that use it.
+
+    Inherits the distance engine tests, which here run against a
+    repository with a commit-graph.
+    """
+
+    def make_branchy_history(self):
+        """Build the distance engine history and write a commit-graph."""
+        branches = super().make_branchy_history()
+        self.run_git("commit-graph", "write", "--reachable")
+        return branches
+
+    def assert_graph_matches_cat_file(self):
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            self.assertIsNotNone(git.graph)
+            for sha in self.run_git("rev-list", "--all").split():
+                body = self.run_git("cat-file", "commit", sha).encode()
+                self.assertEqual(git.commit(sha), fmb.parse_commit(body + b"\n"))
+
+    def test_reader_matches_cat_file(self):
+        """Parents and timestamps read from the graph match the objects."""
+        self.make_branchy_history()
+
+        self.assert_graph_matches_cat_file()
+
+    def test_split_graph_chain(self):
+        """Commits in every layer of a split graph chain are found."""
+        self.run_git("commit-graph", "write", "--reachable", "--split")
+        super().make_branchy_history()
+        self.run_git("commit-graph", "write", "--reachable", "--split=no-merge")
+        chain = self.repo / ".git" / "objects" / "info" / "commit-graphs"
+        self.assertEqual(len(list(chain.glob("*.graph"))), 2)
+
+        self.assert_graph_matches_cat_file()
+
+    def test_commits_newer_than_graph(self):
+        """Commits written after the graph are read through git."""
+        branches = self.make_branchy_history()
+        self.commit("after graph")
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            distances = fmb.DistanceEngine(git).distances(branches)
+
+        for branch in branches:
+            base = self.run_git("merge-base", "HEAD", branch)
+            count = int(self.run_git("rev-list", "--count", f"{base}..HEAD"))
+            self.assertEqual(distances[branch], (base, count), branch)
+
+    def test_distant_branches_skipped(self):
+        """Branches that cannot beat the closest one are never walked."""
+        self.run_git("remote", "add", "origin", f"{self.test_dir}/origin.git")
+        far = self.commit("old")
+        for i in range(5):
+            near = self.commit(f"main {i}")
+        self.run_git("update-ref", "refs/remotes/origin/far", far)
+        self.run_git("update-ref", "refs/remotes/origin/near", near)
+        self.run_git("checkout", "-q", "-b", "feature")
+        self.commit("feature work")
+        without_graph = self.run_script("--no-cache")
+        self.run_git("commit-graph", "write", "--reachable")
+
+        result = self.run_script("--debug", "--no-cache")
+
+        self.assertEqual(result.stdout, without_graph.stdout)
+        self.assertEqual(result.stdout.strip(), "origin/near")
+        self.assertIn("origin/far: skipped, distance at least 6", result.stderr)
+
+    def test_tips_containing_head_known(self):
+        """Tips containing HEAD are at distance 0 without being walked."""
+        self.make_branches_at_head()
+        self.run_git("commit-graph", "write", "--reachable")
+
+        result = self.run_script("--debug", "--no-cache")
+
+        self.assertEqual(result.stdout.strip(), "origin/ahead")
+        self.assertIn("origin/b0: skipped, distance at least", result.stderr)
+        self.assertIn("origin/b11: skipped, distance at least 1", result.stderr)
+
+    def test_disabled_graph_ignored(self):
+        """core.commitGraph=false makes the graph invisible, as in git."""
+        self.make_branchy_history()
+        self.run_git("config", "core.commitGraph", "false")
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            self.assertIsNone(git.graph)
+
+
+class TestConcurrentStrategies(GitRepoTestCase):
+    """Test concurrent strategy evaluation."""
+
+    def test_same_output_as_sequential(self):
+        """--concurrent gives the same result and debug output."""
+        self.commit("base")
+        old = self.commit("old feature")
+        self.run_git("checkout", "-b", "feature")
+        parent = self.commit("parent feature")
+        self.commit("child feature")
+        self.add_remote("origin", old=old, parent=parent)
+
+        sequential = self.run_script("--debug", "--no-cache")
+        concurrent = self.run_script("--debug", "--no-cache", "--concurrent")
+
+        self.assertEqual(concurrent.stdout, sequential.stdout)
+        self.assertEqual(concurrent.stderr, sequential.stderr)
+
+    def test_priority_preserved_and_lower_cancelled(self):
+        """A slow high-priority success beats a fast low-priority one,
+        and strategies below the winner are cancelled."""
+        sessions = {}
+
+        def slow_high(git):
+            time.sleep(0.2)
+            return "high", "slow"
+
+        def fast_low(git):
+            time.sleep(0.05)
+            return "low", "fast"
+
+        def never_finishes(git):
+            sessions["lowest"] = git
+            while not git.cancelled:
+                time.sleep(0.01)
+            return "lowest", "cancelled"
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            result = fmb.run_strategies_concurrently(
+                git, [slow_high, fast_low, never_finishes]
+            )
+
+        self.assertEqual(result, ("high", "slow"))
+        self.assertTrue(sessions["lowest"].cancelled)
+
+    def test_cancelled_strategy_stops_walking(self):
+        """Each real strategy, cancelled once everything it reads is
+        already known, stops in its in-process walk instead of
+        finishing."""
+        base = self.commit("base")
+        for i in range(20):
+            main = self.commit(f"main {i}")
+        self.add_remote("origin", main=main, topic=base)
+        self.run_git(
+            "symbolic-ref", "refs/remotes/origin/HEAD", "refs/remotes/origin/main"
+        )
+        self.run_git("checkout", "-b", "feature", base)
+        self.run_git("branch", "--set-upstream-to=origin/main")
+        for i in range(20):
+            self.commit(f"feature {i}")
+        self.run_git("commit-graph", "write", "--reachable")
+        strategies = [
+            fmb.try_upstream,
+            fmb.try_common_default_branches,
+            fmb.try_closest_remote_branch,
+            fmb.try_origin_head,
+        ]
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            for strategy in strategies:
+                strategy(git)
+            for strategy in strategies:
+                with self.subTest(strategy=strategy.__name__):
+                    session = git.fork()
+                    session.cancel()
+                    with self.assertRaises(fmb.Cancelled):
+                        strategy(session)
+
+    def test_all_strategies_fail(self):
+        """When every strategy fails the result is (None, None)."""
+
+        def fail(git):
+            return None, None
+
+        with fmb.GitSession(cwd=str(self.repo)) as git:
+            result = fmb.run_strategies_concurrently(git, [fail, fail])
+
+        self.assertEqual(result, (None, None))
+
+
+class TestRefStore(GitRepoTestCase):
+    """Test reading refs directly from the git directory."""
+
+    def setUp(self):
+        """Create remote-tracking refs, some packed and some loose."""
+        super().setUp()
+        self.main = self.run_git("rev-parse", "HEAD")
+        self.add_remote("origin", main=self.main, topic=self.main)
+        self.add_remote("upstream", main=self.main)
+        self.run_git(
+            "symbolic-ref", "refs/remotes/origin/HEAD", "refs/remotes/origin/main"
+        )
+        self.run_git("pack-refs", "--all")
+        self.run_git("update-ref", "refs/remotes/origin/loose", self.main)
+
+    def store(self, path=None):
+        store = fmb.RefStore.open(str(path or self.repo))
+        self.assertIsNotNone(store)
+        return store
+
+    def git_lines(self, *args, cwd=None):
+        result = subprocess.run(
+            ["git", *args], capture_output=True, text=True, cwd=cwd or self.repo
+        )
+        return result.stdout.split()
+
+    def test_matches_git(self):
+        """Remote branches, remotes and current branch agree with git."""
+        store = self.store()
+
+        self.assertEqual(
+            store.remote_branches(),
+            self.git_lines("branch", "-r", "--format=%(refname:short)"),
+        )
+        self.assertEqual(store.remotes(), ["origin", "upstream"])
+        self.assertEqual(store.current_branch(), "main")
+
+    def test_loose_ref_overrides_packed(self):
+        """A loose ref update wins over the stale packed-refs entry."""
+        feature = self.commit("feature")
+        self.run_git("update-ref", "refs/remotes/origin/main", feature)
+
+        self.assertEqual(self.store().resolve("refs/remotes/origin/main"), feature)
+
+    def test_symbolic_refs(self):
+        """origin/HEAD is followed, and dangling symrefs are not listed."""
+        self.run_git(
+            "symbolic-ref", "refs/remotes/upstream/HEAD", "refs/remotes/upstream/gone"
+        )
+        store = self.store()
+
+        self.assertEqual(
+            store.symbolic_ref("refs/remotes/origin/HEAD"), "refs/remotes/origin/main"
+        )
+        self.assertEqual(store.resolve("refs/remotes/origin/HEAD"), self.main)
+        self.assertNotIn("upstream/HEAD", store.remote_branches())
+
+    def test_ambiguous_short_names(self):
+        """Names shadowed by a local branch or tag keep the remotes/ prefix."""
+        self.run_git("branch", "origin/topic")
+        self.run_git("tag", "upstream/main")
+
+        branches = self.store().remote_branches()
+
+        self.assertIn("remotes/origin/topic", branches)
+        self.assertIn("remotes/upstream/main", branches)
+        self.assertEqual(
+            branches, self.git_lines("branch", "-r", "--format=%(refname:short)")
+        )
+        self.assertEqual(
+            list(self.store().iter_remote_branches("origin")),
+            [b for b in branches if b.removeprefix("remotes/").startswith("origin/")],
+        )
+
+    def test_one_remote_from_packed_refs(self):
+        """A remote's branches are read alone, whether packed-refs is sorted or not."""
+        expected = self.git_lines(
+            "for-each-ref", "--format=%(refname:short)", "refs/remotes/origin/"
+        )
+        self.assertEqual(list(self.store().iter_remote_branches("origin")), expected)
+
+        packed = self.repo / ".git" / "packed-refs"
+        lines = packed.read_text().splitlines(keepends=True)
+        packed.write_text("".join(reversed(lines[1:])))
+        store = self.store()
+
+        self.assertFalse(store.packed().sorted)
+        self.assertEqual(list(store.iter_remote_branches("origin")), expected)
+        self.assertEqual(store.resolve("refs/remotes/upstream/main"), self.main)
+
+    def test_detached_head(self):
+        """A detached HEAD has no current branch."""
+        self.run_git("checkout", "--detach")
+
+        self.assertEqual(self.store().current_branch(), "")
+
+    def test_worktree(self):
+        """A linked worktree has its own HEAD but shares the common refs."""
+        worktree = Path(self.test_dir) / "worktree"
+        self.run_git("worktree", "add", "-b", "wt", str(worktree))
+
+        store = self.store(worktree)
+
+        self.assertEqual(store.current_branch(), "wt")
+        self.assertEqual(store.common_dir, str(self.repo / ".git"))
+        self.assertIn("origin/main", store.remote_branches())
+
+    def test_unsupported_layout_falls_back(self):
+        """A reftable repository is left to git."""
+        (self.repo / ".git" / "reftable").mkdir()
+
+        self.assertIsNone(fmb.RefStore.open(str(self.repo)))
+
+    def test_include_falls_back(self):
+        """Configs with include directives are left to git's parser."""
+        self.run_git("config", "include.path", "extra.config")
+
+        self.assertIsNone(self.store().remotes())
+
+
+class TestResultCache(GitRepoTestCase):
+    """Test the result cache in the git directory."""
+
+    def setUp(self):
+        """Create a feature branch whose base is origin/main."""
+        super().setUp()
+        main = self.run_git("rev-parse", "HEAD")
+        self.add_remote("origin", main=main)
+        self.run_git("checkout", "-b", "feature")
+        self.commit("feature work")
+
+    def test_second_run_hits_cache(self):
+        """An unchanged repository is answered from the cache."""
+        first = self.run_script("--debug")
+        second = self.run_script("--debug")
+
+        self.assertIn("Cache miss", first.stderr)
+        self.assertIn("Cache hit", second.stderr)
+        self.assertEqual(second.stdout, first.stdout)
+        self.assertTrue((self.repo / ".git" / fmb.CACHE_FILE).exists())
+
+    def test_cache_hit_runs_no_git(self):
+        """A cache hit is answered without starting any git process."""
+        self.run_script()
+        env = self.git_logging_env()
+
+        self.run_script(env=env)
+
+        self.assertFalse(self.git_log.exists())
+
+    def test_cache_miss_lists_refs_without_git(self):
+        """Remote branches, remotes and the current branch are read natively."""
+        env = self.git_logging_env()
+
+        self.run_script("--no-cache", env=env)
+
+        invocations = self.git_log.read_text().splitlines()
+        for command in ["branch", "remote", "symbolic-ref"]:
+            self.assertFalse(
+                [line for line in invocations if line.startswith(command)],
+                invocations,
+            )
+
+    def test_ref_update_invalidates(self):
+        """Updating a remote ref makes the cached entry unreachable."""
+        self.run_script()
+        feature = self.run_git("rev-parse", "HEAD~0")
+        self.run_git("update-ref", "refs/remotes/origin/main", feature)
+
+        result = self.run_script("--debug")
+
+        self.assertIn("Cache miss", result.stderr)
+
+    def test_local_branch_update_invalidates(self):
+        """Deleting the local branch HEAD tracks is not answered from
+        the cache."""
+        self.run_git("branch", "--set-upstream-to=main")
+        self.assertEqual(self.run_script().stdout.strip(), "main")
+        self.run_git("update-ref", "-d", "refs/heads/main")
+
+        result = self.run_script("--debug", expect_success=False)
+
+        self.assertIn("Cache miss", result.stderr)
+        self.assertNotEqual(result.stdout.strip(), "main")
+
+    def test_head_change_invalidates(self):
+        """A new commit on HEAD makes the cached entry unreachable."""
+        self.run_script()
+        self.commit("more work")
+
+        result = self.run_script("--debug")
+
+        self.assertIn("Cache miss", result.stderr)
+
+    def test_no_cache(self):
+        """--no-cache neither reads nor writes the cache."""
+        result = self.run_script("--debug", "--no-cache")
+
+        self.assertNotIn("Cache", result.stderr)
+        self.assertFalse((self.repo / ".git" / fmb.CACHE_FILE).exists())
+
+    def test_eviction(self):
+        """Only the newest CACHE_MAX_ENTRIES fresh entries are kept."""
+        git_dir = str(self.repo / ".git")
+        cache = fmb.ResultCache(git_dir, git_dir)
+        for i in range(fmb.CACHE_MAX_ENTRIES + 5):
+            cache.put(f"key{i}", "origin/main", "test")
+
+        self.assertEqual(len(cache._load()), fmb.CACHE_MAX_ENTRIES)
+        self.assertIsNone(cache.get("key0"))
+        self.assertEqual(
+            cache.get(f"key{fmb.CACHE_MAX_ENTRIES + 4}"), ("origin/main", "test")
+        )
+
+
+
+class TestPrecomputed(GitRepoTestCase):
+    """Test the hooks that precompute the answer for --cached-only."""
+
+    def setUp(self):
+        """Create a feature branch whose base is origin/main."""
+        super().setUp()
+        main = self.run_git("rev-parse", "HEAD")
+        self.add_remote("origin", main=main)
+        self.run_git("checkout", "-b", "feature")
+        self.commit("feature work")
+        self.hooks = self.repo / ".git" / "hooks"
+
+    def wait_for_precompute(self):
+        """Wait until a background --precompute has stored its answer."""
+        result_file = self.repo / ".git" / fmb.PRECOMPUTED_FILE
+        deadline = time.monotonic() + 30
+        while not result_file.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with open(self.repo / ".git" / fmb.PRECOMPUTED_LOCK) as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+    def test_hooks_precompute_on_ref_change(self):
+        """A ref update precomputes the answer, then read without git."""
+        self.run_script("--install-hooks")
+        for name in fmb.HOOK_NAMES:
+            self.assertTrue(os.access(self.hooks / name, os.X_OK), name)
+
+        self.run_git("update-ref", "refs/remotes/origin/topic", "HEAD")
+        self.wait_for_precompute()
+        env = self.git_logging_env()
+        result = self.run_script("--cached-only", env=env)
+
+        self.assertEqual(result.stdout.strip(), "origin/main")
+        self.assertFalse(self.git_log.exists())
+
+    def test_cached_only_for_current_head(self):
+        """An answer precomputed on another branch, for an older commit
+        or before a ref update is not used."""
+        changes = [
+            ("checkout", "main"),
+            ("commit", "--allow-empty", "-m", "more work"),
+            ("update-ref", "refs/remotes/origin/topic", "HEAD"),
+        ]
+        for change in changes:
+            with self.subTest(change=change[0]):
+                self.run_git("checkout", "-q", "feature")
+                self.run_script("--precompute")
+                found = self.run_script("--cached-only").stdout.strip()
+                self.assertEqual(found, "origin/main")
+
+                self.run_git(*change)
+                result = self.run_script("--cached-only", expect_success=False)
+
+                self.assertEqual(result.returncode, 1)
+                self.assertEqual(result.stdout, "")
+
+    def test_existing_hooks_kept(self):
+        """Hooks not installed by the script are neither replaced nor removed."""
+        self.hooks.mkdir(exist_ok=True)
+        own = "#!/bin/sh\necho mine\n"
+        (self.hooks / "post-merge").write_text(own)
+
+        installed = self.run_script("--install-hooks", expect_success=False)
+        self.assertEqual(installed.returncode, 1)
+        self.assertTrue((self.hooks / "post-checkout").exists())
+        self.run_script("--uninstall-hooks", expect_success=False)
+
+        self.assertEqual((self.hooks / "post-merge").read_text(), own)
+        self.assertFalse((self.hooks / "post-checkout").exists())
+
+
+class TestTrace(GitRepoTestCase):
+    """Test --trace output."""
+
+    def setUp(self):
+        """Create a feature branch based on origin/main."""
+        super().setUp()
+        main = self.run_git("rev-parse", "HEAD")
+        self.add_remote("origin", main=main)
+        self.run_git("checkout", "-b", "feature")
+        self.commit("feature work")
+        self.trace = Path(self.test_dir) / "trace"
+
+    def test_jsonl_trace(self):
+        """Every git call is recorded with its cost and what caused it."""
+        plain = self.run_script("--no-cache")
+
+        result = self.run_script("--no-cache", "--trace", str(self.trace))
+
+        self.assertEqual(result.stdout, plain.stdout)
+        events = [json.loads(line) for line in self.trace.read_text().splitlines()]
+        calls = [e for e in events if e["type"] == "git"]
+        self.assertTrue(calls)
+        for call in calls:
+            self.assertEqual(call["argv"][0], "git")
+            self.assertGreaterEqual(call["seconds"], 0)
+            self.assertIn("bytes", call)
+            self.assertIn("status", call)
+        upstream = [c for c in calls if c["strategy"] == "try_upstream"]
+        self.assertEqual(upstream[0]["argv"][1:3], ["rev-parse", "--abbrev-ref"])
+        self.assertNotEqual(upstream[0]["status"], 0)
+        self.assertTrue(
+            [
+                c
+                for c in calls
+                if c["strategy"] == "try_common_default_branches"
+                and c["branch"] == "origin/main"
+            ]
+        )
+        summary = events[-1]
+        self.assertEqual(summary["type"], "summary")
+        self.assertIn("try_common_default_branches", summary)
+        self.assertIn("[trace] try_upstream", result.stderr)
+
+    def test_chrome_trace(self):
+        """The chrome format is a trace-event file of complete events."""
+        self.run_script(
+            "--no-cache", "--trace", str(self.trace), "--trace-format", "chrome"
+        )
+
+        trace = json.loads(self.trace.read_text())
+        self.assertTrue(trace["traceEvents"])
+        for event in trace["traceEvents"]:
+            self.assertEqual(event["ph"], "X")
+            self.assertIn(event["cat"].split(".")[0], ["git", "strategy"])
+        self.assertIn("try_upstream", trace["otherData"])
+
+
+class TestDaemon(GitRepoTestCase):
+    """Test the --serve daemon and the client path that asks it."""
+
+    def setUp(self):
+        """Create a feature branch based on origin/main; start no daemon yet."""
+        super().setUp()
+        main = self.run_git("rev-parse", "HEAD")
+        self.run_git("remote", "add", "origin", f"{self.test_dir}/origin.git")
+        self.run_git("update-ref", "refs/remotes/origin/topic", main)
+        self.run_git("checkout", "-b", "feature")
+        self.commit("feature work")
+        self.socket = self.repo / ".git" / fmb.DAEMON_SOCKET
+        self.daemon = None
+
+    def tearDown(self):
+        if self.daemon:
+            self.daemon.terminate()
+            self.daemon.wait()
+        super().tearDown()
+
+    def start_daemon(self):
+        self.daemon = subprocess.Popen(
+            [str(SCRIPT), "--serve", "--idle-timeout", "60"],
+            cwd=self.repo,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 10
+        while fmb.query_daemon(str(self.repo / ".git")) is None:
+            self.assertLess(time.monotonic(), deadline, "daemon did not start")
+            time.sleep(0.05)
+
+    def test_answers_from_daemon(self):
+        """A running daemon answers, with no git process in the client."""
+        self.start_daemon()
+        shim_dir = Path(self.test_dir) / "shim"
+        shim_dir.mkdir()
+        log = Path(self.test_dir) / "git.log"
+        (shim_dir / "git").write_text(
+            f'#!/bin/sh\necho "$*" >> "{log}"\nexec {shutil.which("git")} "$@"\n'
+        )
+        (shim_dir / "git").chmod(0o755)
+        env = dict(os.environ, PATH=f"{shim_dir}:{os.environ['PATH']}")
+
+        result = self.run_script("--debug", env=env)
+
+        self.assertEqual(result.stdout.strip(), "origin/topic")
+        self.assertIn("Answered by daemon", result.stderr)
+        self.assertIn("Trying closest remote branch", result.stderr)
+        self.assertFalse(log.exists())
+
+    def test_ref_change_recomputes(self):
+        """Updating refs changes the daemon's next answer."""
+        self.start_daemon()
+        self.run_git("update-ref", "refs/remotes/origin/main", "HEAD~1")
+
+        result = self.run_script("--debug")
+
+        self.assertEqual(result.stdout.strip(), "origin/main")
+        self.assertIn("Answered by daemon", result.stderr)
+
+    def test_polling_without_inotify(self):
+        """Without a watcher every query rechecks the repository state."""
+        git_dir = str(self.repo / ".git")
+        daemon = fmb.Daemon(git_dir, git_dir, cwd=str(self.repo))
+        if daemon.watcher:
+            daemon.watcher.close()
+        daemon.watcher = None
+        try:
+            first = daemon.compute()
+            self.run_git("update-ref", "refs/remotes/origin/main", "HEAD~1")
+            second = daemon.compute()
+        finally:
+            daemon.git.close()
+
+        self.assertEqual(first["branch"], "origin/topic")
+        self.assertEqual(second["branch"], "origin/main")
+
+    def test_no_daemon_falls_back(self):
+        """A stale socket file or --no-daemon answers in-process."""
+        self.socket.write_text("")
+
+        result = self.run_script("--debug")
+        self.assertEqual(result.stdout.strip(), "origin/topic")
+        self.assertNotIn("Answered by daemon", result.stderr)
+
+        self.socket.unlink()
+        self.start_daemon()
+        result = self.run_script("--debug", "--no-daemon")
+        self.assertNotIn("Answered by daemon", result.stderr)
+
+    def test_second_daemon_refused(self):
+        """Only one daemon serves a repository."""
+        self.start_daemon()
+
+        result = subprocess.run(
+            [str(SCRIPT), "--serve"], cwd=self.repo, capture_output=True, text=True
+        )
+
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("already listening", result.stderr)
+
+
+class TestBatch(GitRepoTestCase):
+    """Test --batch over several repositories and worktrees."""
+
+    def setUp(self):
+        """Create a repository and a worktree with different bases."""
+        super().setUp()
+        main = self.run_git("rev-parse", "HEAD")
+        self.add_remote("origin", main=main)
+        self.run_git("checkout", "-b", "feature")
+        self.commit("feature work")
+        self.worktree = Path(self.test_dir) / "worktree"
+        self.run_git("worktree", "add", "-b", "other", str(self.worktree), "main")
+        self.run_git("-C", str(self.worktree), "branch", "-u", "origin/main")
+
+    def run_batch(self, *args, **kwargs):
+        result = subprocess.run(
+            [str(SCRIPT), "--batch", *args],
+            capture_output=True,
+            text=True,
+            check=False,
+            cwd=self.test_dir,
+            **kwargs,
+        )
+        results = [json.loads(line) for line in result.stdout.splitlines()]
+        return result.returncode, {r["path"]: r for r in results}
+
+    def test_paths_from_argv(self):
+        """Each repository gets its own line; worktrees resolve separately."""
+        code, results = self.run_batch("-j", "2", str(self.repo), str(self.worktree))
+
+        self.assertEqual(code, 0)
+        self.assertEqual(results[str(self.repo)]["source"], "common default branch")
+        self.assertEqual(results[str(self.worktree)]["source"], "@{upstream}")
+        for result in results.values():
+            self.assertEqual(result["branch"], "origin/main")
+            self.assertGreaterEqual(result["seconds"], 0)
+
+    def test_paths_from_stdin_with_errors(self):
+        """A bad path is reported without stopping the others."""
+        not_repo = Path(self.test_dir) / "plain"
+        not_repo.mkdir()
+        paths = [str(not_repo), str(self.repo), "/nonexistent/repo"]
+
+        code, results = self.run_batch(input="\n".join(paths) + "\n")
+
+        self.assertEqual(code, 1)
+        self.assertEqual(sorted(results), sorted(paths))
+        self.assertEqual(results[str(self.repo)]["branch"], "origin/main")
+        self.assertEqual(results[str(not_repo)]["error"], "not a git repository")
+        self.assertIn("error", results["/nonexistent/repo"])
+
+    def test_options_reach_spawned_workers(self):
+        """Workers started by spawn, not fork, still get --debug."""
+        runner = (
+            "import multiprocessing, runpy, sys\n"
+            "multiprocessing.set_start_method('spawn')\n"
+            "sys.argv = sys.argv[1:]\n"
+            "runpy.run_path(sys.argv[0], run_name='__main__')\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", runner, str(SCRIPT), "--batch", "--debug"]
+            + ["--no-cache", str(self.repo)],
+            capture_output=True,
+            text=True,
+            check=False,
+            cwd=self.test_dir,
+        )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("origin/main", result.stdout)
+        self.assertIn("[debug] Trying common default branches", result.stderr)
+
+
+class TestFetch(GitRepoTestCase):
+    """Test the targeted, concurrent --fetch."""
+
+    def setUp(self):
+        """Create bare origin and fork remotes; track a fork branch."""
+        super().setUp()
+        self.run_git("tag", "v1")
+        for remote in ("origin", "fork"):
+            self.run_git("init", "-q", "--bare", f"{self.test_dir}/{remote}.git")
+        # Push by path so no remote-tracking refs exist before fetching
+        self.run_git("push", "-q", f"{self.test_dir}/origin.git", "main", "v1")
+        fork = f"{self.test_dir}/fork.git"
+        self.run_git("push", "-q", fork, "main:topic", "main:other")
+        self.add_remote("origin")
+        self.add_remote("fork", topic=self.run_git("rev-parse", "main"))
+        self.run_git("checkout", "-q", "-b", "feature", "--track", "fork/topic")
+        self.commit("feature work")
+
+    def fetch(self, *args):
+        """Run --fetch and return its debug output."""
+        result = self.run_script(
+            "--fetch", "--debug", "--no-cache", "--no-daemon", *args
+        )
+        return result.stderr
+
+    def test_fetches_only_needed_refs(self):
+        """Preferred remotes' branches and the upstream branch, no tags."""
+        stderr = self.fetch()
+
+        refs = self.run_git("for-each-ref", "--format=%(refname)").splitlines()
+        self.assertIn("refs/remotes/origin/main", refs)
+        self.assertIn("refs/remotes/fork/topic", refs)
+        self.assertNotIn("refs/remotes/fork/other", refs)
+        self.assertIn("fetched origin in", stderr)
+        self.assertIn("fetched fork in", stderr)
+        self.assertIn("Fetching took", stderr)
+
+        self.run_git("tag", "-d", "v1")
+        self.fetch("--fetch-max-age", "0")
+        self.assertEqual(self.run_git("tag"), "")
+
+    def test_configured_refspec_respected(self):
+        """A preferred remote narrowed to one branch stays narrow."""
+        self.run_git("push", "-q", f"{self.test_dir}/origin.git", "main:extra")
+        self.run_git(
+            "config", "remote.origin.fetch", "+refs/heads/main:refs/remotes/origin/main"
+        )
+
+        self.fetch()
+
+        refs = self.run_git("for-each-ref", "--format=%(refname)", "refs/remotes/")
+        self.assertNotIn("refs/remotes/origin/extra", refs.splitlines())
+        self.assertIn("refs/remotes/origin/main", refs.splitlines())
+
+    def test_recent_fetch_skipped(self):
+        """A fresh FETCH_HEAD skips fetching unless the max age is 0."""
+        self.fetch()
+        self.run_git("push", "-q", f"{self.test_dir}/origin.git", "main:new")
+        listing = ("branch", "-r", "--list", "origin/new")
+
+        self.assertIn("Skipping fetch", self.fetch())
+        self.assertEqual(self.run_git(*listing), "")
+
+        self.fetch("--fetch-max-age", "0")
+        self.assertEqual(self.run_git(*listing), "origin/new")
+
+    def test_failed_fetch_not_skipped(self):
+        """A fetch that fails leaves FETCH_HEAD as old as it was."""
+        self.fetch()
+        fetch_head = self.repo / ".git" / "FETCH_HEAD"
+        old = time.time() - 3600
+        os.utime(fetch_head, (old, old))
+        content = fetch_head.read_text()
+        for remote in ("origin", "fork"):
+            self.run_git("remote", "set-url", remote, f"{self.test_dir}/gone.git")
+
+        self.assertIn("failed to fetch origin", self.fetch())
+
+        self.assertEqual(fetch_head.stat().st_mtime, old)
+        self.assertEqual(fetch_head.read_text(), content)
+        self.assertNotIn("Skipping fetch", self.fetch())
+
+
+class TestBenchmark(unittest.TestCase):
+    """Test the benchmark harness on a small synthetic repository."""
+
+    def setUp(self):
+        spec = importlib.util.spec_from_file_location(
+            "bench_find_merge_base", Path(__file__).parent / "bench_find_merge_base.py"
+        )
+        self.bench = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.bench)
+        self.test_dir = tempfile.mkdtemp(prefix="find-merge-base-bench-test-")
+        self.baseline = Path(self.test_dir) / "baseline.json"
+        self.args = ["--commits", "120", "--branches", "20", "--repeat", "1"]
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def run_bench(self, *args):
+        report = Path(self.test_dir) / "report.json"
+        code = self.bench.main([*self.args, "--report", str(report), *args])
+        return code, json.loads(report.read_text())
+
+    def test_report_and_baseline(self):
+        """The report finds the expected base; an equal rerun passes."""
+        code, report = self.run_bench("--save-baseline", str(self.baseline))
+
+        self.assertEqual(code, 0)
+        results = report["results"]
+        self.assertEqual(results["find_base_branch"]["result"], report["expected_base"])
+        self.assertEqual(results["script"]["result"], report["expected_base"])
+        self.assertGreater(results["script"]["git_processes"], 0)
+        code, _ = self.run_bench("--baseline", str(self.baseline), "--tolerance", "100")
+        self.assertEqual(code, 0)
+
+    def test_process_count_regression_fails(self):
+        """Spawning more git processes than the baseline fails the run."""
+        _, report = self.run_bench()
+        report["results"]["find_base_branch"]["git_processes"] = 0
+        self.baseline.write_text(json.dumps(report))
+
+        code, _ = self.run_bench("--baseline", str(self.baseline), "--tolerance", "100")
+
+        self.assertEqual(code, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()